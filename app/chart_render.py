@@ -0,0 +1,40 @@
+"""Рендеринг графиков в дочерних процессах.
+
+Модуль намеренно не импортирует aiogram/SQLAlchemy: его загружает каждый
+процесс пула, и чем он легче, тем быстрее стартует воркер.
+"""
+from __future__ import annotations
+
+import io
+from datetime import date
+
+
+def render_progress_chart(points: list[tuple[date, int, float]]) -> bytes:
+    """PNG с двумя линиями: стаж (дни) и экономия (₽) по датам."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.dates as mdates
+    import matplotlib.pyplot as plt
+
+    days_axis = [day for day, _, _ in points]
+    fig, ax_days = plt.subplots(figsize=(8, 4.5), dpi=100)
+    try:
+        ax_days.plot(days_axis, [days for _, days, _ in points], color="tab:green", marker="o", markersize=3, label="Стаж, дн.")
+        ax_days.set_ylabel("Стаж, дн.", color="tab:green")
+        ax_days.xaxis.set_major_formatter(mdates.DateFormatter("%d.%m"))
+        ax_days.grid(alpha=0.3)
+
+        ax_saved = ax_days.twinx()
+        ax_saved.plot(days_axis, [saved for _, _, saved in points], color="tab:blue", label="Экономия, ₽")
+        ax_saved.set_ylabel("Экономия, ₽", color="tab:blue")
+
+        ax_days.set_title("Мой прогресс")
+        fig.autofmt_xdate()
+        fig.tight_layout()
+
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png")
+        return buf.getvalue()
+    finally:
+        plt.close(fig)
@@ -1,4 +1,5 @@
 from functools import lru_cache
+from typing import Literal
 
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -8,16 +9,70 @@ class Settings(BaseSettings):
     bot_token: str = Field(alias="BOT_TOKEN")
     database_url: str = Field(alias="DATABASE_URL")
 
+    # Основная группа; остальные группы регистрируются автоматически, когда бота в них добавляют
     group_chat_id: int = Field(alias="GROUP_CHAT_ID")
+    # Сколько групп ежедневные задачи обрабатывают параллельно
+    group_fanout_concurrency: int = Field(default=4, alias="GROUP_FANOUT_CONCURRENCY")
 
     tz: str = Field(default="Europe/Moscow", alias="TZ")
     daily_post_hour: int = Field(default=9, alias="DAILY_POST_HOUR")
     daily_post_minute: int = Field(default=0, alias="DAILY_POST_MINUTE")
+    # Напоминания без выбранного времени распределяются по окну после ежедневного пересчёта
+    notify_spread_minutes: int = Field(default=60, alias="NOTIFY_SPREAD_MINUTES")
+    # Пропущенное (например, из-за простоя) напоминание старше этого не отправляется
+    notify_grace_minutes: int = Field(default=360, alias="NOTIFY_GRACE_MINUTES")
 
     owner_user_id: int = Field(alias="OWNER_USER_ID")
 
     callback_secret: str = Field(alias="CALLBACK_SECRET")
 
+    # Хранилище состояния мастера регистрации: memory | postgres
+    reg_state_backend: Literal["memory", "postgres"] = Field(default="memory", alias="REG_STATE_BACKEND")
+    reg_state_ttl_seconds: int = Field(default=3600, alias="REG_STATE_TTL_SECONDS")
+    reg_state_max_entries: int = Field(default=10000, alias="REG_STATE_MAX_ENTRIES")
+
+    # Выбор ведущей реплики: задачи планировщика выполняет только владелец advisory lock
+    scheduler_lock_id: int = Field(default=7_270_001, alias="SCHEDULER_LOCK_ID")
+    leader_heartbeat_seconds: float = Field(default=10.0, alias="LEADER_HEARTBEAT_SECONDS")
+
+    # Обновление тайтлов делится на шарды по user_id, их забирают воркеры всех процессов
+    daily_shards: int = Field(default=8, alias="DAILY_SHARDS")
+    shard_lease_seconds: int = Field(default=120, alias="SHARD_LEASE_SECONDS")
+
+    # Уведомления о смене места в рейтинге: вход/выход из ТОП‑N и подъём минимум на N мест
+    rank_notify_top: int = Field(default=10, alias="RANK_NOTIFY_TOP")
+    rank_notify_min_climb: int = Field(default=5, alias="RANK_NOTIFY_MIN_CLIMB")
+
+    # Кэш профилей пользователей в памяти процесса (навигация по меню без запросов к БД)
+    profile_cache_ttl_seconds: int = Field(default=300, alias="PROFILE_CACHE_TTL_SECONDS")
+    profile_cache_max_entries: int = Field(default=10000, alias="PROFILE_CACHE_MAX_ENTRIES")
+
+    # Шина инвалидации кэшей между процессами (LISTEN/NOTIFY)
+    cache_bus_enabled: bool = Field(default=True, alias="CACHE_BUS_ENABLED")
+    cache_bus_heartbeat_seconds: float = Field(default=10.0, alias="CACHE_BUS_HEARTBEAT_SECONDS")
+
+    # Антифлуд кнопок: нажатий в секунду на пользователя по семействам callback_data (первый сегмент)
+    throttle_rates: dict[str, float] = Field(
+        default_factory=lambda: {"default": 3.0, "add_relapse": 0.5, "rating": 1.0, "stats": 1.0},
+        alias="THROTTLE_RATES",
+    )
+
+    # Write-behind рецидивов: нажатия копятся в памяти и пишутся пачкой раз в RELAPSE_FLUSH_SECONDS
+    relapse_write_behind: bool = Field(default=False, alias="RELAPSE_WRITE_BEHIND")
+    relapse_flush_seconds: float = Field(default=2.0, alias="RELAPSE_FLUSH_SECONDS")
+
+    # Процессы для рендеринга графиков прогресса (matplotlib)
+    chart_render_workers: int = Field(default=2, alias="CHART_RENDER_WORKERS")
+
+    # Доставка исходящих сообщений через таблицу outbox
+    outbox_workers: int = Field(default=4, alias="OUTBOX_WORKERS")
+    outbox_batch_size: int = Field(default=20, alias="OUTBOX_BATCH_SIZE")
+    outbox_max_attempts: int = Field(default=8, alias="OUTBOX_MAX_ATTEMPTS")
+
+    log_level: str = Field(default="INFO", alias="LOG_LEVEL")
+    # Доля записываемых частых событий горячих путей (нажатия кнопок и т.п.)
+    log_sample_rate: float = Field(default=0.1, alias="LOG_SAMPLE_RATE")
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
@@ -1,16 +1,88 @@
 from __future__ import annotations
 
-from sqlalchemy.ext.asyncio import AsyncEngine
+import hashlib
 
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+from sqlalchemy.schema import CreateIndex, CreateTable
 
-async def ensure_schema(engine: AsyncEngine) -> None:
+from app.db.models import AppMeta, Base
+from app.db.repo import GroupMemberRepo, GroupRepo
+
+SCHEMA_FINGERPRINT_KEY = "schema_fingerprint"
+
+# create_all не добавляет колонки в уже существующие таблицы,
+# поэтому новые поля докатываем идемпотентными ALTER-ами (MVP, без Alembic).
+SCHEMA_PATCHES: tuple[str, ...] = (
+    "ALTER TABLE top_posts ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS deliverability VARCHAR(16) NOT NULL DEFAULT 'ok'",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS undeliverable_since TIMESTAMPTZ",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS notify_time TIME",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS notify_tz VARCHAR(64)",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS next_notify_at TIMESTAMPTZ",
+    "CREATE INDEX IF NOT EXISTS ix_users_next_notify_at ON users (next_notify_at) WHERE notifications",
+    "CREATE INDEX IF NOT EXISTS ix_users_quit_date ON users (quit_date)",
+    # Снимки мест теперь по группам (group_rank_snapshots); общие снимки хранились неделю и не нужны
+    "DROP TABLE IF EXISTS rank_snapshots",
+    # Вехи, пройденные до появления колонки, считаем отмеченными — иначе первый запуск
+    # поздравил бы всех со стажем больше 30 дней. Выполняется только при создании колонки.
+    "DO $$ BEGIN "
+    "IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'users' AND column_name = 'milestone_notified') THEN "
+    "ALTER TABLE users ADD COLUMN milestone_notified INTEGER NOT NULL DEFAULT 0; "
+    "UPDATE users SET milestone_notified = CASE "
+    "WHEN quit_date < CURRENT_DATE - 365 THEN 365 WHEN quit_date < CURRENT_DATE - 100 THEN 100 "
+    "WHEN quit_date < CURRENT_DATE - 30 THEN 30 ELSE 0 END; "
+    "END IF; END $$",
+)
+
+
+def schema_fingerprint() -> str:
+    """sha256 от DDL всех таблиц/индексов моделей и патчей схемы."""
+    dialect = postgresql.dialect()
+    digest = hashlib.sha256()
+    for table in Base.metadata.sorted_tables:
+        digest.update(str(CreateTable(table).compile(dialect=dialect)).encode("utf-8"))
+        for index in sorted(table.indexes, key=lambda i: i.name or ""):
+            digest.update(str(CreateIndex(index).compile(dialect=dialect)).encode("utf-8"))
+    for statement in SCHEMA_PATCHES:
+        digest.update(statement.encode("utf-8"))
+    return digest.hexdigest()
+
+
+async def ensure_schema(engine: AsyncEngine) -> bool:
+    """Приводит схему к моделям, если она изменилась с прошлого запуска.
+
+    Возвращает True, если выполнялся DDL. При совпадении отпечатка старт стоит
+    проверки одной таблицы app_meta и одного SELECT вместо create_all с проверкой
+    каждой таблицы.
+    """
+    fingerprint = schema_fingerprint()
     async with engine.begin() as conn:
-        await conn.exec_driver_sql(
-            """
-            CREATE TABLE IF NOT EXISTS top_posts (
-                chat_id BIGINT PRIMARY KEY,
-                message_id INTEGER NOT NULL,
-                updated_at TIMESTAMP NOT NULL DEFAULT NOW()
-            )
-            """
+        await conn.run_sync(lambda sync_conn: AppMeta.__table__.create(sync_conn, checkfirst=True))
+        stored = await conn.scalar(
+            text("SELECT value FROM app_meta WHERE key = :key"), {"key": SCHEMA_FINGERPRINT_KEY}
+        )
+        if stored == fingerprint:
+            return False
+
+        await conn.run_sync(Base.metadata.create_all)
+        for statement in SCHEMA_PATCHES:
+            await conn.exec_driver_sql(statement)
+        await conn.execute(
+            text(
+                "INSERT INTO app_meta (key, value, updated_at) VALUES (:key, :value, NOW()) "
+                "ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at"
+            ),
+            {"key": SCHEMA_FINGERPRINT_KEY, "value": fingerprint},
         )
+    return True
+
+
+async def ensure_primary_group(session_factory: async_sessionmaker[AsyncSession], chat_id: int) -> None:
+    """Регистрирует основную группу из настроек; при первом запуске переносит в неё участников."""
+    async with session_factory() as session:
+        created = await GroupRepo(session).upsert(chat_id)
+        if created:
+            await GroupMemberRepo(session).backfill_from_users(chat_id)
+        await session.commit()
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import socket
+from typing import Any, Callable, Optional
+
+import structlog
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session
+
+# Получает id изменённых пользователей; None — изменились все (пакетный пересчёт)
+UsersChangedListener = Callable[[Optional[set[int]]], None]
+LeaderboardChangedListener = Callable[[], None]
+
+_USERS = "changed_user_ids"
+_LEADERBOARD = "leaderboard_changed"
+# Больше id в одном коммите — отправляем «изменились все», а не десятки уведомлений
+_MAX_IDS = 2000
+# Лимит payload у NOTIFY — 8000 байт, id укладываются с запасом
+_IDS_PER_NOTIFY = 300
+
+_user_listeners: list[UsersChangedListener] = []
+_leaderboard_listeners: list[LeaderboardChangedListener] = []
+# Канал шины; None — шина не запущена и коммиты ничего не публикуют
+_channel: Optional[str] = None
+_origin = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def on_users_changed(listener: UsersChangedListener) -> None:
+    """Подписка кэшей на изменения пользователей и их метрик после коммита."""
+    _user_listeners.append(listener)
+
+
+def off_users_changed(listener: UsersChangedListener) -> None:
+    """Отписка: кэш, который больше не используется, не должен держаться в списке подписчиков."""
+    if listener in _user_listeners:
+        _user_listeners.remove(listener)
+
+
+def on_leaderboard_changed(listener: LeaderboardChangedListener) -> None:
+    """Подписка кэшей рейтинга: метрики, имена или членство изменились."""
+    _leaderboard_listeners.append(listener)
+
+
+def mark_user_changed(session: AsyncSession, user_id: int) -> None:
+    """Репозиторий изменил пользователя: подписчики узнают об этом после коммита сессии."""
+    pending = session.info.setdefault(_USERS, set())
+    if pending is not None:
+        pending.add(user_id)
+
+
+def mark_all_users_changed(session: AsyncSession) -> None:
+    session.info[_USERS] = None
+
+
+def mark_leaderboard_changed(session: AsyncSession) -> None:
+    session.info[_LEADERBOARD] = True
+
+
+def _notify(users: Optional[set[int]], users_changed: bool, leaderboard_changed: bool) -> None:
+    listeners: list[Callable[[], None]] = []
+    if users_changed:
+        listeners += [lambda listener=listener: listener(users) for listener in _user_listeners]
+    if leaderboard_changed:
+        listeners += _leaderboard_listeners
+    for listener in listeners:
+        try:
+            listener()
+        except Exception as e:  # noqa: BLE001
+            structlog.get_logger().warning("cache_invalidation_listener_failed", error=str(e))
+
+
+def flush_all() -> None:
+    """Сброс всех подписанных кэшей целиком."""
+    _notify(None, True, True)
+
+
+def _payloads(info: dict[str, Any]) -> list[str]:
+    leaderboard = bool(info.get(_LEADERBOARD))
+    if _USERS not in info:
+        return [json.dumps({"o": _origin, "l": leaderboard})]
+    users = info[_USERS]
+    if users is None or len(users) > _MAX_IDS:
+        return [json.dumps({"o": _origin, "u": "*", "l": leaderboard})]
+    ids = sorted(users)
+    return [
+        json.dumps({"o": _origin, "u": ids[start:start + _IDS_PER_NOTIFY], "l": leaderboard and start == 0})
+        for start in range(0, len(ids), _IDS_PER_NOTIFY)
+    ]
+
+
+@event.listens_for(Session, "before_commit")
+def _before_commit(session: Session) -> None:
+    # NOTIFY транзакционный: другие процессы получат его только вместе с коммитом
+    if _channel is None or (_USERS not in session.info and _LEADERBOARD not in session.info):
+        return
+    for payload in _payloads(session.info):
+        session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": _channel, "payload": payload})
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session: Session) -> None:
+    if _USERS in session.info or _LEADERBOARD in session.info:
+        users_changed = _USERS in session.info
+        _notify(session.info.pop(_USERS, None), users_changed, bool(session.info.pop(_LEADERBOARD, False)))
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session: Session) -> None:
+    # Откаченные изменения в БД не попали — кэши остаются как есть
+    session.info.pop(_USERS, None)
+    session.info.pop(_LEADERBOARD, None)
+
+
+class InvalidationBus:
+    """Шина инвалидации кэшей между процессами на LISTEN/NOTIFY Postgres.
+
+    Коммиты с изменениями пользователей или рейтинга публикуют уведомление в
+    канал, каждый процесс слушает его на выделенном соединении и сбрасывает
+    у себя соответствующие записи. Пока соединения нет, уведомления теряются,
+    поэтому после переподключения все кэши сбрасываются целиком.
+    """
+
+    def __init__(self, engine: AsyncEngine, channel: str = "cache_invalidation", interval: float = 10.0) -> None:
+        self.engine = engine
+        self.channel = channel
+        self.interval = interval
+        self._conn: AsyncConnection | None = None
+        self._task: asyncio.Task[None] | None = None
+        self._connected_once = False
+        self.log = structlog.get_logger()
+
+    def start(self) -> None:
+        global _channel
+        _channel = self.channel
+        self._task = asyncio.create_task(self._run(), name="invalidation-bus")
+
+    async def stop(self) -> None:
+        global _channel
+        _channel = None
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._close()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # noqa: BLE001
+                self.log.warning("invalidation_bus_disconnected", channel=self.channel, error=str(e))
+            await self._close()
+            await asyncio.sleep(self.interval)
+
+    async def _listen(self) -> None:
+        conn = await self.engine.connect()
+        self._conn = conn
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        raw = (await conn.get_raw_connection()).driver_connection
+        await raw.add_listener(self.channel, self._on_notification)
+        if self._connected_once:
+            # Уведомления за время разрыва потеряны — не знаем, что устарело
+            self.log.info("invalidation_bus_reconnected", channel=self.channel)
+            flush_all()
+        self._connected_once = True
+
+        while True:
+            await asyncio.sleep(self.interval)
+            await asyncio.wait_for(raw.fetchval("SELECT 1"), timeout=self.interval)
+
+    def _on_notification(self, connection: Any, pid: int, channel: str, payload: str) -> None:
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            self.log.warning("invalidation_bus_bad_payload", payload=payload[:100])
+            flush_all()
+            return
+        if message.get("o") == _origin:
+            # Свои коммиты уже обработаны в after_commit
+            return
+        users = message.get("u")
+        if users is None:
+            _notify(None, False, bool(message.get("l")))
+        else:
+            _notify(None if users == "*" else set(users), True, bool(message.get("l")))
+
+    async def _close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                await conn.invalidate()
+                await conn.close()
+            except Exception:  # noqa: BLE001
+                pass
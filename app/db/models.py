@@ -1,8 +1,9 @@
 from __future__ import annotations
 
-from datetime import date, datetime, timezone
+from datetime import date, datetime, time, timezone
 
-from sqlalchemy import BigInteger, Boolean, Date, DateTime, ForeignKey, Integer, Numeric, String, UniqueConstraint
+from sqlalchemy import BigInteger, Boolean, Date, DateTime, ForeignKey, Index, Integer, Numeric, String, Text, Time, UniqueConstraint, text
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
 
@@ -23,12 +24,29 @@ class User(Base):
     is_member: Mapped[bool] = mapped_column(Boolean, default=True, server_default="true")
     is_admin_promoted: Mapped[bool] = mapped_column(Boolean, default=False, server_default="false")
     notifications: Mapped[bool] = mapped_column(Boolean, default=False, server_default="false")
+    # None — время/таймзона по умолчанию (см. NotifySchedule)
+    notify_time: Mapped[time | None] = mapped_column(Time, nullable=True)
+    notify_tz: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    next_notify_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    # Последняя веха стажа (дней), с которой поздравили при текущей quit_date; 0 — ещё ни с какой
+    milestone_notified: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+
+    # ok | blocked | deactivated | not_found — результат последней доставки в ЛС
+    deliverability: Mapped[str] = mapped_column(String(16), default="ok", server_default="ok")
+    undeliverable_since: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
 
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     updated_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc)
     )
 
+    __table_args__ = (
+        # Выборка пользователей, которым пора отправить напоминание (тик раз в минуту)
+        Index("ix_users_next_notify_at", "next_notify_at", postgresql_where=text("notifications")),
+        # Поиск тех, кто достиг вехи стажа (quit_date <= сегодня − N)
+        Index("ix_users_quit_date", "quit_date"),
+    )
+
 
 class Metrics(Base):
     __tablename__ = "metrics"
@@ -40,6 +58,95 @@ class Metrics(Base):
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
 
 
+class MetricsHistory(Base):
+    """Дневные снимки метрик: одна строка на пользователя и месяц.
+
+    Элемент массива с индексом N (с 1) — значение за N-е число месяца, NULL —
+    снимка за день нет. Экономия хранится в копейках.
+    """
+
+    __tablename__ = "metrics_history"
+
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    month: Mapped[date] = mapped_column(Date, primary_key=True)  # первое число месяца
+    days: Mapped[list[int | None]] = mapped_column(ARRAY(Integer), default=list)
+    saved_cents: Mapped[list[int | None]] = mapped_column(ARRAY(BigInteger), default=list)
+    relapses: Mapped[list[int | None]] = mapped_column(ARRAY(Integer), default=list)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+
+class PriceHistory(Base):
+    """История цены пачки и расхода; saved_before — экономия, накопленная к effective_from."""
+
+    __tablename__ = "price_history"
+
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    effective_from: Mapped[date] = mapped_column(Date, primary_key=True)
+    pack_price: Mapped[float] = mapped_column(Numeric(10, 2))
+    packs_per_day: Mapped[float] = mapped_column(Numeric(4, 2), default=1, server_default="1")
+    saved_before: Mapped[float] = mapped_column(Numeric(14, 2), default=0, server_default="0")
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+
+class RelapseEvent(Base):
+    """Сырой журнал рецидивов; рейтинги читают не его, а дневные агрегаты relapse_daily."""
+
+    __tablename__ = "relapse_events"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(BigInteger)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        Index("ix_relapse_events_user_id_created_at", "user_id", "created_at"),
+    )
+
+
+class RelapseDaily(Base):
+    """Число рецидивов пользователя за локальный день; обновляется инкрементально вместе с событием."""
+
+    __tablename__ = "relapse_daily"
+
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+
+    __table_args__ = (
+        Index("ix_relapse_daily_day", "day"),
+    )
+
+
+class Group(Base):
+    """Группа, которую обслуживает бот (одна инсталляция — много групп)."""
+
+    __tablename__ = "groups"
+
+    chat_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    title: Mapped[str | None] = mapped_column(String(256), nullable=True)
+    is_active: Mapped[bool] = mapped_column(Boolean, default=True, server_default="true")
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc)
+    )
+
+
+class GroupMember(Base):
+    """Членство пользователя в группе; PK (chat_id, user_id) — индекс для выборок по группе."""
+
+    __tablename__ = "group_members"
+
+    chat_id: Mapped[int] = mapped_column(ForeignKey("groups.chat_id", ondelete="CASCADE"), primary_key=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    is_member: Mapped[bool] = mapped_column(Boolean, default=True, server_default="true")
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc)
+    )
+
+    __table_args__ = (
+        Index("ix_group_members_user_id", "user_id"),
+    )
+
+
 class Audit(Base):
     __tablename__ = "audit"
 
@@ -57,8 +164,126 @@ class TopPost(Base):
     chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
     topic_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
     message_id: Mapped[int] = mapped_column(Integer)
+    # sha256 текста опубликованного поста — чтобы не редактировать без изменений
+    content_hash: Mapped[str | None] = mapped_column(String(64), nullable=True)
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
     __table_args__ = (
         UniqueConstraint('chat_id', 'topic_id', name='uq_top_post_chat_topic'),
     )
+
+
+class RegistrationState(Base):
+    """Состояние мастера регистрации (Postgres-бэкенд хранилища)."""
+
+    __tablename__ = "registration_state"
+
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    # None — пользователь начал мастер, но дату ещё не выбрал
+    quit_date: Mapped[date | None] = mapped_column(Date, nullable=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+
+    __table_args__ = (
+        Index("ix_registration_state_expires_at", "expires_at"),
+    )
+
+
+class AppMeta(Base):
+    """Служебные ключ-значение: отпечатки схемы и команд бота для быстрого старта."""
+
+    __tablename__ = "app_meta"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    value: Mapped[str] = mapped_column(String(128))
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+
+class OutboxMessage(Base):
+    """Исходящее сообщение: пишется в одной транзакции с бизнес-изменением, доставляется воркерами."""
+
+    __tablename__ = "outbox"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    # Ключ идемпотентности: повторная постановка того же сообщения игнорируется
+    idempotency_key: Mapped[str] = mapped_column(String(128), unique=True)
+    kind: Mapped[str] = mapped_column(String(32))  # message | top_post
+    chat_id: Mapped[int] = mapped_column(BigInteger)
+    payload_json: Mapped[str] = mapped_column(Text)
+    status: Mapped[str] = mapped_column(String(16), default="pending", server_default="pending")  # pending | sent | dead
+    attempts: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    # Аренда воркера: пока не истекла, сообщение не выдаётся другим воркерам
+    locked_until: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    last_error: Mapped[str | None] = mapped_column(String(512), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    sent_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_outbox_pending_due", "next_attempt_at", postgresql_where=text("status = 'pending'")),
+    )
+
+
+class JobRun(Base):
+    """Запуск стадии конвейера задач: статус и длительность для наблюдения и докатки после простоя."""
+
+    __tablename__ = "job_runs"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    pipeline: Mapped[str] = mapped_column(String(64))
+    run_key: Mapped[str] = mapped_column(String(32))  # например, локальная дата ежедневного запуска
+    stage: Mapped[str] = mapped_column(String(64))
+    status: Mapped[str] = mapped_column(String(16))  # ok | failed | skipped
+    started_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    duration_ms: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+
+    __table_args__ = (
+        Index("ix_job_runs_pipeline_run_key", "pipeline", "run_key"),
+    )
+
+
+class JobShard(Base):
+    """Шард распределённой задачи: любой процесс забирает его под аренду (SKIP LOCKED)."""
+
+    __tablename__ = "job_shards"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    job: Mapped[str] = mapped_column(String(64))
+    run_key: Mapped[str] = mapped_column(String(32))
+    shard_no: Mapped[int] = mapped_column(Integer)
+    shard_count: Mapped[int] = mapped_column(Integer)
+    status: Mapped[str] = mapped_column(String(16), default="pending", server_default="pending")  # pending | running | done | failed
+    attempts: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    worker: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    locked_until: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    started_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("job", "run_key", "shard_no", name="uq_job_shards_job_run_shard"),
+        Index("ix_job_shards_claimable", "id", postgresql_where=text("status IN ('pending', 'running')")),
+    )
+
+
+class RankSnapshot(Base):
+    """Место участника в рейтинге группы на день; сравнение со вчерашним даёт уведомления о смене места."""
+
+    __tablename__ = "group_rank_snapshots"
+
+    chat_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    rank: Mapped[int] = mapped_column(Integer)
+
+
+class ChartCache(Base):
+    """file_id уже загруженного в Telegram графика: график рендерится не чаще раза в день на пользователя."""
+
+    __tablename__ = "chart_cache"
+
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    file_id: Mapped[str] = mapped_column(String(256))
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
@@ -1,12 +1,19 @@
 from __future__ import annotations
 
-from datetime import date, datetime, timezone
-from typing import Iterable, Optional
+import json
+import logging
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Iterable, Optional
 
-from sqlalchemy import Select, desc, select, update
+from sqlalchemy import Select, case, delete, desc, func, or_, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.models import Audit, Metrics, TopPost, User
+from app.db.invalidation import mark_all_users_changed, mark_leaderboard_changed, mark_user_changed
+from app.db.models import AppMeta, Audit, ChartCache, Group, GroupMember, JobRun, JobShard, Metrics, MetricsHistory, OutboxMessage, PriceHistory, RankSnapshot, RegistrationState, RelapseDaily, RelapseEvent, TopPost, User
+from app.domain.services import PricePoint
+
+logger = logging.getLogger(__name__)
 
 
 class UserRepo:
@@ -16,13 +23,50 @@ class UserRepo:
     async def get_by_id(self, user_id: int) -> Optional[User]:
         return await self.session.get(User, user_id)
 
-    async def list_all_members(self) -> list[User]:
+    async def get_with_metrics(self, user_id: int) -> Optional[tuple[User, Optional[Metrics]]]:
+        """Пользователь и его метрики одним запросом (для кэша профилей)."""
+        row = (
+            await self.session.execute(
+                select(User, Metrics).outerjoin(Metrics, Metrics.user_id == User.user_id).where(User.user_id == user_id)
+            )
+        ).first()
+        return None if row is None else (row[0], row[1])
+
+    async def list_all_members(self, reachable_only: bool = False) -> list[User]:
         stmt = select(User).where(User.is_member.is_(True))
+        if reachable_only:
+            stmt = stmt.where(User.deliverability == "ok")
+        rows = await self.session.execute(stmt)
+        return list(rows.scalars().all())
+
+    async def list_due_milestones(self, today: date, milestones: Iterable[int]) -> list[User]:
+        """Доступные участники, достигшие к today вехи, с которой их ещё не поздравляли.
+
+        Условие по каждой вехе — диапазон quit_date <= today − N (индекс ix_users_quit_date)
+        и milestone_notified < N, поэтому пропущенный день (простой, упавший конвейер)
+        догоняется при следующем запуске.
+        """
+        due = [(User.quit_date <= today - timedelta(days=days)) & (User.milestone_notified < days) for days in milestones]
+        if not due:
+            return []
+        stmt = select(User).where(or_(*due), User.is_member.is_(True), User.deliverability == "ok")
         rows = await self.session.execute(stmt)
         return list(rows.scalars().all())
 
+    async def mark_milestones(self, notified: dict[int, int]) -> None:
+        """Запоминает {user_id: веха}, с которой поздравили; по одному UPDATE на веху."""
+        by_days: dict[int, list[int]] = {}
+        for user_id, days in notified.items():
+            by_days.setdefault(days, []).append(user_id)
+        for days, user_ids in by_days.items():
+            await self.session.execute(
+                update(User)
+                .where(User.user_id.in_(user_ids), User.milestone_notified < days)
+                .values(milestone_notified=days)
+            )
+
     async def list_with_notifications(self) -> list[User]:
-        stmt = select(User).where(User.notifications.is_(True))
+        stmt = select(User).where(User.notifications.is_(True), User.deliverability == "ok")
         rows = await self.session.execute(stmt)
         return list(rows.scalars().all())
 
@@ -60,6 +104,9 @@ class UserRepo:
                 user.username = username
             if full_name is not None:
                 user.full_name = full_name
+            if user.quit_date != quit_date:
+                # Новая дата отказа — вехи считаются заново
+                user.milestone_notified = 0
             user.quit_date = quit_date
             user.pack_price = pack_price
             if is_member is not None:
@@ -67,12 +114,66 @@ class UserRepo:
             user.updated_at = now
 
         await self.session.flush()
+        mark_user_changed(self.session, user_id)
+        mark_leaderboard_changed(self.session)
         return user
 
-    async def set_notifications(self, user_id: int, enabled: bool) -> None:
+    async def set_notifications(self, user_id: int, enabled: bool, next_notify_at: Optional[datetime] = None) -> None:
+        await self.session.execute(
+            update(User)
+            .where(User.user_id == user_id)
+            .values(notifications=enabled, next_notify_at=next_notify_at, updated_at=datetime.now(timezone.utc))
+        )
+        mark_user_changed(self.session, user_id)
+
+    async def set_notify_schedule(
+        self, user_id: int, notify_time: Optional[time], notify_tz: Optional[str], next_notify_at: Optional[datetime]
+    ) -> None:
         await self.session.execute(
-            update(User).where(User.user_id == user_id).values(notifications=enabled, updated_at=datetime.now(timezone.utc))
+            update(User)
+            .where(User.user_id == user_id)
+            .values(
+                notify_time=notify_time,
+                notify_tz=notify_tz,
+                next_notify_at=next_notify_at,
+                updated_at=datetime.now(timezone.utc),
+            )
         )
+        mark_user_changed(self.session, user_id)
+
+    async def claim_due_notifications(self, now: datetime, limit: int) -> list[User]:
+        """Пользователи, которым пора напомнить (или ещё не рассчитано время), по индексу next_notify_at.
+
+        Строки блокируются до коммита (SKIP LOCKED), поэтому параллельные тики
+        не выдадут одного пользователя дважды.
+        """
+        stmt = (
+            select(User)
+            .where(
+                # Голая колонка, а не IS true — так планировщик сопоставит частичный индекс
+                User.notifications,
+                User.deliverability == "ok",
+                (User.next_notify_at <= now) | User.next_notify_at.is_(None),
+            )
+            .order_by(User.next_notify_at.asc().nulls_first())
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        rows = await self.session.execute(stmt)
+        return list(rows.scalars().all())
+
+    async def set_next_notify_many(self, schedule: list[tuple[int, datetime]]) -> None:
+        if schedule:
+            await self.session.execute(
+                update(User),
+                [{"user_id": user_id, "next_notify_at": next_at} for user_id, next_at in schedule],
+            )
+
+    async def set_pack_price(self, user_id: int, pack_price: float) -> None:
+        await self.session.execute(
+            update(User).where(User.user_id == user_id).values(pack_price=pack_price, updated_at=datetime.now(timezone.utc))
+        )
+        mark_user_changed(self.session, user_id)
 
     async def set_admin_promoted(self, user_id: int, promoted: bool) -> None:
         await self.session.execute(
@@ -83,6 +184,30 @@ class UserRepo:
         await self.session.execute(
             update(User).where(User.user_id == user_id).values(is_member=is_member, updated_at=datetime.now(timezone.utc))
         )
+        mark_user_changed(self.session, user_id)
+        mark_leaderboard_changed(self.session)
+
+    async def mark_undeliverable(self, user_id: int, state: str) -> None:
+        """Запоминает, что ЛС недоступен; время фиксируется при первом сбое."""
+        now = datetime.now(timezone.utc)
+        await self.session.execute(
+            update(User)
+            .where(User.user_id == user_id)
+            .values(
+                deliverability=state,
+                undeliverable_since=func.coalesce(User.undeliverable_since, now),
+                updated_at=now,
+            )
+        )
+
+    async def mark_reachable(self, user_id: int) -> bool:
+        """Возвращает пользователя в рассылки. Пишет в БД, только если он был недоступен."""
+        result = await self.session.execute(
+            update(User)
+            .where(User.user_id == user_id, User.deliverability != "ok")
+            .values(deliverability="ok", undeliverable_since=None, updated_at=datetime.now(timezone.utc))
+        )
+        return result.rowcount > 0
 
     async def delete_user_data(self, user_id: int) -> None:
         """Удаляет все данные пользователя из БД"""
@@ -96,6 +221,15 @@ class UserRepo:
         if user:
             await self.session.delete(user)
         
+        # Удаляем историю метрик и кэш графиков
+        await self.session.execute(delete(ChartCache).where(ChartCache.user_id == user_id))
+        await self.session.execute(delete(MetricsHistory).where(MetricsHistory.user_id == user_id))
+        await self.session.execute(delete(PriceHistory).where(PriceHistory.user_id == user_id))
+
+        # Удаляем журнал и дневные агрегаты рецидивов
+        await self.session.execute(delete(RelapseEvent).where(RelapseEvent.user_id == user_id))
+        await self.session.execute(delete(RelapseDaily).where(RelapseDaily.user_id == user_id))
+
         # Удаляем записи аудита
         result = await self.session.execute(
             select(Audit).where(Audit.user_id == user_id)
@@ -104,6 +238,9 @@ class UserRepo:
         for audit_record in audit_records:
             await self.session.delete(audit_record)
 
+        mark_user_changed(self.session, user_id)
+        mark_leaderboard_changed(self.session)
+
 
 class MetricsRepo:
     def __init__(self, session: AsyncSession) -> None:
@@ -120,6 +257,8 @@ class MetricsRepo:
             metrics.saved_money = saved_money
             metrics.updated_at = now
         await self.session.flush()
+        mark_user_changed(self.session, user_id)
+        mark_leaderboard_changed(self.session)
         return metrics
 
     async def upsert_metrics_with_relapses(self, user_id: int, days: int, saved_money: float, relapses: int) -> Metrics:
@@ -128,7 +267,7 @@ class MetricsRepo:
         now = datetime.now(timezone.utc)
         if metrics is None:
             metrics = Metrics(user_id=user_id, days=days, saved_money=saved_money, relapses=relapses, updated_at=now)
-            logger.info(f"Created new metrics for user {user_id}")
+            logger.debug("Created new metrics for user %s", user_id)
             self.session.add(metrics)
         else:
             metrics.days = days
@@ -136,12 +275,44 @@ class MetricsRepo:
             metrics.relapses = relapses
             metrics.updated_at = now
         await self.session.flush()
+        mark_user_changed(self.session, user_id)
+        mark_leaderboard_changed(self.session)
         return metrics
 
-    async def add_relapse(self, user_id: int) -> Metrics:
-        """Добавляет рецидив пользователю (без сброса счетчика дней)"""
+    async def upsert_many(self, rows: Iterable[tuple[int, int, float]]) -> None:
+        """Пакетный upsert (user_id, days, saved_money); счётчик рецидивов не трогается."""
+        now = datetime.now(timezone.utc)
+        values = [
+            {"user_id": user_id, "days": days, "saved_money": saved_money, "relapses": 0, "updated_at": now}
+            for user_id, days, saved_money in rows
+        ]
+        for start in range(0, len(values), 5000):
+            stmt = pg_insert(Metrics).values(values[start:start + 5000])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Metrics.user_id],
+                set_={"days": stmt.excluded.days, "saved_money": stmt.excluded.saved_money, "updated_at": stmt.excluded.updated_at},
+            )
+            await self.session.execute(stmt)
+        # Пересчёт всех: поштучная инвалидация дороже полного сброса кэшей
+        mark_all_users_changed(self.session)
+        mark_leaderboard_changed(self.session)
+
+    async def add_relapse(self, user_id: int, day: Optional[date] = None) -> Metrics:
+        """Добавляет рецидив пользователю (без сброса счетчика дней)
+
+        Кроме общего счётчика пишет событие в журнал и увеличивает дневной
+        агрегат за day (локальная дата) — на нём строятся рейтинги за период.
+        """
         metrics = await self.session.get(Metrics, user_id)
         now = datetime.now(timezone.utc)
+        self.session.add(RelapseEvent(user_id=user_id, created_at=now))
+        rollup = pg_insert(RelapseDaily).values(user_id=user_id, day=day or date.today(), count=1)
+        await self.session.execute(
+            rollup.on_conflict_do_update(
+                index_elements=[RelapseDaily.user_id, RelapseDaily.day],
+                set_={"count": RelapseDaily.count + 1},
+            )
+        )
         if metrics is None:
             # Создаем новую запись если пользователя нет
             metrics = Metrics(user_id=user_id, days=0, saved_money=0, relapses=1, updated_at=now)
@@ -151,15 +322,63 @@ class MetricsRepo:
             metrics.updated_at = now
         
         await self.session.flush()
+        mark_user_changed(self.session, user_id)
+        mark_leaderboard_changed(self.session)
         return metrics
 
-    async def get_top(self, limit: int = 10) -> Iterable[tuple[User, Metrics]]:
-        # Получаем всех пользователей с метриками
+    async def add_relapses_many(self, counts: dict[tuple[int, date], int]) -> None:
+        """Пакетное применение накопленных рецидивов {(user_id, day): n}.
+
+        Журнал, дневные агрегаты и общий счётчик обновляются инкрементом
+        (relapses = relapses + n), без чтения текущих значений.
+        """
+        if not counts:
+            return
+        now = datetime.now(timezone.utc)
+        events = [{"user_id": user_id, "created_at": now} for (user_id, _), n in counts.items() for _ in range(n)]
+        await self.session.execute(pg_insert(RelapseEvent), events)
+
+        rollup = pg_insert(RelapseDaily).values(
+            [{"user_id": user_id, "day": day, "count": n} for (user_id, day), n in counts.items()]
+        )
+        await self.session.execute(
+            rollup.on_conflict_do_update(
+                index_elements=[RelapseDaily.user_id, RelapseDaily.day],
+                set_={"count": RelapseDaily.count + rollup.excluded.count},
+            )
+        )
+
+        per_user: dict[int, int] = {}
+        for (user_id, _), n in counts.items():
+            per_user[user_id] = per_user.get(user_id, 0) + n
+        totals = pg_insert(Metrics).values(
+            [
+                {"user_id": user_id, "days": 0, "saved_money": 0, "relapses": n, "updated_at": now}
+                for user_id, n in per_user.items()
+            ]
+        )
+        await self.session.execute(
+            totals.on_conflict_do_update(
+                index_elements=[Metrics.user_id],
+                set_={"relapses": Metrics.relapses + totals.excluded.relapses, "updated_at": totals.excluded.updated_at},
+            )
+        )
+        for user_id in per_user:
+            mark_user_changed(self.session, user_id)
+        mark_leaderboard_changed(self.session)
+
+    async def get_top(self, limit: int | None = 10, chat_id: int | None = None) -> Iterable[tuple[User, Metrics]]:
+        # Получаем всех пользователей с метриками (в рамках группы, если она указана)
         stmt: Select = (
             select(User, Metrics)
             .join(Metrics, Metrics.user_id == User.user_id)
             .where(User.is_member.is_(True))
         )
+        if chat_id is not None:
+            stmt = stmt.join(
+                GroupMember,
+                (GroupMember.user_id == User.user_id) & (GroupMember.chat_id == chat_id),
+            ).where(GroupMember.is_member.is_(True))
         result = await self.session.execute(stmt)
         users_with_metrics = list(result.all())
         
@@ -182,11 +401,309 @@ class MetricsRepo:
         sorted_users = sorted(users_with_metrics, key=get_sort_key)
         return sorted_users[:limit]
 
+    async def get_top_window(
+        self, since: date, window_days: int, limit: int | None = 10, chat_id: int | None = None
+    ) -> list[tuple[User, Metrics, int]]:
+        """Рейтинг за период: стаж ограничен длиной периода, штрафуются только рецидивы за период.
+
+        Рецидивы читаются из дневных агрегатов, поэтому стоимость запроса зависит
+        от длины периода, а не от всей истории журнала.
+        """
+        window = (
+            select(RelapseDaily.user_id, func.sum(RelapseDaily.count).label("relapses"))
+            .where(RelapseDaily.day >= since)
+            .group_by(RelapseDaily.user_id)
+            .subquery()
+        )
+        relapses = func.coalesce(window.c.relapses, 0)
+        score = func.least(Metrics.days, window_days) - relapses * 3
+        stmt: Select = (
+            select(User, Metrics, relapses)
+            .join(Metrics, Metrics.user_id == User.user_id)
+            .outerjoin(window, window.c.user_id == User.user_id)
+            .where(User.is_member.is_(True))
+            .order_by(score.desc(), Metrics.days.desc(), relapses.asc(), User.user_id)
+            .limit(limit)
+        )
+        if chat_id is not None:
+            stmt = stmt.join(
+                GroupMember,
+                (GroupMember.user_id == User.user_id) & (GroupMember.chat_id == chat_id),
+            ).where(GroupMember.is_member.is_(True))
+        result = await self.session.execute(stmt)
+        return [(user, metrics, int(count)) for user, metrics, count in result.all()]
+
     async def get_all_metrics(self) -> list[Metrics]:
         rows = await self.session.execute(select(Metrics))
         return list(rows.scalars().all())
 
 
+class MetricsHistoryRepo:
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+
+    async def capture(self, day: date) -> None:
+        """Снимок текущих метрик всех участников за day одним INSERT ... SELECT.
+
+        Новая строка месяца дополняется NULL до нужного числа, в существующей
+        перезаписывается только элемент дня, поэтому повторный запуск безопасен.
+        """
+        await self.session.execute(
+            text(
+                "INSERT INTO metrics_history (user_id, month, days, saved_cents, relapses, updated_at) "
+                "SELECT m.user_id, :month, "
+                "array_fill(NULL::integer, ARRAY[CAST(:pad AS integer)]) || m.days, "
+                "array_fill(NULL::bigint, ARRAY[CAST(:pad AS integer)]) || CAST(round(m.saved_money * 100) AS bigint), "
+                "array_fill(NULL::integer, ARRAY[CAST(:pad AS integer)]) || m.relapses, "
+                "NOW() "
+                "FROM metrics m JOIN users u ON u.user_id = m.user_id WHERE u.is_member "
+                "ON CONFLICT (user_id, month) DO UPDATE SET "
+                "days[CAST(:dom AS integer)] = EXCLUDED.days[CAST(:dom AS integer)], "
+                "saved_cents[CAST(:dom AS integer)] = EXCLUDED.saved_cents[CAST(:dom AS integer)], "
+                "relapses[CAST(:dom AS integer)] = EXCLUDED.relapses[CAST(:dom AS integer)], "
+                "updated_at = EXCLUDED.updated_at"
+            ),
+            {"month": day.replace(day=1), "pad": day.day - 1, "dom": day.day},
+        )
+
+    async def get_range(self, user_id: int, start: date, end: date) -> list[tuple[date, int, float, int]]:
+        """(день, стаж, экономия, рецидивы) за [start, end] по возрастанию даты; дни без снимка пропускаются."""
+        stmt = (
+            select(MetricsHistory)
+            .where(
+                MetricsHistory.user_id == user_id,
+                MetricsHistory.month >= start.replace(day=1),
+                MetricsHistory.month <= end,
+            )
+            .order_by(MetricsHistory.month)
+        )
+        rows = await self.session.execute(stmt)
+        points = []
+        for row in rows.scalars().all():
+            for idx, days in enumerate(row.days):
+                if days is None:
+                    continue
+                day = row.month.replace(day=idx + 1)
+                if start <= day <= end:
+                    points.append((day, days, (row.saved_cents[idx] or 0) / 100, row.relapses[idx] or 0))
+        return points
+
+
+class PriceHistoryRepo:
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+
+    async def list_points(self, user_id: int) -> list[PricePoint]:
+        rows = await self.session.execute(
+            select(PriceHistory).where(PriceHistory.user_id == user_id).order_by(PriceHistory.effective_from)
+        )
+        return [_price_point(item) for item in rows.scalars().all()]
+
+    async def latest_for(self, user_ids: Optional[list[int]] = None) -> dict[int, PricePoint]:
+        """Действующая точка истории для каждого пользователя (DISTINCT ON по PK); None — для всех."""
+        stmt = (
+            select(PriceHistory)
+            .distinct(PriceHistory.user_id)
+            .order_by(PriceHistory.user_id, desc(PriceHistory.effective_from))
+        )
+        if user_ids is not None:
+            if not user_ids:
+                return {}
+            stmt = stmt.where(PriceHistory.user_id.in_(user_ids))
+        rows = await self.session.execute(stmt)
+        return {item.user_id: _price_point(item) for item in rows.scalars().all()}
+
+    async def set_point(self, user_id: int, point: PricePoint) -> None:
+        """Добавляет точку; точки после неё удаляются — их префиксные суммы устарели."""
+        await self.session.execute(
+            delete(PriceHistory).where(PriceHistory.user_id == user_id, PriceHistory.effective_from > point.effective_from)
+        )
+        stmt = pg_insert(PriceHistory).values(
+            user_id=user_id,
+            effective_from=point.effective_from,
+            pack_price=point.pack_price,
+            packs_per_day=point.packs_per_day,
+            saved_before=point.saved_before,
+            created_at=datetime.now(timezone.utc),
+        )
+        await self.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[PriceHistory.user_id, PriceHistory.effective_from],
+                set_={
+                    "pack_price": stmt.excluded.pack_price,
+                    "packs_per_day": stmt.excluded.packs_per_day,
+                    "saved_before": stmt.excluded.saved_before,
+                },
+            )
+        )
+
+    async def reset(self, user_id: int, quit_date: date, pack_price: float) -> None:
+        """Начинает историю заново с даты отказа (регистрация)."""
+        await self.session.execute(delete(PriceHistory).where(PriceHistory.user_id == user_id))
+        await self.set_point(user_id, PricePoint(quit_date, pack_price, 1.0, 0.0))
+
+
+def _price_point(item: PriceHistory) -> PricePoint:
+    return PricePoint(item.effective_from, float(item.pack_price), float(item.packs_per_day), float(item.saved_before))
+
+
+class RankSnapshotRepo:
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+
+    async def capture(self, day: date) -> None:
+        """Места участников в рейтинге каждой активной группы на day одним INSERT ... SELECT.
+
+        Нумерация идёт отдельно в каждой группе (PARTITION BY chat_id) в том же
+        порядке, что MetricsRepo.get_top: очки (стаж − 3 × рецидивы), стаж,
+        рецидивы, имя. Повторный запуск пересобирает снимок дня целиком.
+        """
+        await self.session.execute(delete(RankSnapshot).where(RankSnapshot.day == day))
+        await self.session.execute(
+            text(
+                "INSERT INTO group_rank_snapshots (chat_id, day, user_id, rank) "
+                "SELECT gm.chat_id, :day, m.user_id, ROW_NUMBER() OVER ("
+                "PARTITION BY gm.chat_id "
+                "ORDER BY m.days - m.relapses * 3 DESC, m.days DESC, m.relapses, "
+                "lower(COALESCE(u.full_name, u.username, CAST(u.user_id AS text)))) "
+                "FROM metrics m JOIN users u ON u.user_id = m.user_id "
+                "JOIN group_members gm ON gm.user_id = m.user_id AND gm.is_member "
+                "JOIN groups g ON g.chat_id = gm.chat_id AND g.is_active "
+                "WHERE u.is_member"
+            ),
+            {"day": day},
+        )
+
+    async def list_moves(
+        self, day: date, top: int, min_climb: int
+    ) -> list[tuple[int, Optional[str], int, Optional[int], int]]:
+        """(chat_id, название группы, user_id, вчерашнее место или None, сегодняшнее) для тех,
+        кто в рейтинге своей группы вошёл в ТОП‑top, выпал из него или поднялся минимум
+        на min_climb мест. Только доступные в ЛС. Группы без вчерашнего снимка (первый
+        запуск, простой, новая группа) пропускаются — иначе весь их ТОП получил бы «вы вошли в ТОП»."""
+        rows = await self.session.execute(
+            text(
+                "SELECT t.chat_id, g.title, t.user_id, y.rank, t.rank FROM group_rank_snapshots t "
+                "JOIN groups g ON g.chat_id = t.chat_id "
+                "JOIN users u ON u.user_id = t.user_id AND u.deliverability = 'ok' "
+                "LEFT JOIN group_rank_snapshots y "
+                "ON y.chat_id = t.chat_id AND y.user_id = t.user_id AND y.day = :yesterday "
+                "WHERE t.day = :day "
+                "AND EXISTS (SELECT 1 FROM group_rank_snapshots p WHERE p.chat_id = t.chat_id AND p.day = :yesterday) "
+                "AND ((t.rank <= :top AND (y.rank IS NULL OR y.rank > :top)) "
+                "OR (y.rank <= :top AND t.rank > :top) "
+                "OR (y.rank - t.rank >= :climb))"
+            ),
+            {"day": day, "yesterday": day - timedelta(days=1), "top": top, "climb": min_climb},
+        )
+        return [(chat_id, title, user_id, prev, cur) for chat_id, title, user_id, prev, cur in rows.all()]
+
+    async def purge_before(self, day: date) -> int:
+        result = await self.session.execute(delete(RankSnapshot).where(RankSnapshot.day < day))
+        return result.rowcount or 0
+
+
+class ChartCacheRepo:
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+
+    async def get(self, user_id: int, day: date) -> Optional[str]:
+        item = await self.session.get(ChartCache, (user_id, day))
+        return item.file_id if item else None
+
+    async def set(self, user_id: int, day: date, file_id: str) -> None:
+        stmt = pg_insert(ChartCache).values(user_id=user_id, day=day, file_id=file_id, created_at=datetime.now(timezone.utc))
+        await self.session.execute(
+            stmt.on_conflict_do_update(index_elements=[ChartCache.user_id, ChartCache.day], set_={"file_id": file_id})
+        )
+
+    async def purge_before(self, day: date) -> int:
+        result = await self.session.execute(delete(ChartCache).where(ChartCache.day < day))
+        return result.rowcount or 0
+
+
+class GroupRepo:
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+
+    async def upsert(self, chat_id: int, title: Optional[str] = None, is_active: bool = True) -> bool:
+        """Создаёт или обновляет группу. Возвращает True, если группа новая."""
+        group = await self.session.get(Group, chat_id)
+        now = datetime.now(timezone.utc)
+        if group is None:
+            self.session.add(Group(chat_id=chat_id, title=title, is_active=is_active, created_at=now, updated_at=now))
+            await self.session.flush()
+            return True
+        if title is not None:
+            group.title = title
+        group.is_active = is_active
+        group.updated_at = now
+        await self.session.flush()
+        return False
+
+    async def list_active_ids(self) -> list[int]:
+        rows = await self.session.execute(select(Group.chat_id).where(Group.is_active.is_(True)))
+        return list(rows.scalars().all())
+
+
+class GroupMemberRepo:
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+
+    async def set_member(self, chat_id: int, user_id: int, is_member: bool) -> None:
+        now = datetime.now(timezone.utc)
+        stmt = pg_insert(GroupMember).values(chat_id=chat_id, user_id=user_id, is_member=is_member, updated_at=now)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[GroupMember.chat_id, GroupMember.user_id],
+            set_={"is_member": is_member, "updated_at": now},
+        )
+        await self.session.execute(stmt)
+        mark_leaderboard_changed(self.session)
+
+    async def list_groups_for_user(self, user_id: int) -> list[int]:
+        stmt = (
+            select(GroupMember.chat_id)
+            .join(Group, Group.chat_id == GroupMember.chat_id)
+            .where(GroupMember.user_id == user_id, GroupMember.is_member.is_(True), Group.is_active.is_(True))
+        )
+        rows = await self.session.execute(stmt)
+        return list(rows.scalars().all())
+
+    async def list_member_days(self, chat_id: int, shard: Optional[tuple[int, int]] = None) -> list[tuple[int, int]]:
+        """(user_id, days) участников группы с ненулевым стажем — для кастом‑тайтлов.
+
+        shard=(номер, всего) оставляет только пользователей с user_id % всего == номер.
+        """
+        stmt = (
+            select(Metrics.user_id, Metrics.days)
+            .join(GroupMember, GroupMember.user_id == Metrics.user_id)
+            .join(User, User.user_id == Metrics.user_id)
+            .where(
+                GroupMember.chat_id == chat_id,
+                GroupMember.is_member.is_(True),
+                User.is_member.is_(True),
+                Metrics.days > 0,
+            )
+        )
+        if shard is not None:
+            shard_no, shard_count = shard
+            stmt = stmt.where(Metrics.user_id % shard_count == shard_no)
+        rows = await self.session.execute(stmt)
+        return [(user_id, days) for user_id, days in rows.all()]
+
+    async def backfill_from_users(self, chat_id: int) -> None:
+        """Переносит участников из одногрупповой схемы: все is_member пользователи — в группу chat_id."""
+        await self.session.execute(
+            text(
+                "INSERT INTO group_members (chat_id, user_id, is_member, updated_at) "
+                "SELECT :chat_id, user_id, true, NOW() FROM users WHERE is_member "
+                "ON CONFLICT (chat_id, user_id) DO NOTHING"
+            ),
+            {"chat_id": chat_id},
+        )
+        mark_leaderboard_changed(self.session)
+
+
 class TopPostRepo:
     def __init__(self, session: AsyncSession) -> None:
         self.session = session
@@ -200,19 +717,322 @@ class TopPostRepo:
         result = await self.session.execute(stmt)
         return result.scalar_one_or_none()
 
-    async def set(self, chat_id: int, message_id: int, topic_id: int | None = None) -> TopPost:
+    async def set(
+        self,
+        chat_id: int,
+        message_id: int,
+        topic_id: int | None = None,
+        content_hash: str | None = None,
+    ) -> TopPost:
         item = await self.get_for_chat(chat_id, topic_id)
         now = datetime.now(timezone.utc)
         if item is None:
-            item = TopPost(chat_id=chat_id, topic_id=topic_id, message_id=message_id, updated_at=now)
+            item = TopPost(
+                chat_id=chat_id,
+                topic_id=topic_id,
+                message_id=message_id,
+                content_hash=content_hash,
+                updated_at=now,
+            )
             self.session.add(item)
         else:
             item.message_id = message_id
+            item.content_hash = content_hash
             item.updated_at = now
         await self.session.flush()
         return item
 
 
+class RegistrationStateRepo:
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+
+    async def get(self, user_id: int) -> Optional[RegistrationState]:
+        stmt = select(RegistrationState).where(
+            RegistrationState.user_id == user_id,
+            RegistrationState.expires_at > datetime.now(timezone.utc),
+        )
+        result = await self.session.execute(stmt)
+        return result.scalar_one_or_none()
+
+    async def set(self, user_id: int, quit_date: Optional[date], ttl: timedelta) -> None:
+        expires_at = datetime.now(timezone.utc) + ttl
+        stmt = pg_insert(RegistrationState).values(user_id=user_id, quit_date=quit_date, expires_at=expires_at)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[RegistrationState.user_id],
+            set_={"quit_date": quit_date, "expires_at": expires_at},
+        )
+        await self.session.execute(stmt)
+
+    async def delete(self, user_id: int) -> None:
+        await self.session.execute(delete(RegistrationState).where(RegistrationState.user_id == user_id))
+
+    async def purge_expired(self) -> int:
+        result = await self.session.execute(
+            delete(RegistrationState).where(RegistrationState.expires_at <= datetime.now(timezone.utc))
+        )
+        return result.rowcount or 0
+
+
+class AppMetaRepo:
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+
+    async def get(self, key: str) -> Optional[str]:
+        item = await self.session.get(AppMeta, key)
+        return item.value if item else None
+
+    async def set(self, key: str, value: str) -> None:
+        stmt = pg_insert(AppMeta).values(key=key, value=value, updated_at=datetime.now(timezone.utc))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[AppMeta.key],
+            set_={"value": value, "updated_at": datetime.now(timezone.utc)},
+        )
+        await self.session.execute(stmt)
+
+
+class JobRunRepo:
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+
+    async def record(
+        self,
+        pipeline: str,
+        run_key: str,
+        stage: str,
+        status: str,
+        started_at: datetime,
+        duration_ms: int,
+        error: Optional[str] = None,
+    ) -> None:
+        self.session.add(
+            JobRun(
+                pipeline=pipeline,
+                run_key=run_key,
+                stage=stage,
+                status=status,
+                started_at=started_at,
+                duration_ms=duration_ms,
+                error=error[:1024] if error else None,
+            )
+        )
+
+    async def completed_stages(self, pipeline: str, run_key: str) -> set[str]:
+        stmt = select(JobRun.stage).where(JobRun.pipeline == pipeline, JobRun.run_key == run_key, JobRun.status == "ok")
+        rows = await self.session.execute(stmt)
+        return set(rows.scalars().all())
+
+
+class JobShardRepo:
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+
+    async def create(self, job: str, run_key: str, shard_count: int) -> None:
+        """Создаёт шарды запуска; уже существующие не трогает, упавшие возвращает в очередь."""
+        now = datetime.now(timezone.utc)
+        rows = [
+            {"job": job, "run_key": run_key, "shard_no": n, "shard_count": shard_count, "status": "pending", "attempts": 0, "created_at": now}
+            for n in range(shard_count)
+        ]
+        stmt = pg_insert(JobShard).values(rows).on_conflict_do_nothing(index_elements=[JobShard.job, JobShard.run_key, JobShard.shard_no])
+        await self.session.execute(stmt)
+        await self.session.execute(
+            update(JobShard)
+            .where(JobShard.job == job, JobShard.run_key == run_key, JobShard.status == "failed")
+            .values(status="pending", attempts=0, error=None)
+        )
+
+    async def claim(self, lease: timedelta, worker: str) -> Optional[JobShard]:
+        """Берёт свободный шард или шард с истёкшей арендой (воркер умер) — SKIP LOCKED."""
+        now = datetime.now(timezone.utc)
+        candidate = (
+            select(JobShard.id)
+            .where(
+                (JobShard.status == "pending")
+                | ((JobShard.status == "running") & (JobShard.locked_until < now))
+            )
+            .order_by(JobShard.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        stmt = (
+            update(JobShard)
+            .where(JobShard.id == candidate.scalar_subquery())
+            .values(status="running", worker=worker, locked_until=now + lease, attempts=JobShard.attempts + 1, started_at=now)
+            .returning(JobShard)
+        )
+        rows = await self.session.execute(stmt)
+        return rows.scalars().first()
+
+    async def renew(self, shard_id: int, worker: str, lease: timedelta) -> bool:
+        """Продлевает аренду, только пока она действует и принадлежит worker.
+
+        False — аренда истекла или шард уже забрал другой воркер: продолжать нельзя.
+        """
+        now = datetime.now(timezone.utc)
+        result = await self.session.execute(
+            update(JobShard)
+            .where(
+                JobShard.id == shard_id,
+                JobShard.status == "running",
+                JobShard.worker == worker,
+                JobShard.locked_until > now,
+            )
+            .values(locked_until=now + lease)
+        )
+        return result.rowcount == 1
+
+    async def finish(self, shard_id: int, worker: str, attempt: int) -> bool:
+        """Отмечает шард выполненным, если он всё ещё за этой попыткой (attempt) воркера."""
+        result = await self.session.execute(
+            update(JobShard)
+            .where(*self._held(shard_id, worker, attempt))
+            .values(status="done", locked_until=None, finished_at=datetime.now(timezone.utc), error=None)
+        )
+        return result.rowcount == 1
+
+    async def fail(self, shard_id: int, worker: str, attempt: int, error: str, max_attempts: int) -> bool:
+        """Возвращает шард в очередь или, если попытки исчерпаны, помечает failed."""
+        result = await self.session.execute(
+            update(JobShard)
+            .where(*self._held(shard_id, worker, attempt))
+            .values(
+                status=case((JobShard.attempts >= max_attempts, "failed"), else_="pending"),
+                locked_until=None,
+                error=error[:1024],
+            )
+        )
+        return result.rowcount == 1
+
+    @staticmethod
+    def _held(shard_id: int, worker: str, attempt: int) -> tuple[Any, ...]:
+        # Повторный claim увеличивает attempts, поэтому перехваченный шард не совпадёт
+        return (
+            JobShard.id == shard_id,
+            JobShard.status == "running",
+            JobShard.worker == worker,
+            JobShard.attempts == attempt,
+        )
+
+    async def status_counts(self, job: str, run_key: str) -> dict[str, int]:
+        stmt = (
+            select(JobShard.status, func.count())
+            .where(JobShard.job == job, JobShard.run_key == run_key)
+            .group_by(JobShard.status)
+        )
+        rows = await self.session.execute(stmt)
+        return {status: count for status, count in rows.all()}
+
+    async def purge(self, older_than: timedelta) -> int:
+        result = await self.session.execute(
+            delete(JobShard).where(JobShard.created_at < datetime.now(timezone.utc) - older_than)
+        )
+        return result.rowcount or 0
+
+
+class OutboxRepo:
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+
+    async def enqueue(self, kind: str, chat_id: int, payload: dict[str, Any], idempotency_key: str) -> None:
+        await self.enqueue_many([(kind, chat_id, payload, idempotency_key)])
+
+    async def enqueue_many(self, items: list[tuple[str, int, dict[str, Any], str]]) -> None:
+        """Ставит сообщения в очередь одним INSERT; уже известные ключи пропускаются."""
+        if not items:
+            return
+        now = datetime.now(timezone.utc)
+        rows = [
+            {
+                "kind": kind,
+                "chat_id": chat_id,
+                "payload_json": json.dumps(payload, ensure_ascii=False),
+                "idempotency_key": key,
+                "status": "pending",
+                "attempts": 0,
+                "next_attempt_at": now,
+                "created_at": now,
+            }
+            for kind, chat_id, payload, key in items
+        ]
+        # asyncpg ограничивает число параметров запроса — вставляем пачками
+        for start in range(0, len(rows), 1000):
+            stmt = pg_insert(OutboxMessage).values(rows[start:start + 1000])
+            await self.session.execute(stmt.on_conflict_do_nothing(index_elements=[OutboxMessage.idempotency_key]))
+
+    async def claim(self, limit: int, lease: timedelta) -> list[OutboxMessage]:
+        """Забирает пачку готовых к отправке сообщений под аренду (SKIP LOCKED — без гонок между воркерами)."""
+        now = datetime.now(timezone.utc)
+        due = (
+            select(OutboxMessage.id)
+            .where(
+                OutboxMessage.status == "pending",
+                OutboxMessage.next_attempt_at <= now,
+                (OutboxMessage.locked_until.is_(None)) | (OutboxMessage.locked_until < now),
+            )
+            .order_by(OutboxMessage.next_attempt_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        stmt = (
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(due.scalar_subquery()))
+            .values(locked_until=now + lease, attempts=OutboxMessage.attempts + 1)
+            .returning(OutboxMessage)
+        )
+        rows = await self.session.execute(stmt)
+        return list(rows.scalars().all())
+
+    async def renew(self, message_id: int, held_until: datetime, lease: timedelta) -> Optional[datetime]:
+        """Продлевает аренду перед отправкой. None — аренда истекла и сообщение забрал другой воркер."""
+        result = await self.session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id == message_id, OutboxMessage.locked_until == held_until)
+            .values(locked_until=datetime.now(timezone.utc) + lease)
+            .returning(OutboxMessage.locked_until)
+        )
+        return result.scalar_one_or_none()
+
+    # Итог доставки записывается, только если воркер всё ещё держит аренду held_until;
+    # False — аренду уже перехватили, результат не пишем поверх чужого.
+
+    async def mark_sent(self, message_id: int, held_until: datetime) -> bool:
+        return await self._finish(message_id, held_until, status="sent", sent_at=datetime.now(timezone.utc), last_error=None)
+
+    async def mark_retry(self, message_id: int, held_until: datetime, delay: timedelta, error: str) -> bool:
+        return await self._finish(message_id, held_until, next_attempt_at=datetime.now(timezone.utc) + delay, last_error=error[:512])
+
+    async def mark_rate_limited(self, message_id: int, held_until: datetime, delay: timedelta, error: str) -> bool:
+        """429 — не ошибка доставки: попытку, засчитанную в claim, возвращаем."""
+        return await self._finish(
+            message_id,
+            held_until,
+            next_attempt_at=datetime.now(timezone.utc) + delay,
+            attempts=OutboxMessage.attempts - 1,
+            last_error=error[:512],
+        )
+
+    async def mark_dead(self, message_id: int, held_until: datetime, error: str) -> bool:
+        return await self._finish(message_id, held_until, status="dead", last_error=error[:512])
+
+    async def _finish(self, message_id: int, held_until: datetime, **values: Any) -> bool:
+        result = await self.session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id == message_id, OutboxMessage.locked_until == held_until)
+            .values(locked_until=None, **values)
+        )
+        return bool(result.rowcount)
+
+    async def purge_sent(self, older_than: timedelta) -> int:
+        result = await self.session.execute(
+            delete(OutboxMessage).where(
+                OutboxMessage.status == "sent",
+                OutboxMessage.sent_at < datetime.now(timezone.utc) - older_than,
+            )
+        )
+        return result.rowcount or 0
+
+
 class AuditRepo:
     def __init__(self, session: AsyncSession) -> None:
         self.session = session
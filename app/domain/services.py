@@ -1,8 +1,16 @@
 from __future__ import annotations
 
+from bisect import bisect_right
 from dataclasses import dataclass
-from datetime import date, datetime
-from typing import Optional
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import TYPE_CHECKING, Any, Iterable, Optional, Sequence
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from app.config import Settings
 
 
 @dataclass(slots=True)
@@ -11,10 +19,21 @@ class MetricsResult:
     saved_money: float
 
 
-def calculate_metrics(quit_date: Optional[date], pack_price: Optional[float]) -> MetricsResult:
+@dataclass(slots=True)
+class MetricsBatch:
+    days: np.ndarray  # int64
+    saved_money: np.ndarray  # float64
+
+
+def local_today(tz: str) -> date:
+    """Текущая дата в таймзоне бота (Settings.tz), а не в таймзоне сервера."""
+    return datetime.now(ZoneInfo(tz)).date()
+
+
+def calculate_metrics(quit_date: Optional[date], pack_price: Optional[float], today: Optional[date] = None) -> MetricsResult:
     if quit_date is None:
         return MetricsResult(days=0, saved_money=0.0)
-    today = date.today()
+    today = today or date.today()
     days = max((today - quit_date).days, 0)
     if pack_price is None:
         return MetricsResult(days=days, saved_money=0.0)
@@ -23,6 +42,88 @@ def calculate_metrics(quit_date: Optional[date], pack_price: Optional[float]) ->
     return MetricsResult(days=days, saved_money=saved_money)
 
 
+def calculate_metrics_batch(
+    quit_dates: Sequence[Optional[date]],
+    pack_prices: Sequence[Optional[float | Decimal]],
+    today: date | Sequence[date],
+    segments: Optional[Sequence[Optional[PricePoint]]] = None,
+) -> MetricsBatch:
+    """Векторный расчёт стажа и экономии для многих пользователей на одну дату.
+
+    Даты переводятся в ординалы одним проходом, остальное считает numpy;
+    пользователи без даты получают 0 дней, без цены — 0 экономии.
+    segments — последние точки истории цен (PricePoint) по пользователям;
+    без точки экономия считается по pack_price, как раньше.
+    today — одна дата для всех или своя для каждого (локальная дата в таймзоне пользователя).
+    """
+    count = len(quit_dates)
+    if isinstance(today, date):
+        today_ordinal: int | np.ndarray = today.toordinal()
+    else:
+        today_ordinal = np.fromiter((d.toordinal() for d in today), dtype=np.int64, count=count)
+    today_ordinals = np.broadcast_to(today_ordinal, (count,)).tolist()
+    ordinals = np.fromiter(
+        (d.toordinal() if d is not None else t for d, t in zip(quit_dates, today_ordinals)), dtype=np.int64, count=count
+    )
+    prices = np.fromiter((p if p is not None else 0.0 for p in pack_prices), dtype=np.float64, count=count)
+    days = np.maximum(today_ordinal - ordinals, 0)
+    if segments is None:
+        # Упрощенно: 1 пачка в день
+        return MetricsBatch(days=days, saved_money=days * prices)
+
+    # Последняя точка истории цен: экономия до неё + дни с её начала по её цене и расходу
+    segment_ordinals = np.fromiter(
+        (seg.effective_from.toordinal() if seg is not None else o for seg, o in zip(segments, ordinals.tolist())),
+        dtype=np.int64,
+        count=count,
+    )
+    packs = np.fromiter((float(seg.packs_per_day) if seg is not None else 1.0 for seg in segments), dtype=np.float64, count=count)
+    saved_before = np.fromiter((float(seg.saved_before) if seg is not None else 0.0 for seg in segments), dtype=np.float64, count=count)
+    segment_prices = np.fromiter(
+        (float(seg.pack_price) if seg is not None else price for seg, price in zip(segments, prices.tolist())),
+        dtype=np.float64,
+        count=count,
+    )
+    segment_days = np.maximum(today_ordinal - np.maximum(segment_ordinals, ordinals), 0)
+    return MetricsBatch(days=days, saved_money=saved_before + segment_days * segment_prices * packs)
+
+
+@dataclass(frozen=True, slots=True)
+class PricePoint:
+    """Точка изменения цены/расхода: действует с effective_from до следующей точки.
+
+    saved_before — накопленная экономия на effective_from (префиксная сумма
+    всех предыдущих отрезков), поэтому экономию на любую дату считает одна точка.
+    """
+
+    effective_from: date
+    pack_price: float
+    packs_per_day: float
+    saved_before: float
+
+
+class SavingsIndex:
+    """Экономия с учётом истории цен: поиск отрезка бинарным поиском, O(log k)."""
+
+    def __init__(self, quit_date: date, points: Sequence[PricePoint]) -> None:
+        self.quit_date = quit_date
+        self.points = sorted(points, key=lambda p: p.effective_from)
+        self._starts = [p.effective_from for p in self.points]
+
+    def saved_at(self, day: date) -> float:
+        i = bisect_right(self._starts, day) - 1
+        if i < 0 or day <= self.quit_date:
+            return 0.0
+        point = self.points[i]
+        start = max(point.effective_from, self.quit_date)
+        return float(point.saved_before) + max((day - start).days, 0) * float(point.pack_price) * float(point.packs_per_day)
+
+    def change_point(self, day: date, pack_price: float, packs_per_day: float) -> PricePoint:
+        """Новая точка с day: префикс считается по отрезкам до day (точка того же дня заменяется)."""
+        earlier = SavingsIndex(self.quit_date, [p for p in self.points if p.effective_from < day])
+        return PricePoint(day, pack_price, packs_per_day, round(earlier.saved_at(day), 2))
+
+
 def generate_admin_title(days: int) -> str:
     # 0–16 символов, без эмодзи. Короткий формат.
     if days <= 0:
@@ -31,6 +132,92 @@ def generate_admin_title(days: int) -> str:
     return text[:16]
 
 
+def format_top_text(header: str, top: Iterable[tuple[Any, Any]]) -> str:
+    """Текст рейтинга по строкам (user, metrics), отсортированным по месту."""
+    lines = []
+    medals = ["🥇", "🥈", "🥉"]
+    for idx, (user, metrics) in enumerate(top, start=1):
+        # Добавляем медальки только для первых трех мест
+        prefix = medals[idx - 1] if idx <= 3 else f"{idx}."
+        name = user.full_name or user.username or str(user.user_id)
+        # Рассчитываем рейтинг
+        score = metrics.days - (metrics.relapses * 3)
+        # Добавляем информацию о рецидивах и рейтинге
+        relapse_text = f" (рецидивов: {metrics.relapses}, рейтинг: {score})" if metrics.relapses > 0 else f" (рейтинг: {score})"
+        lines.append(f"{prefix} {name} — {metrics.days} дн.{relapse_text}")
+    return f"{header}\n" + "\n".join(lines)
+
+
+def period_start(period: str, today: date) -> date:
+    """Начало текущей календарной недели (с понедельника) или месяца."""
+    if period == "week":
+        return today - timedelta(days=today.weekday())
+    if period == "month":
+        return today.replace(day=1)
+    raise ValueError(f"unknown period {period!r}")
+
+
+def format_window_top_text(header: str, top: Iterable[tuple[Any, Any, int]], window_days: int) -> str:
+    """Текст рейтинга за период по строкам (user, metrics, рецидивы за период)."""
+    lines = []
+    medals = ["🥇", "🥈", "🥉"]
+    for idx, (user, metrics, relapses) in enumerate(top, start=1):
+        prefix = medals[idx - 1] if idx <= 3 else f"{idx}."
+        name = user.full_name or user.username or str(user.user_id)
+        days = min(metrics.days, window_days)
+        score = days - relapses * 3
+        relapse_text = f" (рецидивов: {relapses}, рейтинг: {score})" if relapses > 0 else f" (рейтинг: {score})"
+        lines.append(f"{prefix} {name} — {days} дн.{relapse_text}")
+    return f"{header}\n" + "\n".join(lines)
+
+
+def format_progress_text(points: Sequence[tuple[date, int, float, int]], step: int = 7) -> str:
+    """Текст «мой прогресс» по дневным снимкам (день, стаж, экономия, рецидивы)."""
+    if not points:
+        return "📈 История прогресса появится после ближайшего ежедневного пересчёта."
+    first, last = points[0], points[-1]
+    # Каждый step-й снимок с конца, чтобы последний день всегда был в списке
+    sampled = list(points[::-1][::step])[::-1]
+    lines = [f"{day:%d.%m} — {days} дн., {saved:.0f}₽" for day, days, saved, _ in sampled]
+    return (
+        f"📈 Прогресс с {first[0]:%d.%m} по {last[0]:%d.%m}:\n\n"
+        + "\n".join(lines)
+        + f"\n\nЗа период: +{last[1] - first[1]} дн., +{last[2] - first[2]:.0f}₽, рецидивов: {last[3] - first[3]}"
+    )
+
+
+# Вехи стажа в днях, с которыми поздравляем
+MILESTONES: tuple[int, ...] = (30, 100, 365)
+
+
+def due_milestone(quit_date: date, today: date, notified: int, milestones: Iterable[int] = MILESTONES) -> Optional[int]:
+    """Наибольшая веха, достигнутая к today и ещё не отмеченная (> notified), или None.
+
+    Если пропущено несколько вех сразу, поздравляем только с последней.
+    """
+    days_since_quit = (today - quit_date).days
+    reached = [days for days in milestones if notified < days <= days_since_quit]
+    return max(reached) if reached else None
+
+
+def format_milestone_text(days: int) -> str:
+    if days == 365:
+        return "🎉 Год без сигарет! Это огромное достижение — вы молодец!"
+    return f"🎉 {days} дней без сигарет! Так держать!"
+
+
+def format_rank_change_text(prev: Optional[int], cur: int, top: int, group_title: Optional[str] = None) -> str:
+    # Рейтинги ведутся по группам: участнику нескольких групп важно, о каком речь
+    board = f" группы «{group_title}»" if group_title else ""
+    if cur <= top and (prev is None or prev > top):
+        return f"🏆 Вы вошли в ТОП‑{top}{board}! Ваше место в рейтинге: {cur}."
+    if prev is not None and prev <= top < cur:
+        return f"📉 Вы выбыли из ТОП‑{top}{board}: сейчас вы на {cur} месте. Ещё немного — и вы вернётесь!"
+    if prev is not None and prev > cur:
+        return f"📈 Вы обогнали {prev - cur} участн. и поднялись с {prev} на {cur} место в рейтинге{board}!"
+    return f"Ваше место в рейтинге{board}: {cur}."
+
+
 def rank_text(days: int) -> str:
     months = days / 30
     if months < 6:
@@ -40,3 +227,42 @@ def rank_text(days: int) -> str:
     if months < 24:
         return "🥇 Золото"
     return "💎 Платина"
+
+
+@dataclass(frozen=True, slots=True)
+class NotifySchedule:
+    """Расписание персональных напоминаний.
+
+    Пользователи без выбранного времени получают время по умолчанию со
+    стабильным сдвигом в пределах spread_minutes (по user_id), чтобы рассылка
+    шла равномерно, а не одной пачкой в одну минуту.
+    """
+
+    default_time: time
+    default_tz: str
+    spread_minutes: int = 60
+
+    def time_for(self, user_id: int, notify_time: Optional[time]) -> time:
+        if notify_time is not None:
+            return notify_time
+        offset = user_id % max(self.spread_minutes, 1)
+        base = datetime.combine(date(2000, 1, 1), self.default_time)
+        return (base + timedelta(minutes=offset)).time()
+
+    def next_at(self, user_id: int, notify_time: Optional[time], notify_tz: Optional[str], after: datetime) -> datetime:
+        """Ближайший момент напоминания строго позже after (aware datetime)."""
+        tz = ZoneInfo(notify_tz or self.default_tz)
+        at = self.time_for(user_id, notify_time)
+        local_day = after.astimezone(tz).date()
+        candidate = datetime.combine(local_day, at, tzinfo=tz)
+        if candidate <= after:
+            candidate = datetime.combine(local_day + timedelta(days=1), at, tzinfo=tz)
+        return candidate
+
+
+def notify_schedule(settings: Settings) -> NotifySchedule:
+    return NotifySchedule(
+        default_time=time(settings.daily_post_hour, settings.daily_post_minute),
+        default_tz=settings.tz,
+        spread_minutes=settings.notify_spread_minutes,
+    )
@@ -1,21 +1,92 @@
+import atexit
 import logging
+import logging.handlers
+import queue
+import random
 
 import structlog
 
+# Доля сохраняемых событий, помеченных `_sampled=True` (частые события горячих путей)
+_sample_rate = 1.0
+_debug_enabled = False
 
-def configure_logging(level: int = logging.INFO) -> None:
-    logging.basicConfig(
-        level=level,
-        format="%(message)s",
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке.
+
+    Стандартный prepare() рендерит запись сразу; здесь рендеринг и запись
+    в поток выполняет QueueListener в фоне, а обработчик апдейта только кладёт
+    запись в очередь.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _sample(_, __, event_dict: dict) -> dict:
+    sampled = event_dict.pop("_sampled", False)
+    if sampled and _sample_rate < 1.0 and random.random() >= _sample_rate:
+        raise structlog.DropEvent
+    return event_dict
+
+
+def _drop_debug_fields(_, __, event_dict: dict) -> dict:
+    """Поля с префиксом debug_ попадают в лог только при уровне DEBUG."""
+    if not _debug_enabled:
+        for key in [key for key in event_dict if key.startswith("debug_")]:
+            del event_dict[key]
+    return event_dict
+
+
+def _render_lazy(_, __, event_dict: dict) -> dict:
+    """Вычисляет значения-callable только для событий, которые точно будут записаны."""
+    for key, value in event_dict.items():
+        if callable(value):
+            event_dict[key] = value()
+    return event_dict
+
+
+def configure_logging(level: int = logging.INFO, sample_rate: float = 1.0) -> None:
+    global _sample_rate, _debug_enabled
+    _sample_rate = sample_rate
+    _debug_enabled = level <= logging.DEBUG
+
+    timestamper = structlog.processors.TimeStamper(fmt="iso")
+    pre_chain = [
+        structlog.stdlib.add_log_level,
+        timestamper,
+    ]
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        structlog.stdlib.ProcessorFormatter(
+            foreign_pre_chain=pre_chain,
+            processors=[
+                structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+                structlog.processors.StackInfoRenderer(),
+                structlog.processors.format_exc_info,
+                structlog.processors.JSONRenderer(),
+            ],
+        )
     )
 
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+
     structlog.configure(
         processors=[
-            structlog.processors.TimeStamper(fmt="iso"),
-            structlog.processors.add_log_level,
-            structlog.processors.StackInfoRenderer(),
-            structlog.processors.format_exc_info,
-            structlog.processors.JSONRenderer(),
+            _sample,
+            _drop_debug_fields,
+            _render_lazy,
+            *pre_chain,
+            structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
         ],
         wrapper_class=structlog.make_filtering_bound_logger(level),
         logger_factory=structlog.stdlib.LoggerFactory(),
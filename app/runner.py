@@ -0,0 +1,125 @@
+"""Сборка и запуск бота: вызывается из main.py."""
+from __future__ import annotations
+
+import logging
+
+import structlog
+from aiogram import Bot
+
+from app.config import get_settings
+from app.db.session import create_engine, create_session_factory
+from app.db.init_db import ensure_primary_group, ensure_schema
+from app.db.invalidation import InvalidationBus
+from app.logging import configure_logging
+from app.security.hmac import hmac_key
+from app.scheduler.jobs import register_shard_jobs, resume_as_leader, setup_scheduler
+from app.scheduler.leader import LeaderElector
+from app.scheduler.shards import ShardWorker
+from app.startup import FirstUpdateMiddleware, StartupTimer
+from app.transport.bot import build_bot, build_dispatcher
+from app.transport.charts import ProgressCharts
+from app.transport.profiles import ProfileCache
+from app.transport.relapses import RelapseBuffer
+from app.transport.signed import CallbackCodec
+from app.transport.commands import setup_bot_commands
+from app.transport.outbox import OutboxWorkerPool
+from app.transport.reg_state import build_reg_state_storage
+
+
+async def main(process_started: float) -> None:
+    """Запуск бота; process_started — perf_counter() в самом начале main.py."""
+    timer = StartupTimer(process_started)
+    timer.phases["imports"] = timer.elapsed_ms()
+
+    with timer.phase("settings"):
+        settings = get_settings()
+        configure_logging(logging.getLevelName(settings.log_level.upper()), settings.log_sample_rate)
+    log = structlog.get_logger()
+
+    log.info("settings_loaded", tz=settings.tz)
+
+    engine = create_engine(settings.database_url)
+
+    # Автоматическое создание схемы (MVP). В проде использовать Alembic.
+    # DDL выполняется только если отпечаток схемы изменился.
+    with timer.phase("schema"):
+        schema_changed = await ensure_schema(engine)
+
+    session_factory = create_session_factory(engine)
+    with timer.phase("primary_group"):
+        await ensure_primary_group(session_factory, settings.group_chat_id)
+    log.info("db_engine_created")
+
+    bot: Bot = build_bot(settings)
+    with timer.phase("bot_commands"):
+        commands_changed = await setup_bot_commands(bot, session_factory)
+
+    with timer.phase("dispatcher"):
+        reg_state = build_reg_state_storage(settings, session_factory)
+        charts = ProgressCharts(session_factory, max_workers=settings.chart_render_workers)
+        profiles = ProfileCache(session_factory, settings.profile_cache_ttl_seconds, settings.profile_cache_max_entries)
+        relapses = RelapseBuffer(session_factory, settings.relapse_flush_seconds) if settings.relapse_write_behind else None
+        codec = CallbackCodec(hmac_key(settings.callback_secret))
+        dp = build_dispatcher(session_factory, reg_state, charts, profiles, settings.throttle_rates, relapses, codec)
+        dp.update.outer_middleware(FirstUpdateMiddleware(timer))
+
+    # Кэши процессов сбрасываются по уведомлениям о коммитах других реплик
+    cache_bus = InvalidationBus(engine, interval=settings.cache_bus_heartbeat_seconds) if settings.cache_bus_enabled else None
+    if cache_bus is not None:
+        cache_bus.start()
+
+    # Планировщик есть в каждой реплике, но стартует на паузе: задачи выполняет
+    # только реплика, захватившая advisory lock; апдейты обслуживают все.
+    with timer.phase("scheduler"):
+        scheduler = setup_scheduler(settings, bot, session_factory, reg_state)
+        scheduler.start(paused=True)
+        leader = LeaderElector(
+            engine,
+            settings.scheduler_lock_id,
+            on_elected=lambda: resume_as_leader(scheduler),
+            on_demoted=scheduler.pause,
+            interval=settings.leader_heartbeat_seconds,
+        )
+        leader.start()
+    log.info("scheduler_started")
+
+    outbox = OutboxWorkerPool(
+        bot,
+        session_factory,
+        workers=settings.outbox_workers,
+        batch_size=settings.outbox_batch_size,
+        max_attempts=settings.outbox_max_attempts,
+    )
+    outbox.start()
+    if relapses is not None:
+        relapses.start()
+
+    # Воркер шардов работает во всех репликах, включая ведомые
+    shard_worker = ShardWorker(session_factory, lease_seconds=settings.shard_lease_seconds)
+    register_shard_jobs(shard_worker, bot, session_factory, settings)
+    shard_worker.start()
+
+    log.info(
+        "startup_complete",
+        total_ms=timer.elapsed_ms(),
+        phases_ms=timer.phases,
+        schema_changed=schema_changed,
+        commands_changed=commands_changed,
+    )
+
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if relapses is not None:
+            await relapses.stop()
+        await outbox.stop()
+        await shard_worker.stop()
+        charts.shutdown()
+        profiles.close()
+        await leader.stop()
+        if cache_bus is not None:
+            await cache_bus.stop()
+        await bot.session.close()
+        await engine.dispose()
+        scheduler.shutdown(wait=False)
+        log.info("shutdown_complete")
@@ -1,163 +1,401 @@
 from __future__ import annotations
 
-from datetime import date
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+from typing import Awaitable, Callable
 from zoneinfo import ZoneInfo
 
 import structlog
 from aiogram import Bot
-from aiogram.types import ChatMemberAdministrator, ChatMemberOwner, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import ChatMemberOwner
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 
 from app.config import Settings
-from app.db.repo import MetricsRepo, UserRepo, TopPostRepo
-from app.db.models import Metrics
+from app.db.repo import ChartCacheRepo, GroupMemberRepo, GroupRepo, JobShardRepo, MetricsHistoryRepo, MetricsRepo, OutboxRepo, PriceHistoryRepo, RankSnapshotRepo, UserRepo
 from app.db.session import AsyncSession, async_sessionmaker
-from app.domain.services import calculate_metrics, generate_admin_title
+from app.domain.services import MILESTONES, calculate_metrics_batch, due_milestone, format_milestone_text, format_rank_change_text, format_top_text, generate_admin_title, local_today, notify_schedule
+from app.scheduler.pipeline import Pipeline, Stage
+from app.scheduler.shards import ShardWorker, run_sharded
+from app.transport.reg_state import RegStateStorage
+from app.transport.outbox import message_payload
 
 
-async def daily_post_top(bot: Bot, session_factory: async_sessionmaker[AsyncSession], settings: Settings) -> None:
+async def for_each_group(
+    session_factory: async_sessionmaker[AsyncSession],
+    concurrency: int,
+    job_name: str,
+    job: Callable[[int], Awaitable[None]],
+) -> None:
+    """Запускает job для каждой активной группы, не более concurrency одновременно.
+
+    Ошибка в одной группе не мешает остальным.
+    """
+    log = structlog.get_logger()
+    async with session_factory() as session:
+        chat_ids = await GroupRepo(session).list_active_ids()
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(chat_id: int) -> None:
+        async with semaphore:
+            try:
+                await job(chat_id)
+            except Exception as e:  # noqa: BLE001
+                log.warning("group_job_failed", job=job_name, chat_id=chat_id, error=str(e))
+
+    await asyncio.gather(*(run(chat_id) for chat_id in chat_ids))
+    log.info("group_job_finished", job=job_name, groups=len(chat_ids))
+
+
+async def post_group_top(bot: Bot, session_factory: async_sessionmaker[AsyncSession], chat_id: int, run_key: str) -> None:
     async with session_factory() as session:
-        repo = MetricsRepo(session)
-        top = await repo.get_top(limit=10)
+        top = await MetricsRepo(session).get_top(limit=10, chat_id=chat_id)
 
     if not top:
         return
 
-    lines = []
-    medals = ["🥇", "🥈", "🥉"]
-    for idx, (user, metrics) in enumerate(top, start=1):
-        prefix = medals[idx - 1] if idx <= 3 else f"{idx}."
-        name = user.full_name or user.username or str(user.user_id)
-        # Рассчитываем рейтинг
-        score = metrics.days - (metrics.relapses * 3)
-        # Добавляем информацию о рецидивах и рейтинге
-        relapse_text = f" (рецидивов: {metrics.relapses}, рейтинг: {score})" if metrics.relapses > 0 else f" (рейтинг: {score})"
-        lines.append(f"{prefix} {name} — {metrics.days} дн.{relapse_text}")
+    # В ежедневном посте не показываем кнопки - только список.
+    # Пост один на чат: воркер outbox редактирует его, только если рейтинг изменился.
+    # Ключ — от run_key конвейера (локальная дата), а не от даты сервера: повтор стадии не задублирует пост.
+    async with session_factory() as session:
+        await OutboxRepo(session).enqueue(
+            "top_post",
+            chat_id,
+            {"text": format_top_text("ТОП-10:", top)},
+            f"top:{chat_id}:{run_key}",
+        )
+        await session.commit()
 
-    text = "ТОП-10:\n" + "\n".join(lines)
 
-    # В ежедневном посте не показываем кнопки - только список
-    kb = InlineKeyboardMarkup(inline_keyboard=[])
+async def daily_post_top(bot: Bot, session_factory: async_sessionmaker[AsyncSession], settings: Settings, run_key: str) -> None:
+    await for_each_group(
+        session_factory,
+        settings.group_fanout_concurrency,
+        "daily_top_post",
+        lambda chat_id: post_group_top(bot, session_factory, chat_id, run_key),
+    )
 
-    try:
-        # Удаляем предыдущий пост ТОПа, если был
-        top_repo = TopPostRepo(session)
-        prev = await top_repo.get_for_chat(settings.group_chat_id, None)
-        if prev is not None:
-            try:
-                # Проверяем права бота перед удалением
-                me = await bot.get_me()
-                member = await bot.get_chat_member(settings.group_chat_id, me.id)
-                if getattr(member, "can_delete_messages", False) or member.status in ("creator", "administrator"):
-                    await bot.delete_message(chat_id=settings.group_chat_id, message_id=prev.message_id)
-                else:
-                    structlog.get_logger().info("Skip delete: no rights in chat %s", settings.group_chat_id)
-            except Exception as e:  # noqa: BLE001
-                structlog.get_logger().warning("daily_top_prev_delete_failed", error=str(e))
 
-        # Отправляем новый пост
-        sent = await bot.send_message(chat_id=settings.group_chat_id, text=text, reply_markup=kb)
-        
-        # Сохраняем информацию о новом посте
-        await top_repo.set(settings.group_chat_id, sent.message_id, None)
-        await session.commit()
-        
-    except Exception as e:  # noqa: BLE001
-        structlog.get_logger().warning("daily_top_post_failed", error=str(e))
+async def update_group_titles(
+    bot: Bot, session_factory: async_sessionmaker[AsyncSession], chat_id: int, shard: tuple[int, int] | None = None
+) -> None:
+    log = structlog.get_logger()
+    async with session_factory() as session:
+        members = await GroupMemberRepo(session).list_member_days(chat_id, shard)
+
+    for user_id, days in members:
+        try:
+            member = await bot.get_chat_member(chat_id, user_id)
+            # Пропускаем владельца — ему нельзя ставить кастом‑тайтл ботом
+            if isinstance(member, ChatMemberOwner):
+                continue
+            await bot.set_chat_administrator_custom_title(
+                chat_id=chat_id,
+                user_id=user_id,
+                custom_title=generate_admin_title(days),
+            )
+        except Exception as e:  # noqa: BLE001
+            log.warning("custom_title_update_failed", chat_id=chat_id, user_id=user_id, error=str(e))
 
 
 async def daily_update(bot: Bot, session_factory: async_sessionmaker[AsyncSession], settings: Settings) -> None:
     log = structlog.get_logger()
     async with session_factory() as session:
-        users = UserRepo(session)
-        metrics_repo = MetricsRepo(session)
-        members = await users.list_all_members()
-        for user in members:
-            m = calculate_metrics(user.quit_date, user.pack_price)
-            # Получаем текущие метрики для сохранения количества рецидивов
-            current_metrics = await session.get(Metrics, user.user_id)
-            if current_metrics and current_metrics.relapses > 0:
-                # Сохраняем количество рецидивов без сброса дней
-                await metrics_repo.upsert_metrics_with_relapses(user.user_id, m.days, m.saved_money, current_metrics.relapses)
-            else:
-                await metrics_repo.upsert_metrics(user.user_id, m.days, m.saved_money)
-            try:
-                if m.days > 0:
-                    member = await bot.get_chat_member(settings.group_chat_id, user.user_id)
-                    # Пропускаем владельца — ему нельзя ставить кастом‑тайтл ботом
-                    if isinstance(member, ChatMemberOwner):
-                        continue
-                    title = generate_admin_title(m.days)
-                    await bot.set_chat_administrator_custom_title(
-                        chat_id=settings.group_chat_id,
-                        user_id=user.user_id,
-                        custom_title=title,
-                    )
-            except Exception as e:  # noqa: BLE001
-                log.warning("custom_title_update_failed", user_id=user.user_id, error=str(e))
+        members = await UserRepo(session).list_all_members()
+        # Все действующие точки одним запросом: список id всех участников не влез бы в параметры
+        latest = await PriceHistoryRepo(session).latest_for()
+        batch = calculate_metrics_batch(
+            [user.quit_date for user in members],
+            [user.pack_price for user in members],
+            local_today(settings.tz),
+            [latest.get(user.user_id) for user in members],
+        )
+        # Рецидивы сохраняются: upsert обновляет только дни и экономию
+        await MetricsRepo(session).upsert_many(
+            zip([user.user_id for user in members], batch.days.tolist(), batch.saved_money.tolist())
+        )
+        await session.commit()
+
+    log.info("daily_metrics_updated", users=len(members))
+
+
+async def capture_metrics_history(session_factory: async_sessionmaker[AsyncSession], run_key: str) -> None:
+    async with session_factory() as session:
+        await MetricsHistoryRepo(session).capture(date.fromisoformat(run_key))
         await session.commit()
 
-    log.info("daily_metrics_updated")
 
+async def update_titles_shard(
+    bot: Bot, session_factory: async_sessionmaker[AsyncSession], settings: Settings, shard_no: int, shard_count: int
+) -> None:
+    # Кастом‑тайтлы ставятся в каждой группе отдельно, группы обрабатываются параллельно
+    await for_each_group(
+        session_factory,
+        settings.group_fanout_concurrency,
+        "custom_titles",
+        lambda chat_id: update_group_titles(bot, session_factory, chat_id, (shard_no, shard_count)),
+    )
 
-async def send_morning_notifications(bot: Bot, session_factory: async_sessionmaker[AsyncSession], settings: Settings) -> None:
-    """Отправляет утренние уведомления пользователям"""
+
+async def daily_update_titles(session_factory: async_sessionmaker[AsyncSession], settings: Settings, run_key: str) -> None:
+    """Раздаёт обновление тайтлов шардами по user_id воркерам всех процессов и ждёт завершения."""
+    await run_sharded(session_factory, "titles", run_key, settings.daily_shards)
+
+
+def register_shard_jobs(
+    worker: ShardWorker, bot: Bot, session_factory: async_sessionmaker[AsyncSession], settings: Settings
+) -> None:
+    worker.register(
+        "titles",
+        lambda shard_no, shard_count, run_key: update_titles_shard(bot, session_factory, settings, shard_no, shard_count),
+    )
+
+
+async def send_due_notifications(
+    bot: Bot, session_factory: async_sessionmaker[AsyncSession], settings: Settings, batch_size: int = 500
+) -> None:
+    """Тик раз в минуту: ставит в outbox напоминания тех, у кого наступило время.
+
+    Каждый тик обрабатывает только «свою» корзину пользователей по индексу
+    next_notify_at и сдвигает им время на следующий день. Ключ идемпотентности
+    содержит локальную дату, так что за день уходит не больше одного напоминания.
+    Стаж и экономия считаются на текущую дату в таймзоне пользователя (notify_tz),
+    а не бота: у пользователя восточнее TZ утреннее напоминание уже учитывает новый день.
+    """
     log = structlog.get_logger()
+    schedule = notify_schedule(settings)
+    grace = timedelta(minutes=settings.notify_grace_minutes)
+    enqueued = 0
     try:
-        async with session_factory() as session:
-            users = UserRepo(session)
-            notify_users = await users.list_with_notifications()
-            log.info("sending_morning_notifications", user_count=len(notify_users))
-            
-            for u in notify_users:
-                try:
-                    m = calculate_metrics(u.quit_date, u.pack_price)
-                    await bot.send_message(
-                        chat_id=u.user_id, 
-                        text=f"Доброе утро! Ваш стаж: {m.days} дн., экономия: {m.saved_money:.0f}₽"
-                    )
-                except Exception as user_error:  # noqa: BLE001
-                    log.warning("notification_failed_for_user", user_id=u.user_id, error=str(user_error))
-                    
+        while True:
+            now = datetime.now(timezone.utc)
+            async with session_factory() as session:
+                users = UserRepo(session)
+                due = await users.claim_due_notifications(now, batch_size)
+                if not due:
+                    break
+
+                latest = await PriceHistoryRepo(session).latest_for([u.user_id for u in due])
+                zones = [ZoneInfo(u.notify_tz or settings.tz) for u in due]
+                batch = calculate_metrics_batch(
+                    [u.quit_date for u in due],
+                    [u.pack_price for u in due],
+                    [now.astimezone(tz).date() for tz in zones],
+                    [latest.get(u.user_id) for u in due],
+                )
+                items = []
+                next_times = []
+                for u, tz, days, saved in zip(due, zones, batch.days.tolist(), batch.saved_money.tolist()):
+                    # NULL — время ещё не рассчитано (включили до появления расписания): только планируем
+                    if u.next_notify_at is not None and now - u.next_notify_at <= grace:
+                        local_day = u.next_notify_at.astimezone(tz).date()
+                        text = f"🔔 Ваш стаж: {days} дн., экономия: {saved:.0f}₽"
+                        items.append(("message", u.user_id, message_payload(text), f"morning:{local_day.isoformat()}:{u.user_id}"))
+                    next_times.append((u.user_id, schedule.next_at(u.user_id, u.notify_time, u.notify_tz, now)))
+
+                await OutboxRepo(session).enqueue_many(items)
+                await users.set_next_notify_many(next_times)
+                await session.commit()
+            enqueued += len(items)
+            if len(due) < batch_size:
+                break
+
     except Exception as e:  # noqa: BLE001
-        log.warning("morning_notifications_failed", error=str(e))
+        log.warning("due_notifications_failed", error=str(e))
+    if enqueued:
+        log.info("enqueue_due_notifications", count=enqueued)
+
+
+async def purge_outbox(session_factory: async_sessionmaker[AsyncSession], settings: Settings) -> None:
+    """Чистка служебных таблиц: доставленный outbox, шарды, кэш графиков, снимки мест.
+
+    Таблицы общие для всех реплик, поэтому задача выполняется только ведущей
+    (как и остальной планировщик). Повторный запуск безопасен: удаляется только
+    старше порога.
+    """
+    # Ключи графиков и снимков рейтинга — локальные даты, а не даты сервера
+    today = local_today(settings.tz)
+    async with session_factory() as session:
+        purged = await OutboxRepo(session).purge_sent(timedelta(days=7))
+        purged_shards = await JobShardRepo(session).purge(timedelta(days=7))
+        # Графики кэшируются на день: вчерашние file_id больше не понадобятся
+        purged_charts = await ChartCacheRepo(session).purge_before(today - timedelta(days=1))
+        # Для уведомлений о смене места нужен только вчерашний снимок, неделя — с запасом
+        purged_ranks = await RankSnapshotRepo(session).purge_before(today - timedelta(days=7))
+        await session.commit()
+    structlog.get_logger().info("outbox_purged", count=purged, shards=purged_shards, charts=purged_charts, ranks=purged_ranks)
+
+
+async def purge_reg_state(reg_state: RegStateStorage) -> None:
+    purged = await reg_state.purge_expired()
+    if purged:
+        structlog.get_logger().info("reg_state_purged", count=purged)
+
+
+async def send_milestones(session_factory: async_sessionmaker[AsyncSession], run_key: str) -> None:
+    """Поздравления с вехами стажа, достигнутыми к дате запуска и ещё не отмеченными.
 
+    Веха выбирается по стажу на дату запуска (>= веха), а не по точному совпадению,
+    и сравнивается с users.milestone_notified, поэтому пропущенные дни догоняются.
+    Ключ идемпотентности milestone:{quit_date}:{веха}:{user_id} не зависит от даты
+    запуска, но включает дату отказа: повтор стадии не поздравит дважды, а после
+    сброса и новой даты отказа с той же вехой поздравят снова.
+    """
+    log = structlog.get_logger()
+    today = date.fromisoformat(run_key)
+    async with session_factory() as session:
+        repo = UserRepo(session)
+        items = []
+        notified: dict[int, int] = {}
+        for u in await repo.list_due_milestones(today, MILESTONES):
+            days = due_milestone(u.quit_date, today, u.milestone_notified) if u.quit_date is not None else None
+            if days is None:
+                continue
+            items.append(
+                ("message", u.user_id, message_payload(format_milestone_text(days)), f"milestone:{u.quit_date.isoformat()}:{days}:{u.user_id}")
+            )
+            notified[u.user_id] = days
+        await OutboxRepo(session).enqueue_many(items)
+        await repo.mark_milestones(notified)
+        await session.commit()
+    log.info("milestones_enqueued", day=run_key, users=len(items))
+
+
+async def notify_rank_changes(session_factory: async_sessionmaker[AsyncSession], settings: Settings, run_key: str) -> None:
+    """Снимок мест за день и уведомления тем, чьё место пересекло пороги относительно вчера.
+
+    Места считаются в рейтинге каждой группы — том же, что в её ТОП-посте.
+    Группы без вчерашнего снимка (первый запуск, простой, новая группа) только
+    сохраняют снимок, иначе весь их ТОП получил бы «вы вошли в ТОП».
+    """
+    log = structlog.get_logger()
+    day = date.fromisoformat(run_key)
+    top = settings.rank_notify_top
+    async with session_factory() as session:
+        snapshots = RankSnapshotRepo(session)
+        await snapshots.capture(day)
+        moves = await snapshots.list_moves(day, top, settings.rank_notify_min_climb)
+        await OutboxRepo(session).enqueue_many(
+            [
+                (
+                    "message",
+                    user_id,
+                    message_payload(format_rank_change_text(prev, cur, top, title)),
+                    f"rank:{run_key}:{chat_id}:{user_id}",
+                )
+                for chat_id, title, user_id, prev, cur in moves
+            ]
+        )
+        await session.commit()
+    log.info("rank_changes_enqueued", day=run_key, users=len(moves))
 
-def setup_scheduler(settings: Settings, bot: Bot, session_factory: async_sessionmaker[AsyncSession]) -> AsyncIOScheduler:
+
+def build_daily_pipeline(settings: Settings, bot: Bot, session_factory: async_sessionmaker[AsyncSession]) -> Pipeline:
+    return Pipeline(
+        "daily",
+        session_factory,
+        [
+            Stage("metrics", lambda run_key: daily_update(bot, session_factory, settings)),
+            Stage("titles", lambda run_key: daily_update_titles(session_factory, settings, run_key), after=("metrics",)),
+            Stage("top_post", lambda run_key: daily_post_top(bot, session_factory, settings, run_key), after=("metrics",)),
+            Stage("history", lambda run_key: capture_metrics_history(session_factory, run_key), after=("metrics",)),
+            Stage("milestones", lambda run_key: send_milestones(session_factory, run_key)),
+            Stage("ranks", lambda run_key: notify_rank_changes(session_factory, settings, run_key), after=("metrics",)),
+        ],
+    )
+
+
+def daily_run_key(settings: Settings) -> str:
+    return datetime.now(ZoneInfo(settings.tz)).date().isoformat()
+
+
+async def run_daily_pipeline(pipeline: Pipeline, settings: Settings) -> None:
+    await pipeline.run(daily_run_key(settings))
+
+
+async def catch_up_daily_pipeline(pipeline: Pipeline, settings: Settings) -> None:
+    now = datetime.now(ZoneInfo(settings.tz))
+    scheduled = now.replace(hour=settings.daily_post_hour, minute=settings.daily_post_minute, second=0, microsecond=0)
+    if now >= scheduled:
+        await pipeline.run(now.date().isoformat())
+
+
+def resume_as_leader(scheduler: AsyncIOScheduler) -> None:
+    """Реплика стала ведущей: включает задачи и докатывает пропущенный ежедневный запуск."""
+    scheduler.resume()
+    daily = scheduler.get_job("daily_pipeline")
+    if daily is not None:
+        scheduler.add_job(
+            func=catch_up_daily_pipeline,
+            args=daily.args,
+            trigger="date",
+            id="daily_pipeline_catch_up",
+            misfire_grace_time=None,
+            replace_existing=True,
+        )
+
+
+def setup_scheduler(
+    settings: Settings,
+    bot: Bot,
+    session_factory: async_sessionmaker[AsyncSession],
+    reg_state: RegStateStorage | None = None,
+) -> AsyncIOScheduler:
     scheduler = AsyncIOScheduler(timezone=ZoneInfo(settings.tz))
 
-    # Ежедневное обновление метрик и тайтлов в указанное время
+    # Ежедневный конвейер: пересчёт метрик, затем тайтлы и пост ТОПа — сразу по готовности метрик
+    daily = build_daily_pipeline(settings, bot, session_factory)
     scheduler.add_job(
-        func=daily_update,
-        args=[bot, session_factory, settings],
+        func=run_daily_pipeline,
+        args=[daily, settings],
         trigger="cron",
         hour=settings.daily_post_hour,
         minute=settings.daily_post_minute,
-        id="daily_metrics_update",
+        id="daily_pipeline",
+        coalesce=True,
+        max_instances=1,
+        misfire_grace_time=3600,
         replace_existing=True,
     )
 
-    # Ежедневный пост ТОП-10 в группу через 1 минуту после обновления метрик
+    # Персональные напоминания: каждую минуту только пользователи, у которых наступило время
     scheduler.add_job(
-        func=daily_post_top,
+        func=send_due_notifications,
         args=[bot, session_factory, settings],
-        trigger="cron",
-        hour=settings.daily_post_hour,
-        minute=settings.daily_post_minute + 1,
-        id="daily_top_post",
+        trigger="interval",
+        minutes=1,
+        id="due_notifications",
+        coalesce=True,
+        max_instances=1,
         replace_existing=True,
     )
 
-    # Утренние уведомления пользователям через 2 минуты после обновления метрик
+    # Чистка доставленных сообщений outbox и служебных таблиц — только на ведущей реплике.
+    # Если в 04:00 ведущей не было (смена лидера, простой), чистка выполнится, когда
+    # реплика станет ведущей в течение суток.
     scheduler.add_job(
-        func=send_morning_notifications,
-        args=[bot, session_factory, settings],
+        func=purge_outbox,
+        args=[session_factory, settings],
         trigger="cron",
-        hour=settings.daily_post_hour,
-        minute=settings.daily_post_minute + 2,
-        id="morning_notifications",
+        hour=4,
+        minute=0,
+        id="outbox_purge",
+        coalesce=True,
+        max_instances=1,
+        misfire_grace_time=24 * 3600,
         replace_existing=True,
     )
 
+    # Чистка просроченных состояний мастера регистрации
+    if reg_state is not None:
+        scheduler.add_job(
+            func=purge_reg_state,
+            args=[reg_state],
+            trigger="interval",
+            minutes=15,
+            id="reg_state_purge",
+            replace_existing=True,
+        )
+
     return scheduler
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Callable
+
+import structlog
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+# Держим ли мы ещё блокировку: pg_locks раскладывает bigint-ключ на classid/objid, objsubid=1
+_HOLDS_LOCK = text(
+    "SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid() AND granted "
+    "AND classid = CAST(:classid AS oid) AND objid = CAST(:objid AS oid) AND objsubid = 1)"
+)
+
+
+class LeaderElector:
+    """Выбор ведущей реплики через advisory lock Postgres.
+
+    Блокировка сессионная и живёт, пока открыто выделенное соединение: если
+    процесс умирает или теряет связь с БД, Postgres снимает её сам, и другая
+    реплика захватывает её на следующей попытке. Ведущий раз в interval
+    проверяет, что блокировка по-прежнему за ним (heartbeat); при ошибке или
+    таймауте он немедленно слагает полномочия и закрывает соединение.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        lock_id: int,
+        on_elected: Callable[[], None],
+        on_demoted: Callable[[], None],
+        interval: float = 10.0,
+    ) -> None:
+        self.engine = engine
+        self.lock_id = lock_id
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.interval = interval
+        self.is_leader = False
+        self._conn: AsyncConnection | None = None
+        self._task: asyncio.Task[None] | None = None
+        self.log = structlog.get_logger()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="leader-elector")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.is_leader:
+            self._set_leader(False)
+        # Закрытие соединения освобождает блокировку — другая реплика подхватит задачи без ожидания
+        await self._close()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._tick(), timeout=self.interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # noqa: BLE001
+                self.log.warning("leader_heartbeat_failed", lock_id=self.lock_id, error=str(e))
+                if self.is_leader:
+                    self._set_leader(False)
+                await self._close()
+            await asyncio.sleep(self.interval)
+
+    async def _tick(self) -> None:
+        if self._conn is None:
+            conn = await self.engine.connect()
+            await conn.execution_options(isolation_level="AUTOCOMMIT")
+            self._conn = conn
+
+        if self.is_leader:
+            held = await self._conn.scalar(_HOLDS_LOCK, {"classid": self.lock_id >> 32, "objid": self.lock_id & 0xFFFFFFFF})
+            if not held:
+                self._set_leader(False)
+            return
+
+        acquired = await self._conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.lock_id})
+        if acquired:
+            self._set_leader(True)
+
+    def _set_leader(self, leader: bool) -> None:
+        self.is_leader = leader
+        self.log.info("leader_elected" if leader else "leader_demoted", lock_id=self.lock_id)
+        (self.on_elected if leader else self.on_demoted)()
+
+    async def _close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                await conn.invalidate()
+                await conn.close()
+            except Exception:  # noqa: BLE001
+                pass
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Awaitable, Callable
+
+import structlog
+
+from app.db.repo import JobRunRepo
+from app.db.session import AsyncSession, async_sessionmaker
+
+
+@dataclass(frozen=True, slots=True)
+class Stage:
+    name: str
+    run: Callable[[str], Awaitable[None]]  # получает run_key
+    # Стадии, которые должны успешно завершиться до запуска этой
+    after: tuple[str, ...] = ()
+
+
+class Pipeline:
+    """Небольшой DAG задач: стадия стартует сразу, как только готовы её зависимости.
+
+    Независимые стадии идут параллельно. Повторный запуск, пока идёт текущий,
+    схлопывается. Успешные стадии записываются в job_runs по run_key, поэтому
+    запуск с тем же ключом после простоя или сбоя докатывает только недостающие стадии.
+    """
+
+    def __init__(self, name: str, session_factory: async_sessionmaker[AsyncSession], stages: list[Stage]) -> None:
+        self.name = name
+        self.session_factory = session_factory
+        self.stages = self._toposort(stages)
+        self._lock = asyncio.Lock()
+        self.log = structlog.get_logger()
+
+    @staticmethod
+    def _toposort(stages: list[Stage]) -> list[Stage]:
+        by_name = {stage.name: stage for stage in stages}
+        if len(by_name) != len(stages):
+            raise ValueError("duplicate stage names")
+        for stage in stages:
+            unknown = set(stage.after) - by_name.keys()
+            if unknown:
+                raise ValueError(f"stage {stage.name!r} depends on unknown stages {sorted(unknown)}")
+
+        ordered: list[Stage] = []
+        ready = [stage for stage in stages if not stage.after]
+        pending = {stage.name: set(stage.after) for stage in stages if stage.after}
+        while ready:
+            stage = ready.pop(0)
+            ordered.append(stage)
+            for name, deps in list(pending.items()):
+                deps.discard(stage.name)
+                if not deps:
+                    del pending[name]
+                    ready.append(by_name[name])
+        if pending:
+            raise ValueError(f"dependency cycle between stages {sorted(pending)}")
+        return ordered
+
+    async def run(self, run_key: str) -> bool:
+        """Выполняет недостающие стадии запуска run_key. Возвращает True, если все стадии успешны."""
+        if self._lock.locked():
+            self.log.info("pipeline_coalesced", pipeline=self.name, run_key=run_key)
+            return False
+
+        async with self._lock:
+            async with self.session_factory() as session:
+                done = await JobRunRepo(session).completed_stages(self.name, run_key)
+            if all(stage.name in done for stage in self.stages):
+                return True
+
+            started = time.perf_counter()
+            tasks: dict[str, asyncio.Task[bool]] = {}
+            # Порядок топологический, поэтому задачи зависимостей уже созданы
+            for stage in self.stages:
+                deps = [tasks[name] for name in stage.after]
+                tasks[stage.name] = asyncio.create_task(self._run_stage(stage, run_key, deps, stage.name in done))
+            results = await asyncio.gather(*tasks.values())
+
+            self.log.info(
+                "pipeline_finished",
+                pipeline=self.name,
+                run_key=run_key,
+                ok=all(results),
+                duration_ms=round((time.perf_counter() - started) * 1000),
+            )
+            return all(results)
+
+    async def _run_stage(self, stage: Stage, run_key: str, deps: list[asyncio.Task[bool]], already_done: bool) -> bool:
+        if not all(await asyncio.gather(*deps)):
+            await self._record(stage.name, run_key, "skipped", datetime.now(timezone.utc), 0)
+            return False
+        if already_done:
+            return True
+
+        started_at = datetime.now(timezone.utc)
+        started = time.perf_counter()
+        status, error = "ok", None
+        try:
+            await stage.run(run_key)
+        except Exception as e:  # noqa: BLE001
+            status, error = "failed", str(e)
+        duration_ms = round((time.perf_counter() - started) * 1000)
+
+        log = self.log.info if status == "ok" else self.log.warning
+        log("pipeline_stage_finished", pipeline=self.name, stage=stage.name, status=status, duration_ms=duration_ms, error=error)
+        await self._record(stage.name, run_key, status, started_at, duration_ms, error)
+        return status == "ok"
+
+    async def _record(
+        self, stage: str, run_key: str, status: str, started_at: datetime, duration_ms: int, error: str | None = None
+    ) -> None:
+        try:
+            async with self.session_factory() as session:
+                await JobRunRepo(session).record(self.name, run_key, stage, status, started_at, duration_ms, error)
+                await session.commit()
+        except Exception as e:  # noqa: BLE001
+            self.log.warning("pipeline_record_failed", pipeline=self.name, stage=stage, error=str(e))
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+from datetime import timedelta
+from typing import Awaitable, Callable
+
+import structlog
+
+from app.db.models import JobShard
+from app.db.repo import JobShardRepo
+from app.db.session import AsyncSession, async_sessionmaker
+
+# Обработчик шарда: (номер шарда, всего шардов, run_key)
+ShardHandler = Callable[[int, int, str], Awaitable[None]]
+
+
+class ShardWorker:
+    """Забирает шарды распределённых задач из job_shards и выполняет их.
+
+    Запускается в каждом процессе, поэтому N процессов делят задачу примерно
+    поровну. Пока шард выполняется, аренда продлевается; если процесс умер,
+    аренда истекает и шард забирает другой воркер. Если продлить аренду не
+    удалось (она истекла или шард уже у другого), обработчик отменяется —
+    два воркера не выполняют один шард одновременно.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        lease_seconds: int = 120,
+        max_attempts: int = 3,
+        poll_interval: float = 5.0,
+    ) -> None:
+        self.session_factory = session_factory
+        self.lease = timedelta(seconds=lease_seconds)
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.handlers: dict[str, ShardHandler] = {}
+        self._task: asyncio.Task[None] | None = None
+        self.log = structlog.get_logger()
+
+    def register(self, job: str, handler: ShardHandler) -> None:
+        if job in self.handlers:
+            raise ValueError(f"shard handler for {job!r} is already registered")
+        self.handlers[job] = handler
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="shard-worker")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                processed = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # noqa: BLE001
+                self.log.warning("shard_worker_failed", worker=self.worker_id, error=str(e))
+                processed = False
+            if not processed:
+                await asyncio.sleep(self.poll_interval)
+
+    async def run_once(self) -> bool:
+        """Забирает и выполняет один шард. Возвращает False, если свободных шардов нет."""
+        async with self.session_factory() as session:
+            shard = await JobShardRepo(session).claim(self.lease, self.worker_id)
+            await session.commit()
+        if shard is None:
+            return False
+
+        work = asyncio.create_task(self._execute(shard))
+        renewer = asyncio.create_task(self._renew(shard))
+        try:
+            await asyncio.wait({work, renewer}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            renewer.cancel()
+            if not work.done():
+                work.cancel()
+                await asyncio.gather(work, return_exceptions=True)
+
+        if work.cancelled():
+            self.log.warning("shard_lease_lost", job=shard.job, run_key=shard.run_key, shard=shard.shard_no, attempts=shard.attempts)
+            return True
+        error = work.exception()
+        if error is not None:
+            self.log.warning("shard_failed", job=shard.job, run_key=shard.run_key, shard=shard.shard_no, attempts=shard.attempts, error=str(error))
+        await self._finish(shard, error=str(error) if error is not None else None)
+        return True
+
+    async def _execute(self, shard: JobShard) -> None:
+        handler = self.handlers.get(shard.job)
+        if handler is None:
+            raise LookupError(f"no shard handler for job {shard.job!r}")
+        await handler(shard.shard_no, shard.shard_count, shard.run_key)
+
+    async def _renew(self, shard: JobShard) -> None:
+        """Продлевает аренду, пока она наша; возвращается, когда аренда потеряна."""
+        while True:
+            await asyncio.sleep(self.lease.total_seconds() / 3)
+            try:
+                async with self.session_factory() as session:
+                    renewed = await JobShardRepo(session).renew(shard.id, self.worker_id, self.lease)
+                    await session.commit()
+            except Exception as e:  # noqa: BLE001
+                # Сбой БД: аренда ещё может действовать, попробуем на следующем шаге
+                self.log.warning("shard_lease_renew_failed", shard_id=shard.id, error=str(e))
+                continue
+            if not renewed:
+                return
+
+    async def _finish(self, shard: JobShard, error: str | None = None) -> None:
+        async with self.session_factory() as session:
+            repo = JobShardRepo(session)
+            if error is None:
+                held = await repo.finish(shard.id, self.worker_id, shard.attempts)
+            else:
+                held = await repo.fail(shard.id, self.worker_id, shard.attempts, error, self.max_attempts)
+            await session.commit()
+        if not held:
+            self.log.warning("shard_result_discarded", job=shard.job, run_key=shard.run_key, shard=shard.shard_no, attempts=shard.attempts)
+
+
+async def run_sharded(
+    session_factory: async_sessionmaker[AsyncSession],
+    job: str,
+    run_key: str,
+    shard_count: int,
+    timeout: timedelta = timedelta(hours=2),
+    poll_interval: float = 2.0,
+) -> None:
+    """Ставит шарды задачи в очередь и ждёт, пока воркеры всех процессов их выполнят.
+
+    Повторный вызов с тем же run_key не повторяет готовые шарды. Исключение,
+    если какой-то шард исчерпал попытки или не уложился в timeout.
+    """
+    async with session_factory() as session:
+        await JobShardRepo(session).create(job, run_key, shard_count)
+        await session.commit()
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout.total_seconds()
+    while True:
+        async with session_factory() as session:
+            counts = await JobShardRepo(session).status_counts(job, run_key)
+        if counts.get("failed"):
+            raise RuntimeError(f"{counts['failed']} shard(s) of {job} {run_key} failed")
+        if counts.get("done", 0) >= shard_count:
+            return
+        if loop.time() >= deadline:
+            raise TimeoutError(f"{job} {run_key} did not finish in time: {counts}")
+        await asyncio.sleep(poll_interval)
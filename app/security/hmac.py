@@ -1,10 +1,41 @@
 import hmac
 import hashlib
+from functools import lru_cache
+
+
+class HmacKey:
+    """HMAC-SHA256 с заранее подготовленным ключом.
+
+    Разбор ключа (дополнение до блока, ipad/opad) делается один раз, на каждое
+    сообщение копируется готовое состояние — copy() дешевле hmac.new().
+    """
+
+    def __init__(self, secret: str | bytes) -> None:
+        if isinstance(secret, str):
+            secret = secret.encode("utf-8")
+        self._state = hmac.new(secret, digestmod=hashlib.sha256)
+
+    def digest(self, message: bytes) -> bytes:
+        mac = self._state.copy()
+        mac.update(message)
+        return mac.digest()
+
+    def sign(self, message: bytes, size: int = 32) -> bytes:
+        """Подпись, усечённая до size байт."""
+        return self.digest(message)[:size]
+
+    def verify(self, message: bytes, signature: bytes) -> bool:
+        return hmac.compare_digest(self.sign(message, len(signature)), signature) if signature else False
+
+
+@lru_cache(maxsize=8)
+def hmac_key(secret: str) -> HmacKey:
+    return HmacKey(secret)
 
 
 def make_signature(secret: str, *parts: str) -> str:
     message = ":".join(parts).encode("utf-8")
-    return hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+    return hmac_key(secret).digest(message).hex()
 
 
 def verify_signature(secret: str, signature: str, *parts: str) -> bool:
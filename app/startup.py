@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterator
+
+import structlog
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+# Время запуска процесса по настенным часам — для сравнения с датами апдейтов Telegram
+PROCESS_STARTED_AT = datetime.now(timezone.utc)
+
+
+class StartupTimer:
+    """Замеряет длительность фаз старта и время до первого обработанного апдейта."""
+
+    def __init__(self, started_at: float | None = None) -> None:
+        self.started_at = time.perf_counter() if started_at is None else started_at
+        self.phases: dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        phase_started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round((time.perf_counter() - phase_started) * 1000, 1)
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started_at) * 1000, 1)
+
+
+class FirstUpdateMiddleware(BaseMiddleware):
+    """Один раз логирует время от старта процесса до первого обработанного апдейта."""
+
+    def __init__(self, timer: StartupTimer) -> None:
+        super().__init__()
+        self.timer = timer
+        self.seen = False
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Any], event: TelegramObject, data: dict[str, Any]) -> Any:  # type: ignore[override]
+        if self.seen:
+            return await handler(event, data)
+        self.seen = True
+        try:
+            return await handler(event, data)
+        finally:
+            structlog.get_logger().info("first_update_handled", since_start_ms=self.timer.elapsed_ms())
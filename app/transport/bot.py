@@ -1,5 +1,6 @@
 from contextlib import AsyncExitStack
 import logging
+from typing import Mapping
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.bot import DefaultBotProperties
@@ -7,7 +8,16 @@ from aiogram.client.bot import DefaultBotProperties
 from app.config import Settings
 from app.transport.handlers import start as start_handlers
 from app.transport.handlers import registration, stats, notify, group, reset
-from app.transport.di import DbSessionMiddleware
+from app.transport.callbacks import callbacks
+from app.transport.deliverability import ReviveMiddleware
+from app.transport.charts import ProgressCharts
+from app.transport.di import ChartsMiddleware, DbSessionMiddleware, KeyboardsMiddleware, ProfilesMiddleware, RegStateMiddleware, RelapseBufferMiddleware
+from app.transport.keyboards import keyboards
+from app.transport.profiles import ProfileCache
+from app.transport.signed import CallbackCodec, SignedCallbackMiddleware
+from app.transport.throttling import ThrottlingMiddleware
+from app.transport.relapses import RelapseBuffer
+from app.transport.reg_state import MemoryRegStateStorage, RegStateStorage
 from app.db.session import AsyncSession, async_sessionmaker
 
 logger = logging.getLogger(__name__)
@@ -17,29 +27,60 @@ def build_bot(settings: Settings) -> Bot:
     return Bot(token=settings.bot_token, default=DefaultBotProperties(parse_mode=None))
 
 
-def build_dispatcher(session_factory: async_sessionmaker[AsyncSession] | None = None) -> Dispatcher:
+def build_dispatcher(
+    session_factory: async_sessionmaker[AsyncSession] | None = None,
+    reg_state: RegStateStorage | None = None,
+    charts: ProgressCharts | None = None,
+    profiles: ProfileCache | None = None,
+    throttle_rates: Mapping[str, float] | None = None,
+    relapses: RelapseBuffer | None = None,
+    callback_codec: CallbackCodec | None = None,
+) -> Dispatcher:
     dp = Dispatcher()
+    dp_keyboards = keyboards
+    if callback_codec is not None:
+        # Подпись проверяется внешним middleware — раньше антифлуда, DI и обработчиков.
+        # Подписанные клавиатуры — собственные у диспетчера, общий реестр не меняется.
+        dp_keyboards = keyboards.signed(callback_codec)
+        dp.callback_query.outer_middleware(SignedCallbackMiddleware(callback_codec))
+    dp.update.middleware(KeyboardsMiddleware(dp_keyboards))
+    dp.callback_query.middleware(ThrottlingMiddleware(throttle_rates or {}))
 
     if session_factory is not None:
         dp.update.middleware(DbSessionMiddleware(session_factory))
+        if profiles is None:
+            # Без явного кэша — свой на диспетчер с настройками по умолчанию; при остановке
+            # он отписывается от инвалидации, иначе каждый такой диспетчер оставлял бы подписчика
+            own_profiles = profiles = ProfileCache(session_factory)
+
+            async def close_profiles() -> None:
+                own_profiles.close()
+
+            dp.shutdown.register(close_profiles)
+        dp.update.middleware(ProfilesMiddleware(profiles))
+        revive = ReviveMiddleware()
+        dp.message.middleware(revive)
+        dp.callback_query.middleware(revive)
+    if reg_state is None:
+        reg_state = MemoryRegStateStorage(ttl_seconds=3600, max_entries=10000)
+    dp.update.middleware(RegStateMiddleware(reg_state))
+    if charts is not None:
+        dp.update.middleware(ChartsMiddleware(charts))
+    if relapses is not None:
+        dp.update.middleware(RelapseBufferMiddleware(relapses))
+
+    # Все callback_query маршрутизируются одной таблицей (словарь + trie по префиксам)
+    dp.include_router(callbacks.router)
 
     # Регистрируем специализированные обработчики ПЕРЕД общими
-    logger.info("Registering specialized routers first:")
     dp.include_router(registration.router)
-    logger.info("✓ registration.router registered")
     dp.include_router(stats.router)
-    logger.info("✓ stats.router registered")
     dp.include_router(notify.router)
-    logger.info("✓ notify.router registered")
     dp.include_router(group.router)
-    logger.info("✓ group.router registered")
     dp.include_router(reset.router)
-    logger.info("✓ reset.router registered")
     
     # Регистрируем общие обработчики ПОСЛЕ специализированных
-    logger.info("Registering general routers last:")
     dp.include_router(start_handlers.router)
-    logger.info("✓ start_handlers.router registered")
     
-    logger.info("All routers registered successfully")
+    logger.debug("All routers registered")
     return dp
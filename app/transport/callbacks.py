@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import inspect
+import logging
+from typing import Any, Awaitable, Callable, NamedTuple
+
+from aiogram import Router
+from aiogram.types import CallbackQuery
+
+logger = logging.getLogger(__name__)
+
+SEP = ":"
+
+CallbackHandler = Callable[..., Awaitable[Any]]
+
+
+def pack(*parts: object) -> str:
+    """Собирает callback_data из сегментов: pack("rating", "top", 10) -> "rating:top:10"."""
+    data = SEP.join(str(part) for part in parts)
+    if len(data.encode("utf-8")) > 64:
+        raise ValueError(f"callback_data longer than 64 bytes: {data!r}")
+    return data
+
+
+def unpack(data: str) -> tuple[str, ...]:
+    return tuple(data.split(SEP))
+
+
+class CallbackPayload(NamedTuple):
+    key: str  # ключ, по которому найден обработчик
+    args: tuple[str, ...]  # сегменты после префикса (для exact — пусто)
+
+
+class _Entry:
+    __slots__ = ("handler", "params")
+
+    def __init__(self, handler: CallbackHandler) -> None:
+        self.handler = handler
+        # Имена параметров после первого (callback) — их подставляем из data диспетчера
+        self.params = tuple(inspect.signature(handler).parameters)[1:]
+
+
+class _Node:
+    __slots__ = ("children", "entry")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _Node] = {}
+        self.entry: _Entry | None = None
+
+
+class CallbackTable:
+    """Таблица маршрутизации callback_query.
+
+    Точные ключи ищутся в словаре, префиксы — в trie по сегментам callback_data,
+    поэтому стоимость маршрутизации не зависит от числа обработчиков.
+    """
+
+    def __init__(self) -> None:
+        self._exact: dict[str, _Entry] = {}
+        self._root = _Node()
+        self.router = Router(name="callbacks")
+        self.router.callback_query.register(self._dispatch)
+
+    def exact(self, *keys: str) -> Callable[[CallbackHandler], CallbackHandler]:
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            entry = _Entry(handler)
+            for key in keys:
+                if key in self._exact:
+                    raise ValueError(f"callback {key!r} is already registered")
+                self._exact[key] = entry
+            return handler
+
+        return decorator
+
+    def prefix(self, *prefixes: str) -> Callable[[CallbackHandler], CallbackHandler]:
+        """Регистрирует обработчик на все callback_data вида "<prefix>:<args...>"."""
+
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            entry = _Entry(handler)
+            for prefix in prefixes:
+                node = self._root
+                for segment in unpack(prefix):
+                    node = node.children.setdefault(segment, _Node())
+                if node.entry is not None:
+                    raise ValueError(f"callback prefix {prefix!r} is already registered")
+                node.entry = entry
+            return handler
+
+        return decorator
+
+    def resolve(self, data: str) -> tuple[_Entry, CallbackPayload] | None:
+        entry = self._exact.get(data)
+        if entry is not None:
+            return entry, CallbackPayload(data, ())
+
+        # Ищем самый длинный зарегистрированный префикс
+        segments = unpack(data)
+        node = self._root
+        found: tuple[_Entry, int] | None = None
+        for depth, segment in enumerate(segments, start=1):
+            node = node.children.get(segment)  # type: ignore[assignment]
+            if node is None:
+                break
+            if node.entry is not None:
+                found = (node.entry, depth)
+        if found is None:
+            return None
+        entry, depth = found
+        return entry, CallbackPayload(SEP.join(segments[:depth]), segments[depth:])
+
+    async def _dispatch(self, callback: CallbackQuery, **data: Any) -> Any:
+        resolved = self.resolve(callback.data) if callback.data else None
+        if resolved is None:
+            # Устаревшая или чужая кнопка: сразу снимаем «часики» у клиента
+            logger.debug("Unknown callback_data %r from user %s", callback.data, callback.from_user.id)
+            await callback.answer("Кнопка устарела. Откройте меню заново: /menu")
+            return None
+
+        entry, payload = resolved
+        data["payload"] = payload
+        kwargs = {name: data[name] for name in entry.params if name in data}
+        return await entry.handler(callback, **kwargs)
+
+
+callbacks = CallbackTable()
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Awaitable, Callable, Optional
+
+from aiogram.types import BufferedInputFile, Message
+
+from app.chart_render import render_progress_chart
+from app.db.repo import ChartCacheRepo
+from app.db.session import AsyncSession, async_sessionmaker
+
+ChartPoints = list[tuple[date, int, float]]
+
+# Результат рендера для ожидающих: график отправлен, но file_id не получен — рендерят сами
+_NOT_CACHED = ""
+
+
+class ProgressCharts:
+    """Отправка графика прогресса с рендерингом в пуле процессов.
+
+    matplotlib работает в отдельных процессах и не блокирует event loop.
+    Готовый график загружается в Telegram один раз за день: его file_id
+    хранится в chart_cache, повторные показы отправляют только file_id.
+    Одновременные запросы одного графика ждут первый рендер, а не запускают свой.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker[AsyncSession], max_workers: int = 2) -> None:
+        self.session_factory = session_factory
+        self.max_workers = max_workers
+        self._executor: ProcessPoolExecutor | None = None
+        self._inflight: dict[tuple[int, date], asyncio.Future[Optional[str]]] = {}
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Пул создаётся при первом рендере; spawn — чтобы не форкать процесс с потоками и открытыми соединениями
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def send(
+        self, message: Message, user_id: int, day: date, load_points: Callable[[], Awaitable[ChartPoints]]
+    ) -> bool:
+        """Отправляет график за day в чат message. False — данных для графика нет.
+
+        Ошибка рендера или отправки пробрасывается и первому запросу, и ожидающим его.
+        """
+        key = (user_id, day)
+        async with self.session_factory() as session:
+            file_id = await ChartCacheRepo(session).get(user_id, day)
+
+        if file_id is None and key in self._inflight:
+            file_id = await asyncio.shield(self._inflight[key])
+            if file_id is None:
+                return False
+        if file_id:
+            await message.answer_photo(file_id)
+            return True
+
+        loop = asyncio.get_running_loop()
+        inflight: asyncio.Future[Optional[str]] = loop.create_future()
+        self._inflight[key] = inflight
+        try:
+            points = await load_points()
+            if len(points) < 2:
+                inflight.set_result(None)
+                return False
+            png = await loop.run_in_executor(self._pool(), render_progress_chart, points)
+            sent = await message.answer_photo(BufferedInputFile(png, filename="progress.png"))
+            file_id = sent.photo[-1].file_id if sent.photo else None
+            if file_id is not None:
+                async with self.session_factory() as session:
+                    await ChartCacheRepo(session).set(user_id, day, file_id)
+                    await session.commit()
+            inflight.set_result(file_id or _NOT_CACHED)
+            return True
+        except BaseException as e:
+            # Ожидающие получают ту же ошибку, что и первый запрос, а не «мало данных»
+            if not inflight.done():
+                inflight.set_exception(e if isinstance(e, Exception) else RuntimeError("chart render interrupted"))
+                # Ожидающих может не быть — помечаем исключение полученным, чтобы asyncio не ругался
+                inflight.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
@@ -1,20 +1,54 @@
 from __future__ import annotations
 
+import hashlib
+import json
+
 from aiogram import Bot
 from aiogram.types import BotCommand, BotCommandScopeAllGroupChats, BotCommandScopeDefault
 
+from app.db.repo import AppMetaRepo
+from app.db.session import AsyncSession, async_sessionmaker
+
+COMMANDS_FINGERPRINT_KEY = "bot_commands_fingerprint"
+
+# Команды для групповых чатов
+GROUP_COMMANDS = [
+    BotCommand(command="top_members", description="ТОП-10 стажа"),
+]
+
+# Команды для личных чатов
+PRIVATE_COMMANDS = [
+    BotCommand(command="start", description="Запустить бота"),
+    BotCommand(command="menu", description="Главное меню"),
+    BotCommand(command="help", description="Справка по боту"),
+]
+
+
+def commands_fingerprint(bot_id: int) -> str:
+    payload = {
+        "bot_id": bot_id,
+        "group": [c.model_dump() for c in GROUP_COMMANDS],
+        "private": [c.model_dump() for c in PRIVATE_COMMANDS],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+async def setup_bot_commands(bot: Bot, session_factory: async_sessionmaker[AsyncSession] | None = None) -> bool:
+    """Публикует команды бота, если набор изменился с прошлого запуска.
+
+    Возвращает True, если выполнялись вызовы set_my_commands.
+    """
+    fingerprint = commands_fingerprint(bot.id)
+    if session_factory is not None:
+        async with session_factory() as session:
+            if await AppMetaRepo(session).get(COMMANDS_FINGERPRINT_KEY) == fingerprint:
+                return False
+
+    await bot.set_my_commands(commands=GROUP_COMMANDS, scope=BotCommandScopeAllGroupChats())
+    await bot.set_my_commands(commands=PRIVATE_COMMANDS, scope=BotCommandScopeDefault())
 
-async def setup_bot_commands(bot: Bot) -> None:
-    # Команды для групповых чатов
-    group_commands = [
-        BotCommand(command="top_members", description="ТОП-10 стажа"),
-    ]
-    await bot.set_my_commands(commands=group_commands, scope=BotCommandScopeAllGroupChats())
-    
-    # Команды для личных чатов
-    private_commands = [
-        BotCommand(command="start", description="Запустить бота"),
-        BotCommand(command="menu", description="Главное меню"),
-        BotCommand(command="help", description="Справка по боту"),
-    ]
-    await bot.set_my_commands(commands=private_commands, scope=BotCommandScopeDefault())
+    if session_factory is not None:
+        async with session_factory() as session:
+            await AppMetaRepo(session).set(COMMANDS_FINGERPRINT_KEY, fingerprint)
+            await session.commit()
+    return True
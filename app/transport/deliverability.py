@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import Chat, TelegramObject, User as TgUser
+
+from app.cache import TTLCache
+from app.db.repo import UserRepo
+
+
+def classify_delivery_error(exc: Exception) -> Optional[str]:
+    """Состояние доставляемости для ошибки отправки в ЛС или None, если ошибка временная."""
+    message = str(exc).lower()
+    if isinstance(exc, TelegramForbiddenError):
+        if "deactivated" in message:
+            return "deactivated"
+        # "bot was blocked by the user", "bot can't initiate conversation"
+        return "blocked"
+    if isinstance(exc, TelegramBadRequest) and ("chat not found" in message or "user not found" in message):
+        return "not_found"
+    return None
+
+
+class ReviveMiddleware(BaseMiddleware):
+    """Возвращает пользователя в рассылки, когда он сам пишет боту в ЛС.
+
+    UPDATE условный (только для недоступных), а недавно проверенные user_id
+    кэшируются, чтобы не ходить в БД на каждое сообщение.
+    """
+
+    def __init__(self, ttl_seconds: int = 600, max_entries: int = 50000) -> None:
+        super().__init__()
+        self._checked: TTLCache[int, bool] = TTLCache(maxsize=max_entries, ttl=ttl_seconds)
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Any], event: TelegramObject, data: dict[str, Any]) -> Any:  # type: ignore[override]
+        user: TgUser | None = data.get("event_from_user")
+        chat: Chat | None = data.get("event_chat")
+        session_factory = data.get("session_factory")
+        private = chat is not None and chat.type == "private"
+        if private and user is not None and session_factory is not None and self._checked.get(user.id) is None:
+            async with session_factory() as session:
+                if await UserRepo(session).mark_reachable(user.id):
+                    await session.commit()
+            self._checked.set(user.id, True)
+        return await handler(event, data)
@@ -6,6 +6,12 @@ from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
+from app.transport.charts import ProgressCharts
+from app.transport.keyboards import KeyboardRegistry
+from app.transport.profiles import ProfileCache
+from app.transport.relapses import RelapseBuffer
+from app.transport.reg_state import RegStateStorage
+
 
 class DbSessionMiddleware(BaseMiddleware):
     def __init__(self, session_factory: async_sessionmaker[AsyncSession]) -> None:
@@ -15,3 +21,53 @@ class DbSessionMiddleware(BaseMiddleware):
     async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Any], event: TelegramObject, data: dict[str, Any]) -> Any:  # type: ignore[override]
         data["session_factory"] = self.session_factory
         return await handler(event, data)
+
+
+class RegStateMiddleware(BaseMiddleware):
+    def __init__(self, storage: RegStateStorage) -> None:
+        super().__init__()
+        self.storage = storage
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Any], event: TelegramObject, data: dict[str, Any]) -> Any:  # type: ignore[override]
+        data["reg_state"] = self.storage
+        return await handler(event, data)
+
+
+class ChartsMiddleware(BaseMiddleware):
+    def __init__(self, charts: ProgressCharts) -> None:
+        super().__init__()
+        self.charts = charts
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Any], event: TelegramObject, data: dict[str, Any]) -> Any:  # type: ignore[override]
+        data["charts"] = self.charts
+        return await handler(event, data)
+
+
+class ProfilesMiddleware(BaseMiddleware):
+    def __init__(self, profiles: ProfileCache) -> None:
+        super().__init__()
+        self.profiles = profiles
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Any], event: TelegramObject, data: dict[str, Any]) -> Any:  # type: ignore[override]
+        data["profiles"] = self.profiles
+        return await handler(event, data)
+
+
+class RelapseBufferMiddleware(BaseMiddleware):
+    def __init__(self, relapses: RelapseBuffer) -> None:
+        super().__init__()
+        self.relapses = relapses
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Any], event: TelegramObject, data: dict[str, Any]) -> Any:  # type: ignore[override]
+        data["relapses"] = self.relapses
+        return await handler(event, data)
+
+
+class KeyboardsMiddleware(BaseMiddleware):
+    def __init__(self, keyboards: KeyboardRegistry) -> None:
+        super().__init__()
+        self.keyboards = keyboards
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Any], event: TelegramObject, data: dict[str, Any]) -> Any:  # type: ignore[override]
+        data["keyboards"] = self.keyboards
+        return await handler(event, data)
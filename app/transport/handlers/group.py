@@ -1,85 +1,127 @@
 from __future__ import annotations
 
+from datetime import timedelta
+
 import structlog
 from aiogram import Router, F
 from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import Message, CallbackQuery, ChatMemberUpdated
 
-from app.db.repo import MetricsRepo, TopPostRepo
+from app.cache import TTLCache
+from app.config import get_settings
+from app.db.invalidation import on_leaderboard_changed
+from app.db.repo import GroupMemberRepo, GroupRepo, MetricsRepo, OutboxRepo, UserRepo
 from app.db.session import AsyncSession, async_sessionmaker
+from app.domain.services import format_top_text, format_window_top_text, local_today, period_start
+from app.startup import PROCESS_STARTED_AT
+from app.transport.callbacks import callbacks
 from app.transport.handlers.menu_utils import update_message_with_menu
+from app.transport.keyboards import KeyboardRegistry
+from app.transport.outbox import message_payload
+from app.transport.profiles import ProfileCache
+from app.transport.relapses import RelapseBuffer
+from app.transport.texts import texts
+from app.transport.top_post import publish_top_post
 
 router = Router()
 
+# Смена статуса бота в группе ближе к запуску процесса считается перезапуском
+RESTART_WINDOW = timedelta(minutes=5)
+
+# Готовые тексты рейтингов; сбрасываются при любом изменении метрик, имён или членства
+# (в том числе в других процессах — через шину инвалидации)
+_top_texts: TTLCache[tuple[object, ...], str] = TTLCache(maxsize=256, ttl=600)
+on_leaderboard_changed(_top_texts.clear)
+
+
+async def build_top_text(
+    session_factory: async_sessionmaker[AsyncSession],
+    limit: int | None = 10,
+    chat_id: int | None = None,
+) -> str:
+    """Текст рейтинга: общий (chat_id=None) или только по участникам группы."""
+    key = ("top", limit, chat_id)
+    cached = _top_texts.get(key)
+    if cached is not None:
+        return cached
 
-async def build_top_text(session_factory: async_sessionmaker[AsyncSession], limit: int | None = 10) -> str:
     async with session_factory() as session:
         repo = MetricsRepo(session)
-        top = await repo.get_top(limit=limit)
+        top = await repo.get_top(limit=limit, chat_id=chat_id)
 
     if not top:
         return "Пока нет участников в рейтинге."
 
-    lines = []
-    medals = ["🥇", "🥈", "🥉"]
-    for idx, (user, metrics) in enumerate(top, start=1):
-        # Добавляем медальки только для первых трех мест
-        if idx <= 3:
-            prefix = medals[idx - 1]
-        else:
-            prefix = f"{idx}."
-        
-        name = user.full_name or user.username or str(user.user_id)
-        # Рассчитываем рейтинг
-        score = metrics.days - (metrics.relapses * 3)
-        # Добавляем информацию о рецидивах и рейтинге
-        relapse_text = f" (рецидивов: {metrics.relapses}, рейтинг: {score})" if metrics.relapses > 0 else f" (рейтинг: {score})"
-        lines.append(f"{prefix} {name} — {metrics.days} дн.{relapse_text}")
-
     # Формируем заголовок в зависимости от лимита
-    if limit is None:
-        header = "Вся таблица рейтинга:"
-    elif limit == 10:
-        header = "ТОП-10:"
-    elif limit == 50:
-        header = "ТОП-50:"
-    elif limit == 100:
-        header = "ТОП-100:"
-    else:
-        header = f"ТОП-{limit}:"
-    
-    return f"{header}\n" + "\n".join(lines)
+    header = "Вся таблица рейтинга:" if limit is None else f"ТОП-{limit}:"
+    text = format_top_text(header, top)
+    _top_texts.set(key, text)
+    return text
+
+
+PERIOD_TITLES = {"week": "Рейтинг за неделю", "month": "Рейтинг за месяц"}
+
+
+async def build_period_top_text(
+    session_factory: async_sessionmaker[AsyncSession],
+    period: str,
+    limit: int | None = 10,
+    chat_id: int | None = None,
+) -> str:
+    """Текст рейтинга за текущую неделю или месяц (по дневным агрегатам рецидивов)."""
+    today = local_today(get_settings().tz)
+    since = period_start(period, today)
+    window_days = (today - since).days + 1
+    key = (period, today, limit, chat_id)
+    cached = _top_texts.get(key)
+    if cached is not None:
+        return cached
 
+    async with session_factory() as session:
+        top = await MetricsRepo(session).get_top_window(since, window_days, limit=limit, chat_id=chat_id)
 
-@router.callback_query(lambda c: c.data == "add_relapse")
-async def add_relapse_callback(callback: CallbackQuery, session_factory: async_sessionmaker[AsyncSession]) -> None:
+    if not top:
+        return "Пока нет участников в рейтинге."
+    text = format_window_top_text(f"{PERIOD_TITLES[period]} (с {since:%d.%m}):", top, window_days)
+    _top_texts.set(key, text)
+    return text
+
+
+@callbacks.exact("add_relapse")
+async def add_relapse_callback(
+    callback: CallbackQuery,
+    keyboards: KeyboardRegistry,
+    session_factory: async_sessionmaker[AsyncSession],
+    profiles: ProfileCache,
+    relapses: RelapseBuffer | None = None,
+) -> None:
     """Добавляет рецидив пользователю через кнопку"""
+    await callback.answer()
     log = structlog.get_logger()
     bot = callback.bot
     
     # Получаем ID пользователя из callback
     user_id = callback.from_user.id
+
+    if relapses is not None:
+        # Write-behind: запись в БД уйдёт пачкой, число — из БД плюс ещё не записанные
+        relapses.add(user_id, local_today(get_settings().tz))
+        _, relapse_count = await relapses.total(user_id, profiles)
+        text = texts.render("relapse_added", callback.from_user.language_code, count=relapse_count)
+        await update_message_with_menu(callback, text, keyboards["help"], add_main_menu=True)
+        log.info("relapse_buffered", user_id=user_id, relapse_count=relapse_count)
+        return
     
     async with session_factory() as session:
         metrics_repo = MetricsRepo(session)
         try:
-            metrics = await metrics_repo.add_relapse(user_id)
+            metrics = await metrics_repo.add_relapse(user_id, local_today(get_settings().tz))
             relapse_count = metrics.relapses
             
-            text = f"Рецидив добавлен. У вас {relapse_count} рецидивов. Рецидивы влияют на ваш рейтинг."
-            
-            # Импортируем здесь чтобы избежать циклических импортов
-            from app.transport.handlers.menu_utils import update_message_with_menu
-            
-            # Создаем клавиатуру с кнопками
-            kb = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [InlineKeyboardButton(text="❓ Помощь", callback_data="help:show")],
-                ]
-            )
+            text = texts.render("relapse_added", callback.from_user.language_code, count=relapse_count)
             
             # Используем update_message_with_menu для добавления кнопки "Главное меню"
-            await update_message_with_menu(callback, text, kb, add_main_menu=True)
+            await update_message_with_menu(callback, text, keyboards["help"], add_main_menu=True)
             
             await session.commit()
             log.info("relapse_added", user_id=user_id, relapse_count=relapse_count)
@@ -87,35 +129,20 @@ async def add_relapse_callback(callback: CallbackQuery, session_factory: async_s
         except Exception as e:
             log.error("relapse_add_failed", user_id=user_id, error=str(e))
             
-            # Импортируем здесь чтобы избежать циклических импортов
-            from app.transport.handlers.menu_utils import update_message_with_menu
-            
-            # Создаем клавиатуру с кнопками
-            kb = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [InlineKeyboardButton(text="❓ Помощь", callback_data="help:show")],
-                ]
-            )
-            
             # Используем update_message_with_menu для добавления кнопки "Главное меню"
-            await update_message_with_menu(callback, "Ошибка при добавлении рецидива. Попробуйте позже.", kb, add_main_menu=True)
+            await update_message_with_menu(
+                callback, texts.render("relapse_failed", callback.from_user.language_code), keyboards["help"], add_main_menu=True
+            )
 
 
-@router.callback_query(F.data == "top:show")
-async def show_top_in_private(callback: CallbackQuery, session_factory: async_sessionmaker[AsyncSession]) -> None:
+@callbacks.exact("top:show")
+async def show_top_in_private(callback: CallbackQuery, keyboards: KeyboardRegistry, session_factory: async_sessionmaker[AsyncSession]) -> None:
     """Показывает ТОП-10 в приватном чате"""
     await callback.answer()
     
     text = await build_top_text(session_factory, limit=10)
     
-    # Создаем клавиатуру с кнопками
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="❓ Помощь", callback_data="help:show")],
-        ]
-    )
-    
-    await update_message_with_menu(callback, text, kb, add_main_menu=True)
+    await update_message_with_menu(callback, text, keyboards["help"], add_main_menu=True)
 
 
 @router.message(Command("top_members"))
@@ -128,57 +155,79 @@ async def top_members(message: Message, session_factory: async_sessionmaker[Asyn
         return
     
     bot = message.bot
-    text = await build_top_text(session_factory, limit=10)
-
-    # В общем чате не показываем кнопки - только список
-    kb = InlineKeyboardMarkup(inline_keyboard=[])
-
-    # Определяем параметры для отправки сообщения
-    topic_id = message.message_thread_id
-    params = {}
-    if topic_id is not None:
-        params["message_thread_id"] = topic_id
+    chat_id = message.chat.id
 
-    # Удалим предыдущий пост ТОПа, если был в том же топике
+    # Команда из группы — значит группа обслуживается, а автор в ней состоит
     async with session_factory() as session:
-        top_repo = TopPostRepo(session)
-        prev = await top_repo.get_for_chat(message.chat.id, topic_id)
-        if prev is not None:
-            try:
-                await bot.delete_message(chat_id=message.chat.id, message_id=prev.message_id)
-            except Exception as e:  # noqa: BLE001
-                log.warning("top_prev_delete_failed", error=str(e))
-
-        sent = await bot.send_message(
-            chat_id=message.chat.id,
-            text=text,
-            reply_markup=kb,
-            **params,
-        )
-
-        await top_repo.set(message.chat.id, sent.message_id, topic_id)
+        await GroupRepo(session).upsert(chat_id, message.chat.title)
+        await GroupMemberRepo(session).set_member(chat_id, message.from_user.id, True)
         await session.commit()
 
-    # Диагностика прав бота
+    text = await build_top_text(session_factory, limit=10, chat_id=chat_id)
+
+    # В общем чате не показываем кнопки - только список.
+    # Держим один пост на топик: правим его, а не удаляем и шлём заново.
     try:
-        me = await bot.get_me()
-        me_member = await bot.get_chat_member(message.chat.id, me.id)
-        can_delete = getattr(getattr(me_member, "can_delete_messages", None), "__bool__", lambda: False)()
-        log.info("bot_rights", can_delete_messages=bool(getattr(me_member, "can_delete_messages", False)))
+        await publish_top_post(bot, session_factory, chat_id, text, message.message_thread_id, probe=True)
     except Exception as e:  # noqa: BLE001
-        log.warning("bot_rights_check_failed", error=str(e))
+        log.warning("top_post_publish_failed", error=str(e))
 
-    # Пытаемся удалить командное сообщение пользователя (требуются права delete_messages)
+    # Удаляем командное сообщение пользователя, если у бота есть право delete_messages
     try:
-        # Проверяем права бота перед удалением
-        me = await bot.get_me()
-        me_member = await bot.get_chat_member(message.chat.id, me.id)
-        can_delete = getattr(me_member, "can_delete_messages", False)
-        
+        me_member = await bot.get_chat_member(chat_id, bot.id)
+        can_delete = bool(getattr(me_member, "can_delete_messages", False))
+        log.info("bot_rights", can_delete_messages=can_delete)
         if can_delete:
-            await bot.delete_message(chat_id=message.chat.id, message_id=message.message_id)
+            await bot.delete_message(chat_id=chat_id, message_id=message.message_id)
             log.info("Command message deleted successfully")
         else:
             log.info("Bot doesn't have permission to delete messages")
     except Exception as e:  # noqa: BLE001
         log.warning("top_command_delete_failed", error=str(e))
+
+
+@router.my_chat_member(F.chat.type.in_({"group", "supergroup"}))
+async def on_bot_group_membership(
+    event: ChatMemberUpdated, session_factory: async_sessionmaker[AsyncSession], keyboards: KeyboardRegistry
+) -> None:
+    """Бота добавили в группу или убрали из неё — включаем/выключаем группу."""
+    is_active = event.new_chat_member.status in {"member", "administrator"}
+    async with session_factory() as session:
+        await GroupRepo(session).upsert(event.chat.id, event.chat.title, is_active=is_active)
+        await session.commit()
+    structlog.get_logger().info("group_status_changed", chat_id=event.chat.id, is_active=is_active)
+
+    # Бот стал участником чата в пределах 5 минут от запуска процесса (перезапуск):
+    # показываем главное меню всем зарегистрированным. Ключ — от времени запуска,
+    # поэтому несколько групп в одном запуске дают одну рассылку.
+    if is_active and abs(event.date - PROCESS_STARTED_AT) <= RESTART_WINDOW:
+        await enqueue_restart_menu(session_factory, keyboards, int(PROCESS_STARTED_AT.timestamp()))
+
+
+async def enqueue_restart_menu(session_factory: async_sessionmaker[AsyncSession], keyboards: KeyboardRegistry, stamp: int) -> None:
+    """Ставит главное меню всем зарегистрированным в outbox.
+
+    Доставка идёт воркерами с учётом лимитов Telegram, ключ не даёт задублировать рассылку.
+    """
+    async with session_factory() as session:
+        registered_users = await UserRepo(session).list_all_members(reachable_only=True)
+        payload = message_payload("🏠 Главное меню (бот перезапущен)", keyboards["main_menu"])
+        await OutboxRepo(session).enqueue_many(
+            [("message", user.user_id, payload, f"restart_menu:{stamp}:{user.user_id}") for user in registered_users]
+        )
+        await session.commit()
+    if registered_users:
+        structlog.get_logger().info("restart_menu_enqueued", users=len(registered_users))
+
+
+@router.chat_member(F.chat.type.in_({"group", "supergroup"}))
+async def on_group_member_change(event: ChatMemberUpdated, session_factory: async_sessionmaker[AsyncSession]) -> None:
+    """Отслеживаем вход/выход участников (приходит, если бот — администратор группы)."""
+    member = event.new_chat_member
+    is_member = member.status in {"member", "administrator", "creator"} or (
+        member.status == "restricted" and getattr(member, "is_member", False)
+    )
+    async with session_factory() as session:
+        await GroupRepo(session).upsert(event.chat.id, event.chat.title)
+        await GroupMemberRepo(session).set_member(event.chat.id, event.new_chat_member.user.id, is_member)
+        await session.commit()
@@ -1,17 +1,43 @@
 from __future__ import annotations
 
-from aiogram import Router, F
-from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from datetime import datetime, time, timezone
+from typing import Optional
 
+from aiogram import Router
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup
+
+from app.config import get_settings
+from app.db.models import User
 from app.db.repo import UserRepo
 from app.db.session import AsyncSession, async_sessionmaker
+from app.domain.services import notify_schedule
+from app.transport.callbacks import CallbackPayload, callbacks
 from app.transport.handlers.menu_utils import update_message_with_menu
+from app.transport.keyboards import NOTIFY_TIMES, NOTIFY_TIMEZONES, KeyboardRegistry
+from app.transport.profiles import ProfileCache, UserProfile
+from app.transport.texts import texts
 
 router = Router()
 
 
-@router.callback_query(F.data == "notify:toggle")
-async def on_notify_toggle(callback: CallbackQuery, session_factory: async_sessionmaker[AsyncSession]) -> None:
+def notify_menu_kb(keyboards: KeyboardRegistry, enabled: bool) -> InlineKeyboardMarkup:
+    return keyboards["notify_on" if enabled else "notify_off"]
+
+
+def notify_status_text(user: Optional[User | UserProfile]) -> str:
+    if user is None or not user.notifications:
+        return "🔔 Напоминания: ❌ Выключены"
+    settings = get_settings()
+    at = notify_schedule(settings).time_for(user.user_id, user.notify_time)
+    tz_name = user.notify_tz or settings.tz
+    suffix = "" if user.notify_time is not None else " (по умолчанию)"
+    return f"🔔 Напоминания: ✅ Включены\nВремя: {at:%H:%M}{suffix}\nЧасовой пояс: {tz_name}"
+
+
+@callbacks.exact("notify:toggle")
+async def on_notify_toggle(
+    callback: CallbackQuery, session_factory: async_sessionmaker[AsyncSession], keyboards: KeyboardRegistry
+) -> None:
     await callback.answer()
     user_id = callback.from_user.id
 
@@ -28,21 +54,70 @@ async def on_notify_toggle(callback: CallbackQuery, session_factory: async_sessi
                 quit_date=None,
                 pack_price=None,
             )
-        await repo.set_notifications(user_id, enabled)
+        next_at = None
+        if enabled:
+            notify_time = user.notify_time if user else None
+            notify_tz = user.notify_tz if user else None
+            next_at = notify_schedule(get_settings()).next_at(user_id, notify_time, notify_tz, datetime.now(timezone.utc))
+        await repo.set_notifications(user_id, enabled, next_at)
         await session.commit()
+        user = await repo.get_by_id(user_id)
+
+    await update_message_with_menu(callback, notify_status_text(user), notify_menu_kb(keyboards, enabled), add_main_menu=False)
+
 
-    # Создаем клавиатуру с кнопками
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="❓ Помощь", callback_data="help:show")],
-            [InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu:main")],
-        ]
+@callbacks.exact("notify:time_menu")
+async def on_notify_time_menu(callback: CallbackQuery, keyboards: KeyboardRegistry) -> None:
+    await callback.answer()
+    await update_message_with_menu(
+        callback, texts.render("notify_time_menu", callback.from_user.language_code), keyboards["notify_times"]
     )
-    
-    status_text = "✅ Включены" if enabled else "❌ Выключены"
+
+
+@callbacks.exact("notify:tz_menu")
+async def on_notify_tz_menu(callback: CallbackQuery, keyboards: KeyboardRegistry) -> None:
+    await callback.answer()
     await update_message_with_menu(
-        callback, 
-        f"🔔 Напоминания: {status_text}", 
-        kb, 
-        add_main_menu=False
+        callback, texts.render("notify_tz_menu", callback.from_user.language_code), keyboards["notify_timezones"]
     )
+
+
+@callbacks.exact("notify:menu")
+async def on_notify_menu(callback: CallbackQuery, profiles: ProfileCache, keyboards: KeyboardRegistry) -> None:
+    await callback.answer()
+    user = await profiles.get(callback.from_user.id)
+    enabled = bool(user and user.notifications)
+    await update_message_with_menu(callback, notify_status_text(user), notify_menu_kb(keyboards, enabled), add_main_menu=False)
+
+
+@callbacks.prefix("notify:time", "notify:tz")
+async def on_notify_schedule(
+    callback: CallbackQuery,
+    payload: CallbackPayload,
+    session_factory: async_sessionmaker[AsyncSession],
+    keyboards: KeyboardRegistry,
+) -> None:
+    await callback.answer()
+    user_id = callback.from_user.id
+    choice = payload.args[0] if payload.args else ""
+
+    async with session_factory() as session:
+        repo = UserRepo(session)
+        user = await repo.get_by_id(user_id)
+        if user is None:
+            await update_message_with_menu(callback, texts.render("register_first", callback.from_user.language_code), notify_menu_kb(keyboards, False), add_main_menu=False)
+            return
+
+        notify_time, notify_tz = user.notify_time, user.notify_tz
+        if payload.key == "notify:time":
+            notify_time = time(int(choice[:2]), int(choice[2:])) if choice in NOTIFY_TIMES else None
+        elif choice in {name for _, name in NOTIFY_TIMEZONES}:
+            notify_tz = choice
+
+        next_at = None
+        if user.notifications:
+            next_at = notify_schedule(get_settings()).next_at(user_id, notify_time, notify_tz, datetime.now(timezone.utc))
+        await repo.set_notify_schedule(user_id, notify_time, notify_tz, next_at)
+        await session.commit()
+
+    await update_message_with_menu(callback, notify_status_text(user), notify_menu_kb(keyboards, user.notifications), add_main_menu=False)
@@ -1,32 +1,30 @@
 from __future__ import annotations
 
+import asyncio
 import logging
 from datetime import date, timedelta, datetime, timezone
-from typing import Optional, Dict
+from typing import Optional
 
 from aiogram import Router, F
 from aiogram.types import (
     CallbackQuery,
-    InlineKeyboardMarkup,
-    InlineKeyboardButton,
     Message,
 )
 from aiogram import Bot
 
 from app.config import get_settings
-from app.db.repo import MetricsRepo, UserRepo
+from app.db.repo import GroupMemberRepo, MetricsRepo, PriceHistoryRepo, UserRepo
 from app.db.session import AsyncSession, async_sessionmaker
-from app.domain.services import calculate_metrics, generate_admin_title, rank_text
+from app.domain.services import calculate_metrics, generate_admin_title, local_today, rank_text
+from app.transport.callbacks import CallbackPayload, callbacks
 from app.transport.handlers.menu_utils import update_message_with_menu
+from app.transport.keyboards import KeyboardRegistry
+from app.transport.reg_state import RegStateStorage
 
 logger = logging.getLogger(__name__)
 
 router = Router()
 
-# Простое in-memory хранилище выбранной даты на время мастера (MVP)
-REG_STATE: Dict[int, date] = {}
-
-logger.info("Registration handlers module loaded successfully")
 
 def _parse_user_date(date_str: str) -> Optional[datetime]:
     """
@@ -45,408 +43,376 @@ def _parse_user_date(date_str: str) -> Optional[datetime]:
             continue
     return None
 
-# Логируем регистрацию обработчиков для отладки
-logger.info("Registering registration handlers:")
-logger.info("- reg_start: callback_query with data='reg:start'")
-logger.info("- reg_date: callback_query with data starting with 'reg:date:'")
-logger.info("- reg_date_custom: message with regex pattern '^\\d{4}-\\d{2}-\\d{2}$' (ГОД-МЕСЯЦ-ДЕНЬ)")
-logger.info("- reg_price: callback_query with data starting with 'reg:price:'")
-logger.info("- reg_price_custom: message with regex pattern '^\\d+(?:[\\.,]\\d+)?$'")
-
-
-def price_menu_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="200", callback_data="reg:price:200")],
-            [InlineKeyboardButton(text="250", callback_data="reg:price:250")],
-            [InlineKeyboardButton(text="300", callback_data="reg:price:300")],
-            [InlineKeyboardButton(text="Другая", callback_data="reg:price:custom")],
-            [InlineKeyboardButton(text="❓ Помощь", callback_data="help:show")],
-        ]
-    )
-
-
-def date_selection_kb() -> InlineKeyboardMarkup:
-    """Клавиатура для выбора даты"""
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Сегодня", callback_data="reg:date:today")],
-            [InlineKeyboardButton(text="Вчера", callback_data="reg:date:yesterday")],
-            [InlineKeyboardButton(text="3 дня назад", callback_data="reg:date:3")],
-            [InlineKeyboardButton(text="7 дней назад", callback_data="reg:date:7")],
-            [InlineKeyboardButton(text="Другая дата", callback_data="reg:date:custom")],
-            [InlineKeyboardButton(text="❓ Помощь", callback_data="help:show")],
-        ]
-    )
-
 
-@router.callback_query(F.data == "reg:start")
-async def reg_start(callback: CallbackQuery) -> None:
+@callbacks.exact("reg:start")
+async def reg_start(callback: CallbackQuery, keyboards: KeyboardRegistry, reg_state: RegStateStorage) -> None:
     await callback.answer()
     user_id = callback.from_user.id
-    logger.info(f"=== REG_START DEBUG START ===")
-    logger.info(f"User {user_id} started registration process")
-    logger.info(f"REG_STATE before clearing: {REG_STATE}")
+    logger.info("User %s started registration process", user_id)
     
-    # Очищаем предыдущее состояние регистрации, если было
-    if user_id in REG_STATE:
-        logger.info(f"Clearing previous registration state for user {user_id}")
-        REG_STATE.pop(user_id, None)
+    # Инициализируем (или сбрасываем предыдущее) состояние регистрации для пользователя
+    await reg_state.set(user_id, None)
+    logger.debug("Initialized registration state for user %s", user_id)
     
-    # Инициализируем состояние регистрации для пользователя
-    REG_STATE[user_id] = None
-    logger.info(f"Initialized registration state for user {user_id}")
-    logger.info(f"REG_STATE after initialization: {REG_STATE}")
-    
-    await update_message_with_menu(callback, "Дата последней сигареты:", date_selection_kb())
-    logger.info(f"Date selection menu sent to user {user_id}")
-    logger.info(f"=== REG_START DEBUG END ===")
+    await update_message_with_menu(callback, "Дата последней сигареты:", keyboards["reg_date"])
+    logger.debug("Date selection menu sent to user %s", user_id)
 
 
-@router.callback_query(F.data == "reg:date_menu")
-async def reg_date_menu(callback: CallbackQuery) -> None:
+@callbacks.exact("reg:date_menu")
+async def reg_date_menu(callback: CallbackQuery, keyboards: KeyboardRegistry, reg_state: RegStateStorage) -> None:
     """Возврат к меню выбора даты при ошибке ввода"""
     await callback.answer()
     user_id = callback.from_user.id
-    logger.info(f"User {user_id} returned to date menu after error")
+    logger.debug("User %s returned to date menu after error", user_id)
     
     # Сбрасываем состояние для повторного выбора
-    if user_id in REG_STATE:
-        REG_STATE[user_id] = None
+    if await reg_state.get(user_id) is not None:
+        await reg_state.set(user_id, None)
     
-    await update_message_with_menu(callback, "Дата последней сигареты:", date_selection_kb())
+    await update_message_with_menu(callback, "Дата последней сигареты:", keyboards["reg_date"])
 
 
-@router.callback_query(F.data.startswith("reg:date:"))
-async def reg_date(callback: CallbackQuery, session_factory: async_sessionmaker[AsyncSession]) -> None:
+@callbacks.prefix("reg:date")
+async def reg_date(callback: CallbackQuery, keyboards: KeyboardRegistry, payload: CallbackPayload, reg_state: RegStateStorage) -> None:
     await callback.answer()
     user_id = callback.from_user.id
-    logger.info(f"User {user_id} selected date option: {callback.data}")
+    logger.debug("User %s selected date option: %s", user_id, callback.data)
 
     today = date.today()
-    choice = callback.data.split(":")[-1]
-    logger.info(f"Date choice: {choice}")
-    
-    # Очищаем предыдущее состояние регистрации
-    if user_id in REG_STATE:
-        logger.info(f"Clearing previous registration state for user {user_id}")
-        REG_STATE.pop(user_id, None)
+    choice = payload.args[0] if payload.args else ""
+    logger.debug("Date choice: %s", choice)
     
     if choice == "today":
         qd = today
-        logger.info(f"User {user_id} selected today: {qd}")
+        logger.debug("User %s selected today: %s", user_id, qd)
     elif choice == "yesterday":
         qd = today - timedelta(days=1)
-        logger.info(f"User {user_id} selected yesterday: {qd}")
+        logger.debug("User %s selected yesterday: %s", user_id, qd)
     elif choice.isdigit():
         qd = today - timedelta(days=int(choice))
-        logger.info(f"User {user_id} selected {choice} days ago: {qd}")
+        logger.debug("User %s selected %s days ago: %s", user_id, choice, qd)
     elif choice == "custom":
-        logger.info(f"User {user_id} chose custom date, entering custom date mode")
+        logger.debug("User %s chose custom date, entering custom date mode", user_id)
         # Добавляем пользователя в состояние регистрации для custom date
-        REG_STATE[user_id] = None  # Временно устанавливаем None, дата будет установлена позже
-        logger.info(f"Added user {user_id} to REG_STATE for custom date input")
-        logger.info(f"REG_STATE after custom date selection: {REG_STATE}")
-        await update_message_with_menu(callback, "Введите дату в формате ГОД-МЕСЯЦ-ДЕНЬ (например: 2025-01-31)", InlineKeyboardMarkup(inline_keyboard=[]))
-        logger.info(f"Custom date input prompt sent to user {user_id}")
+        await reg_state.set(user_id, None)  # Дата будет установлена позже
+        logger.debug("Added user %s to registration state for custom date input", user_id)
+        await update_message_with_menu(callback, "Введите дату в формате ГОД-МЕСЯЦ-ДЕНЬ (например: 2025-01-31)", keyboards["empty"])
+        logger.debug("Custom date input prompt sent to user %s", user_id)
         return
     else:
-        logger.warning(f"Unknown date choice: {choice}")
-        await update_message_with_menu(callback, "Неизвестный выбор даты. Попробуйте еще раз.", InlineKeyboardMarkup(inline_keyboard=[]))
+        logger.warning("Unknown date choice: %s", choice)
+        await reg_state.delete(user_id)
+        await update_message_with_menu(callback, "Неизвестный выбор даты. Попробуйте еще раз.", keyboards["empty"])
         return
 
     # Сохраняем временно и переходим к цене
-    REG_STATE[user_id] = qd
-    logger.info(f"User {user_id} selected date {qd}, moving to price selection")
+    await reg_state.set(user_id, qd)
+    logger.debug("User %s selected date %s, moving to price selection", user_id, qd)
 
     await update_message_with_menu(
         callback,
         f"Выбрана дата: {qd.isoformat()}\nТеперь выберите цену пачки:",
-        price_menu_kb()
+        keyboards["reg_price"]
     )
-    logger.info(f"Price selection menu sent to user {user_id}")
-    logger.info(f"REG_STATE after date selection: {REG_STATE}")
+    logger.debug("Price selection menu sent to user %s", user_id)
 
 
 @router.message(F.text.regexp(r"^\d{4}-\d{2}-\d{2}$"))
-async def reg_date_custom(message: Message) -> None:
+async def reg_date_custom(message: Message, keyboards: KeyboardRegistry, reg_state: RegStateStorage) -> None:
     try:
         # Дополнительное логирование для отладки
-        logger.info(f"=== REG_DATE_CUSTOM DEBUG START ===")
-        logger.info(f"Message text: '{message.text}'")
-        logger.info(f"Message chat type: {message.chat.type}")
-        logger.info(f"Message from user: {message.from_user.id} (@{message.from_user.username})")
-        logger.info(f"REG_STATE before processing: {REG_STATE}")
+        logger.debug("Message text: '%s'", message.text)
+        logger.debug("Message chat type: %s", message.chat.type)
+        logger.debug("Message from user: %s (@%s)", message.from_user.id, message.from_user.username)
         
         # Проверяем, что это личное сообщение
         if message.chat.type != "private":
-            logger.info(f"Ignoring date input in non-private chat: {message.chat.type}")
+            logger.debug("Ignoring date input in non-private chat: %s", message.chat.type)
             return
             
         user_id = message.from_user.id
-        logger.info(f"Received date input: {message.text} from user {user_id}")
+        logger.debug("Received date input: %s from user %s", message.text, user_id)
         
         # Проверяем, что пользователь находится в процессе регистрации
-        if user_id not in REG_STATE:
-            logger.info(f"User {user_id} not in registration state, starting registration process")
+        state = await reg_state.get(user_id)
+        if state is None:
+            logger.debug("User %s not in registration state, starting registration process", user_id)
             # Пользователь не в процессе регистрации - начинаем процесс заново
-            # Очищаем предыдущее состояние и инициализируем новое
-            if user_id in REG_STATE:
-                REG_STATE.pop(user_id, None)
-            REG_STATE[user_id] = None
-            logger.info(f"Initialized registration state for user {user_id}")
-        
-        # Проверяем, что пользователь в режиме custom date (REG_STATE[user_id] может быть None)
-        if REG_STATE[user_id] is not None:
-            logger.info(f"User {user_id} already has a date set ({REG_STATE[user_id]}), ignoring message")
+            await reg_state.set(user_id, None)
+            logger.debug("Initialized registration state for user %s", user_id)
+        elif state.quit_date is not None:
+            # Пользователь не в режиме custom date - дата уже выбрана
+            logger.debug("User %s already has a date set (%s), ignoring message", user_id, state.quit_date)
             return
         
         # Используем новую функцию валидации даты
         last_smoke = _parse_user_date(message.text)
         if not last_smoke:
             # При ошибке даты предлагаем повторный ввод или возврат к выбору даты
-            error_kb = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [InlineKeyboardButton(text="📅 Выбрать дату из списка", callback_data="reg:date_menu")],
-                    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu:main")],
-                ]
-            )
             await message.answer(
                 "❌ Некорректная дата!\n\n"
                 "Попробуйте еще раз или выберите дату из списка.\n\n"
                 "Правильный формат: ГОД-МЕСЯЦ-ДЕНЬ (например: 2025-01-31) или ДЕНЬ.МЕСЯЦ.ГОД (например: 31.01.2025)\n\n"
                 "⚠️ Дата не должна быть в будущем.",
-                reply_markup=error_kb
+                reply_markup=keyboards["reg_date_retry"]
             )
             return
         
         # Конвертируем datetime в date для совместимости
         qd = last_smoke.date()
-        logger.info(f"Successfully parsed and validated date: {qd} for user {user_id}")
+        logger.debug("Successfully parsed and validated date: %s for user %s", qd, user_id)
 
         # Сохраняем дату в состоянии регистрации
-        REG_STATE[user_id] = qd
-        logger.info(f"Stored date {qd} in REG_STATE for user {user_id}")
-        logger.info(f"REG_STATE after storing date: {REG_STATE}")
+        await reg_state.set(user_id, qd)
+        logger.debug("Stored date %s in registration state for user %s", qd, user_id)
 
         # Отправляем новое сообщение с клавиатурой выбора цены
-        await message.answer("Выберите цену пачки:", reply_markup=price_menu_kb())
-        logger.info(f"Sent price selection message to user {user_id}")
+        await message.answer("Выберите цену пачки:", reply_markup=keyboards["reg_price"])
+        logger.debug("Sent price selection message to user %s", user_id)
         
         # НЕ очищаем состояние регистрации здесь - оно нужно для следующего шага
-        logger.info(f"Keeping REG_STATE for user {user_id} for price selection")
-        logger.info(f"=== REG_DATE_CUSTOM DEBUG END ===")
+        logger.debug("Keeping registration state for user %s for price selection", user_id)
         
     except Exception as e:
-        logger.error(f"Error in reg_date_custom for user {message.from_user.id}: {e}", exc_info=True)
+        logger.error("Error in reg_date_custom for user %s: %s", message.from_user.id, e, exc_info=True)
         # Отправляем сообщение об ошибке пользователю
         try:
-            error_kb = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [InlineKeyboardButton(text="📅 Выбрать дату из списка", callback_data="reg:date_menu")],
-                    [InlineKeyboardButton(text="🔄 Начать регистрацию заново", callback_data="reg:start")],
-                    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu:main")],
-                ]
-            )
-            await message.answer("Произошла ошибка при обработке даты. Попробуйте еще раз!", reply_markup=error_kb)
+            await message.answer("Произошла ошибка при обработке даты. Попробуйте еще раз!", reply_markup=keyboards["reg_date_failed"])
         except Exception as send_error:
-            logger.error(f"Failed to send error message to user {message.from_user.id}: {send_error}")
-        logger.info(f"=== REG_DATE_CUSTOM ERROR END ===")
+            logger.error("Failed to send error message to user %s: %s", message.from_user.id, send_error)
 
 
-@router.callback_query(F.data == "reg:price_menu")
-async def reg_price_menu(callback: CallbackQuery) -> None:
+@callbacks.exact("reg:price_menu")
+async def reg_price_menu(callback: CallbackQuery, keyboards: KeyboardRegistry, reg_state: RegStateStorage) -> None:
     """Возврат к меню выбора цены при ошибке ввода"""
     await callback.answer()
     user_id = callback.from_user.id
-    logger.info(f"User {user_id} returned to price menu after error")
+    logger.debug("User %s returned to price menu after error", user_id)
     
     # Проверяем, что у пользователя есть дата
-    qd = REG_STATE.get(user_id)
+    state = await reg_state.get(user_id)
+    qd = state.quit_date if state else None
     if qd is None:
         # Если нет даты, отправляем к выбору даты
-        await update_message_with_menu(callback, "Сначала выберите дату:", date_selection_kb())
+        await update_message_with_menu(callback, "Сначала выберите дату:", keyboards["reg_date"])
         return
     
     await update_message_with_menu(
         callback,
         f"Выбрана дата: {qd.isoformat()}\nТеперь выберите цену пачки:",
-        price_menu_kb()
+        keyboards["reg_price"]
     )
 
 
-@router.callback_query(F.data.startswith("reg:price:"))
-async def reg_price(callback: CallbackQuery, session_factory: async_sessionmaker[AsyncSession]) -> None:
+@callbacks.prefix("reg:price")
+async def reg_price(
+    callback: CallbackQuery,
+    keyboards: KeyboardRegistry,
+    payload: CallbackPayload,
+    session_factory: async_sessionmaker[AsyncSession],
+    reg_state: RegStateStorage,
+) -> None:
     await callback.answer()
     user_id = callback.from_user.id
-    choice = callback.data.split(":")[-1]
-    logger.info(f"User {user_id} selected price option: {choice}")
+    choice = payload.args[0] if payload.args else ""
+    logger.debug("User %s selected price option: %s", user_id, choice)
 
     if choice == "custom":
-        logger.info(f"User {user_id} chose custom price, entering custom price mode")
-        await update_message_with_menu(callback, "Введите стоимость пачки (число)", InlineKeyboardMarkup(inline_keyboard=[]))
-        logger.info(f"Custom price input prompt sent to user {user_id}")
+        logger.debug("User %s chose custom price, entering custom price mode", user_id)
+        await update_message_with_menu(callback, "Введите стоимость пачки (число)", keyboards["empty"])
+        logger.debug("Custom price input prompt sent to user %s", user_id)
         return
 
     if not choice.isdigit():
-        logger.warning(f"Invalid price choice: {choice}")
-        await update_message_with_menu(callback, "Неверное значение цены. Попробуйте еще раз.", InlineKeyboardMarkup(inline_keyboard=[]))
+        logger.warning("Invalid price choice: %s", choice)
+        await update_message_with_menu(callback, "Неверное значение цены. Попробуйте еще раз.", keyboards["empty"])
         return
 
     price = float(choice)
-    logger.info(f"User {user_id} selected price {price}, proceeding to save_and_confirm")
+    logger.debug("User %s selected price %s, proceeding to save_and_confirm", user_id, price)
     
-    await save_and_confirm(callback, session_factory, user_id, price)
-    logger.info(f"save_and_confirm completed for user {user_id}")
+    await save_and_confirm(callback, keyboards, session_factory, reg_state, user_id, price)
+    logger.debug("save_and_confirm completed for user %s", user_id)
 
 
 @router.message(F.text.regexp(r"^\d+(?:[\.,]\d+)?$"))
-async def reg_price_custom(message: Message, session_factory: async_sessionmaker[AsyncSession]) -> None:
+async def reg_price_custom(
+    message: Message, keyboards: KeyboardRegistry, session_factory: async_sessionmaker[AsyncSession], reg_state: RegStateStorage
+) -> None:
     try:
         # Дополнительное логирование для отладки
-        logger.info(f"=== REG_PRICE_CUSTOM DEBUG START ===")
-        logger.info(f"Message text: '{message.text}'")
-        logger.info(f"Message chat type: {message.chat.type}")
-        logger.info(f"Message from user: {message.from_user.id} (@{message.from_user.username})")
-        logger.info(f"REG_STATE before processing: {REG_STATE}")
+        logger.debug("Message text: '%s'", message.text)
+        logger.debug("Message chat type: %s", message.chat.type)
+        logger.debug("Message from user: %s (@%s)", message.from_user.id, message.from_user.username)
         
         # Проверяем, что это личное сообщение
         if message.chat.type != "private":
-            logger.info(f"Ignoring price input in non-private chat: {message.chat.type}")
+            logger.debug("Ignoring price input in non-private chat: %s", message.chat.type)
             return
             
         user_id = message.from_user.id
-        logger.info(f"Received price input: {message.text} from user {user_id}")
+        logger.debug("Received price input: %s from user %s", message.text, user_id)
         
         # Проверяем, что пользователь находится в процессе регистрации
-        logger.info(f"Checking registration state for user {user_id}")
+        logger.debug("Checking registration state for user %s", user_id)
         
-        if user_id not in REG_STATE:
-            logger.info(f"User {user_id} not in registration state, starting registration process")
+        state = await reg_state.get(user_id)
+        if state is None:
+            logger.debug("User %s not in registration state, starting registration process", user_id)
             # Пользователь не в процессе регистрации - начинаем процесс заново
-            # Очищаем предыдущее состояние и инициализируем новое
-            if user_id in REG_STATE:
-                REG_STATE.pop(user_id, None)
-            REG_STATE[user_id] = None
-            logger.info(f"Initialized registration state for user {user_id}")
+            await reg_state.set(user_id, None)
+            logger.debug("Initialized registration state for user %s", user_id)
         
         # Проверяем, что у пользователя уже установлена дата
-        if REG_STATE[user_id] is None:
-            logger.info(f"User {user_id} doesn't have a date set yet, starting date selection")
+        if state is None or state.quit_date is None:
+            logger.debug("User %s doesn't have a date set yet, starting date selection", user_id)
             # Пользователь не установил дату - предлагаем выбрать дату
-            await message.answer("Сначала нужно выбрать дату. Выберите один из вариантов:", reply_markup=date_selection_kb())
+            await message.answer("Сначала нужно выбрать дату. Выберите один из вариантов:", reply_markup=keyboards["reg_date"])
             return
         
-        logger.info(f"User {user_id} has date {REG_STATE[user_id]} set, proceeding with price {message.text}")
+        logger.debug("User %s has date %s set, proceeding with price %s", user_id, state.quit_date, message.text)
         
         try:
             price = float(message.text.replace(",", "."))  # type: ignore[union-attr]
             
             # Проверяем разумные границы цены
             if price <= 0 or price > 10000:
-                error_kb = InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [InlineKeyboardButton(text="💰 Выбрать цену из списка", callback_data="reg:price_menu")],
-                        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu:main")],
-                    ]
-                )
                 await message.answer(
                     "❌ Цена должна быть от 1 до 10000 рублей!\n\n"
                     "Попробуйте еще раз или выберите цену из списка.",
-                    reply_markup=error_kb
+                    reply_markup=keyboards["reg_price_retry"]
                 )
                 return
             
-            logger.info(f"Parsed price {price} for user {user_id}")
-            await save_and_confirm(message, session_factory, user_id, price)
-            logger.info(f"save_and_confirm completed for user {user_id}")
+            logger.debug("Parsed price %s for user %s", price, user_id)
+            await save_and_confirm(message, keyboards, session_factory, reg_state, user_id, price)
+            logger.debug("save_and_confirm completed for user %s", user_id)
         except ValueError:
             # При ошибке цены предлагаем повторный ввод или возврат к выбору цены
-            error_kb = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [InlineKeyboardButton(text="💰 Выбрать цену из списка", callback_data="reg:price_menu")],
-                    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu:main")],
-                ]
-            )
             await message.answer(
                 "❌ Неверная цена!\n\n"
                 "Попробуйте еще раз или выберите цену из списка.\n\n"
                 "Правильный формат: число (например: 250 или 250.50)\n\n"
                 "💡 Можно использовать точку или запятую для десятичных дробей.",
-                reply_markup=error_kb
+                reply_markup=keyboards["reg_price_retry"]
             )
             return
         
-        logger.info(f"=== REG_PRICE_CUSTOM DEBUG END ===")
         
     except Exception as e:
-        logger.error(f"Error in reg_price_custom for user {message.from_user.id}: {e}", exc_info=True)
+        logger.error("Error in reg_price_custom for user %s: %s", message.from_user.id, e, exc_info=True)
         # Отправляем сообщение об ошибке пользователю
         try:
-            error_kb = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [InlineKeyboardButton(text="💰 Выбрать цену из списка", callback_data="reg:price_menu")],
-                    [InlineKeyboardButton(text="🔄 Начать регистрацию заново", callback_data="reg:start")],
-                    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu:main")],
-                ]
-            )
-            await message.answer("Произошла ошибка при обработке цены. Попробуйте еще раз!", reply_markup=error_kb)
+            await message.answer("Произошла ошибка при обработке цены. Попробуйте еще раз!", reply_markup=keyboards["reg_price_failed"])
         except Exception as send_error:
-            logger.error(f"Failed to send error message to user {message.from_user.id}: {send_error}")
-        logger.info(f"=== REG_PRICE_CUSTOM ERROR END ===")
+            logger.error("Failed to send error message to user %s: %s", message.from_user.id, send_error)
+
+
+MEMBER_STATUSES = {"member", "administrator", "creator"}
+
+
+async def _check_memberships(bot: Bot, chat_ids: list[int], user_id: int) -> dict[int, Optional[str]]:
+    """Статус пользователя в каждой группе; группы, где проверка не удалась, пропускаются."""
+    async def check(chat_id: int) -> tuple[int, Optional[str]] | None:
+        try:
+            member = await bot.get_chat_member(chat_id=chat_id, user_id=user_id)
+        except Exception as e:
+            logger.warning("Membership check failed for %s in %s: %s", user_id, chat_id, e)
+            return None
+        status = getattr(member, "status", None)
+        logger.debug("User %s membership in %s: status=%s", user_id, chat_id, status)
+        return chat_id, status
+
+    results = await asyncio.gather(*(check(chat_id) for chat_id in chat_ids))
+    return dict(result for result in results if result is not None)
+
+
+async def _promote_with_title(bot: Bot, chat_id: int, user_id: int, status: Optional[str], title: str) -> bool:
+    """Промоут до микро-админа с кастом-тайтлом в группе. True — если тайтл установлен."""
+    # Владельцу (creator) Telegram не позволяет ставить кастом‑тайтл ботом
+    if status == "creator":
+        logger.debug("User %s is creator of %s, skipping promotion", user_id, chat_id)
+        return False
+    try:
+        # Проверяем права бота перед промоушеном
+        bot_member = await bot.get_chat_member(chat_id=chat_id, user_id=bot.id)
+        if not getattr(bot_member, "can_promote_members", False):
+            logger.warning("Bot doesn't have permission to promote members in group %s", chat_id)
+            return False
+        logger.debug("Promoting user %s to admin in %s with title '%s'", user_id, chat_id, title)
+        await bot.promote_chat_member(
+            chat_id=chat_id,
+            user_id=user_id,
+            can_pin_messages=True,
+            can_change_info=False,
+            can_invite_users=False,
+            can_manage_topics=False,
+            can_delete_messages=False,
+            can_restrict_members=False,
+            can_promote_members=False,
+            can_manage_chat=False,
+            can_post_stories=False,
+            can_edit_stories=False,
+            can_delete_stories=False,
+        )
+        await bot.set_chat_administrator_custom_title(
+            chat_id=chat_id,
+            user_id=user_id,
+            custom_title=title,
+        )
+        return True
+    except Exception as e:
+        logger.warning("Promotion failed for %s in %s: %s", user_id, chat_id, e)
+        return False
 
 
 async def save_and_confirm(
     source: Message | CallbackQuery,
+    keyboards: KeyboardRegistry,
     session_factory: async_sessionmaker[AsyncSession],
+    reg_state: RegStateStorage,
     user_id: int,
     pack_price: float,
 ) -> None:
-    logger.info(f"=== SAVE_AND_CONFIRM DEBUG START ===")
-    logger.info(f"Starting save_and_confirm for user {user_id} with price {pack_price}")
-    logger.info(f"REG_STATE at start of save_and_confirm: {REG_STATE}")
+    logger.debug("Starting save_and_confirm for user %s with price %s", user_id, pack_price)
     
-    qd: Optional[date] = REG_STATE.get(user_id)
-    logger.info(f"Retrieved date {qd} from REG_STATE for user {user_id}")
+    state = await reg_state.get(user_id)
+    qd: Optional[date] = state.quit_date if state else None
+    logger.debug("Retrieved date %s from registration state for user %s", qd, user_id)
 
     if qd is None:
-        logger.warning(f"User {user_id} has no date set in REG_STATE")
+        logger.warning("User %s has no date set in registration state", user_id)
         if isinstance(source, CallbackQuery):
-            await update_message_with_menu(source, "Сначала выберите дату", InlineKeyboardMarkup(inline_keyboard=[]))
+            await update_message_with_menu(source, "Сначала выберите дату", keyboards["empty"])
         else:
-            temp_kb = InlineKeyboardMarkup(inline_keyboard=[])
-            temp_kb.inline_keyboard.append([InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu:main")])
-            await source.answer("Сначала нужно выбрать дату. Начните регистрацию заново.", reply_markup=temp_kb)  # type: ignore[attr-defined]
+            await source.answer("Сначала нужно выбрать дату. Начните регистрацию заново.", reply_markup=keyboards["main_only"])  # type: ignore[attr-defined]
         return
 
     settings = get_settings()
 
-    # Проверка членства в группе
+    # Проверка членства: основная группа и группы, где мы уже видели пользователя
     bot: Bot = source.bot  # type: ignore[assignment]
-    try:
-        member = await bot.get_chat_member(chat_id=settings.group_chat_id, user_id=user_id)
-        status = getattr(member, "status", None)
-        is_member = status in {"member", "administrator", "creator"}
-        logger.info(f"User {user_id} group membership check: status={status}, is_member={is_member}")
-    except Exception as e:
-        logger.warning(f"Membership check failed for %s: %s", user_id, e)
+    async with session_factory() as session:
+        known_groups = await GroupMemberRepo(session).list_groups_for_user(user_id)
+    candidate_groups = list(dict.fromkeys([settings.group_chat_id, *known_groups]))
+    statuses = await _check_memberships(bot, candidate_groups, user_id)
+    member_groups = {chat_id: status for chat_id, status in statuses.items() if status in MEMBER_STATUSES}
+    is_member = bool(member_groups)
+
+    if not statuses:
         error_msg = "Не удалось проверить членство. Попробуйте ещё раз позже."
         if isinstance(source, CallbackQuery):
-            await update_message_with_menu(source, error_msg, InlineKeyboardMarkup(inline_keyboard=[]))
+            await update_message_with_menu(source, error_msg, keyboards["empty"])
         else:
-            temp_kb = InlineKeyboardMarkup(inline_keyboard=[])
-            temp_kb.inline_keyboard.append([InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu:main")])
-            await source.answer(error_msg, reply_markup=temp_kb)
+            await source.answer(error_msg, reply_markup=keyboards["main_only"])
         return
 
     if not is_member:
         join_hint = "Для регистрации необходимо быть участником нашей группы. Вступите в группу и попробуйте снова."
         if isinstance(source, CallbackQuery):
-            await update_message_with_menu(source, join_hint, InlineKeyboardMarkup(inline_keyboard=[]))
+            await update_message_with_menu(source, join_hint, keyboards["empty"])
         else:
-            temp_kb = InlineKeyboardMarkup(inline_keyboard=[])
-            temp_kb.inline_keyboard.append([InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu:main")])
-            await source.answer(join_hint, reply_markup=temp_kb)
+            await source.answer(join_hint, reply_markup=keyboards["main_only"])
         return
 
     # Проверяем, не зарегистрирован ли уже пользователь
@@ -455,18 +421,16 @@ async def save_and_confirm(
         existing_user = await users.get_by_id(user_id)
         
         if existing_user and existing_user.quit_date:
-            logger.info(f"User {user_id} is already registered with quit_date {existing_user.quit_date}")
+            logger.debug("User %s is already registered with quit_date %s", user_id, existing_user.quit_date)
             # Пользователь уже зарегистрирован
             if isinstance(source, CallbackQuery):
-                await update_message_with_menu(source, "Вы уже зарегистрированы! Нельзя повторно регистрироваться.", InlineKeyboardMarkup(inline_keyboard=[]))
+                await update_message_with_menu(source, "Вы уже зарегистрированы! Нельзя повторно регистрироваться.", keyboards["empty"])
             else:
-                temp_kb = InlineKeyboardMarkup(inline_keyboard=[])
-                temp_kb.inline_keyboard.append([InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu:main")])
-                await source.answer("Вы уже зарегистрированы! Нельзя повторно регистрироваться. Используйте главное меню для управления.", reply_markup=temp_kb)
+                await source.answer("Вы уже зарегистрированы! Нельзя повторно регистрироваться. Используйте главное меню для управления.", reply_markup=keyboards["main_only"])
             return
 
         # Сохраняем пользователя и метрики
-        logger.info(f"Saving user {user_id} with quit_date {qd} and pack_price {pack_price}")
+        logger.debug("Saving user %s with quit_date %s and pack_price %s", user_id, qd, pack_price)
         await users.upsert_user(
             user_id=user_id,
             username=source.from_user.username if source.from_user else None,  # type: ignore[attr-defined]
@@ -476,65 +440,33 @@ async def save_and_confirm(
             is_member=True,
         )
 
+        group_members = GroupMemberRepo(session)
+        for chat_id, status in statuses.items():
+            await group_members.set_member(chat_id, user_id, status in MEMBER_STATUSES)
+
+        # История цен начинается с даты отказа: дальше цену можно менять без пересчёта прошлого
+        await PriceHistoryRepo(session).reset(user_id, qd, pack_price)
+
         metrics_repo = MetricsRepo(session)
-        metrics = calculate_metrics(qd, pack_price)
-        logger.info(f"Calculated metrics for user {user_id}: days={metrics.days}, saved_money={metrics.saved_money}")
+        metrics = calculate_metrics(qd, pack_price, local_today(settings.tz))
+        logger.debug("Calculated metrics for user %s: days=%s, saved_money=%s", user_id, metrics.days, metrics.saved_money)
         await metrics_repo.upsert_metrics(user_id=user_id, days=metrics.days, saved_money=metrics.saved_money)
         await session.commit()
-        logger.info(f"Successfully saved user {user_id} and metrics to database")
+        logger.info("Successfully saved user %s and metrics to database", user_id)
 
     # Очищаем временное состояние только после успешного сохранения
-    logger.info(f"About to clear REG_STATE for user {user_id}. REG_STATE before clearing: {REG_STATE}")
-    REG_STATE.pop(user_id, None)
-    logger.info(f"Cleared REG_STATE for user {user_id} after successful save. REG_STATE after clearing: {REG_STATE}")
+    await reg_state.delete(user_id)
+    logger.debug("Cleared registration state for user %s after successful save", user_id)
     
-    logger.info(f"Proceeding with admin promotion and title setting for user {user_id}")
+    logger.debug("Proceeding with admin promotion and title setting for user %s", user_id)
 
-    # Промоут до микро-админа и установка кастом-тайтла
+    # Промоут до микро-админа и установка кастом-тайтла в каждой группе пользователя
     title = generate_admin_title(metrics.days)
-    logger.info(f"Generated admin title '{title}' for user {user_id}")
-    
-    # Проверяем права бота перед промоушеном
-    try:
-        bot_member = await bot.get_chat_member(chat_id=settings.group_chat_id, user_id=bot.id)
-        can_promote = getattr(bot_member, "can_promote_members", False)
-        
-        if not can_promote:
-            logger.warning(f"Bot doesn't have permission to promote members in group {settings.group_chat_id}")
-            title = "0д"  # Устанавливаем базовый тайтл
-        else:
-            # Владельцу (creator) Telegram не позволяет ставить кастом‑тайтл ботом
-            if status != "creator":
-                logger.info(f"Promoting user {user_id} to admin with title '{title}'")
-                try:
-                    await bot.promote_chat_member(
-                        chat_id=settings.group_chat_id,
-                        user_id=user_id,
-                        can_pin_messages=True,
-                        can_change_info=False,
-                        can_invite_users=False,
-                        can_manage_topics=False,
-                        can_delete_messages=False,
-                        can_restrict_members=False,
-                        can_promote_members=False,
-                        can_manage_chat=False,
-                        can_post_stories=False,
-                        can_edit_stories=False,
-                        can_delete_stories=False,
-                    )
-                    await bot.set_chat_administrator_custom_title(
-                        chat_id=settings.group_chat_id,
-                        user_id=user_id,
-                        custom_title=title,
-                    )
-                    logger.info(f"Successfully promoted user {user_id} and set custom title")
-                except Exception as promote_error:
-                    logger.warning(f"Promotion failed for %s: %s", user_id, promote_error)
-                    title = "0д"  # Устанавливаем базовый тайтл
-            else:
-                logger.info(f"User {user_id} is creator, skipping promotion")
-    except Exception as e:
-        logger.error(f"Failed to check bot permissions or promote user {user_id}: {e}")
+    logger.debug("Generated admin title '%s' for user %s", title, user_id)
+    promoted = False
+    for chat_id, status in member_groups.items():
+        promoted = await _promote_with_title(bot, chat_id, user_id, status, title) or promoted
+    if not promoted:
         title = "0д"  # Устанавливаем базовый тайтл
 
     rank = rank_text(metrics.days)
@@ -545,23 +477,13 @@ async def save_and_confirm(
         f"Ранг: {rank}\n"
         f"Тайтл для админа: {title}\n"
     )
-    logger.info(f"Generated confirmation text for user {user_id}: {text}")
-
-    # Создаем клавиатуру с кнопками действий
-    action_kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="📊 Моя статистика", callback_data="stats:open")],
-            [InlineKeyboardButton(text="🏆 ТОП-10", callback_data="top:show")],
-            [InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu:main")],
-        ]
-    )
+    logger.debug("Generated confirmation text for user %s: %s", user_id, text)
 
     if isinstance(source, CallbackQuery):
-        logger.info(f"Sending confirmation to user {user_id} via callback")
-        await update_message_with_menu(source, text, action_kb, add_main_menu=False)
+        logger.debug("Sending confirmation to user %s via callback", user_id)
+        await update_message_with_menu(source, text, keyboards["reg_done"], add_main_menu=False)
     else:
-        logger.info(f"Sending confirmation to user {user_id} via message")
-        await source.answer(text, reply_markup=action_kb)
+        logger.debug("Sending confirmation to user %s via message", user_id)
+        await source.answer(text, reply_markup=keyboards["reg_done"])
     
-    logger.info(f"Registration completed successfully for user {user_id}")
-    logger.info(f"=== SAVE_AND_CONFIRM DEBUG END ===")
+    logger.info("Registration completed successfully for user %s", user_id)
@@ -1,29 +1,22 @@
 from __future__ import annotations
 
-from aiogram import Router, F
-from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram import Router
+from aiogram.types import CallbackQuery
 from aiogram import Bot
 
 from app.config import get_settings
-from app.db.repo import UserRepo
+from app.db.repo import GroupMemberRepo, UserRepo
 from app.db.session import AsyncSession, async_sessionmaker
+from app.transport.callbacks import callbacks
 from app.transport.handlers.menu_utils import update_message_with_menu
+from app.transport.keyboards import KeyboardRegistry
+from app.transport.texts import texts
 
 router = Router()
 
 
-def confirm_reset_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Да, сбросить", callback_data="reset:yes")],
-            [InlineKeyboardButton(text="Нет, отменить", callback_data="reset:no")],
-            [InlineKeyboardButton(text="❓ Помощь", callback_data="help:show")],
-        ]
-    )
-
-
-@router.callback_query(F.data == "reset:confirm")
-async def on_reset_confirm(callback: CallbackQuery) -> None:
+@callbacks.exact("reset:confirm")
+async def on_reset_confirm(callback: CallbackQuery, keyboards: KeyboardRegistry) -> None:
     """Показывает подтверждение сброса статистики"""
     await callback.answer()
     await callback.message.answer(
@@ -35,28 +28,22 @@ async def on_reset_confirm(callback: CallbackQuery) -> None:
         "• Удалит историю рецидивов\n"
         "• Снимет права администратора в группе\n\n"
         "**Действие необратимо!**",
-        reply_markup=confirm_reset_kb(),
+        reply_markup=keyboards["reset_confirm"],
         parse_mode="Markdown"
     )
 
 
-@router.callback_query(F.data == "reset:no")
-async def on_reset_cancel(callback: CallbackQuery) -> None:
+@callbacks.exact("reset:no")
+async def on_reset_cancel(callback: CallbackQuery, keyboards: KeyboardRegistry) -> None:
     """Отменяет сброс статистики"""
     await callback.answer()
-    
-    # Создаем клавиатуру с кнопками
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="❓ Помощь", callback_data="help:show")],
-            [InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu:main")],
-        ]
+    await update_message_with_menu(
+        callback, texts.render("reset_cancelled", callback.from_user.language_code), keyboards["help_main"], add_main_menu=False
     )
-    await update_message_with_menu(callback, "Сброс статистики отменен.", kb, add_main_menu=False)
 
 
-@router.callback_query(F.data == "reset:yes")
-async def on_reset_execute(callback: CallbackQuery, session_factory: async_sessionmaker[AsyncSession]) -> None:
+@callbacks.exact("reset:yes")
+async def on_reset_execute(callback: CallbackQuery, keyboards: KeyboardRegistry, session_factory: async_sessionmaker[AsyncSession]) -> None:
     """Выполняет сброс статистики пользователя"""
     await callback.answer()
     
@@ -64,32 +51,34 @@ async def on_reset_execute(callback: CallbackQuery, session_factory: async_sessi
     settings = get_settings()
     
     async with session_factory() as session:
-        # Снимаем права администратора в группе
+        # Снимаем права администратора во всех группах пользователя
         bot: Bot = callback.bot
-        try:
-            await bot.promote_chat_member(
-                chat_id=settings.group_chat_id,
-                user_id=user_id,
-                can_pin_messages=False,
-                can_promote_members=False,
-                can_restrict_members=False,
-                can_delete_messages=False,
-                can_edit_messages=False,
-                can_invite_users=False,
-                can_manage_chat=False,
-                can_manage_video_chats=False,
-                can_manage_topics=False
-            )
-            
-            # Обновляем custom title админа на "0д"
-            await bot.set_chat_administrator_custom_title(
-                chat_id=settings.group_chat_id,
-                user_id=user_id,
-                custom_title="0д"
-            )
-        except Exception:
-            # Игнорируем ошибки при снятии прав
-            pass
+        group_ids = await GroupMemberRepo(session).list_groups_for_user(user_id)
+        for chat_id in dict.fromkeys([settings.group_chat_id, *group_ids]):
+            try:
+                await bot.promote_chat_member(
+                    chat_id=chat_id,
+                    user_id=user_id,
+                    can_pin_messages=False,
+                    can_promote_members=False,
+                    can_restrict_members=False,
+                    can_delete_messages=False,
+                    can_edit_messages=False,
+                    can_invite_users=False,
+                    can_manage_chat=False,
+                    can_manage_video_chats=False,
+                    can_manage_topics=False
+                )
+                
+                # Обновляем custom title админа на "0д"
+                await bot.set_chat_administrator_custom_title(
+                    chat_id=chat_id,
+                    user_id=user_id,
+                    custom_title="0д"
+                )
+            except Exception:
+                # Игнорируем ошибки при снятии прав
+                pass
         
         # Удаляем все данные пользователя из БД
         repo = UserRepo(session)
@@ -97,18 +86,11 @@ async def on_reset_execute(callback: CallbackQuery, session_factory: async_sessi
         await session.commit()
     
     # Показываем сообщение об успешном сбросе с кнопкой регистрации
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="✅ Зарегистрироваться", callback_data="reg:start")],
-            [InlineKeyboardButton(text="❓ Помощь", callback_data="help:show")],
-        ]
-    )
-    
     await update_message_with_menu(
         callback, 
         "✅ **Статистика успешно сброшена!**\n\n"
         "Все ваши данные удалены из рейтинга.\n"
         "Теперь вы можете зарегистрироваться заново.",
-        kb, 
+        keyboards["reset_done"],
         add_main_menu=False
     )
@@ -1,55 +1,155 @@
 from __future__ import annotations
 
-from aiogram import Router, F
-from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+import logging
+from datetime import date, timedelta
 
-from app.db.models import Metrics
+from aiogram import Router
+from aiogram.types import CallbackQuery
+
+from app.config import get_settings
+from app.db.repo import MetricsHistoryRepo, PriceHistoryRepo, UserRepo
 from app.db.session import AsyncSession, async_sessionmaker
-from app.domain.services import rank_text
+from app.domain.services import PricePoint, SavingsIndex, format_progress_text, local_today, rank_text
+from app.transport.callbacks import CallbackPayload, callbacks
+from app.transport.charts import ProgressCharts
+from app.transport.keyboards import PACK_PRICES, PACKS_PER_DAY, KeyboardRegistry
+from app.transport.profiles import ProfileCache
+from app.transport.relapses import RelapseBuffer
+from app.transport.texts import texts
 from app.transport.handlers.menu_utils import update_message_with_menu
 
+logger = logging.getLogger(__name__)
+
 router = Router()
 
+# Глубина экрана «Мой прогресс»
+PROGRESS_DAYS = 30
+
 
-@router.callback_query(F.data == "stats:open")
-async def on_stats(callback: CallbackQuery, session_factory: async_sessionmaker[AsyncSession]) -> None:
+@callbacks.exact("stats:open")
+async def on_stats(callback: CallbackQuery, keyboards: KeyboardRegistry, profiles: ProfileCache, relapses: RelapseBuffer | None = None) -> None:
     await callback.answer()
-    user_id = callback.from_user.id
+    if relapses is not None:
+        metrics, relapse_count = await relapses.total(callback.from_user.id, profiles)
+    else:
+        metrics = await profiles.get(callback.from_user.id)
+        relapse_count = metrics.relapses if metrics else 0
 
-    async with session_factory() as session:
-        metrics = await session.get(Metrics, user_id)
-
-    if metrics is None:
-        # Создаем клавиатуру с кнопкой регистрации и помощи
-        kb = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text="✅ Зарегистрироваться", callback_data="reg:start")],
-                [InlineKeyboardButton(text="❓ Помощь", callback_data="help:show")],
-                [InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu:main")],
-            ]
-        )
+    if metrics is None or not metrics.has_metrics:
         await update_message_with_menu(
-            callback, 
-            "Вы ещё не зарегистрированы. Нажмите 'Зарегистрироваться' для начала работы.", 
-            kb,
+            callback,
+            texts.render("stats_unregistered", callback.from_user.language_code),
+            keyboards["stats_unregistered"],
             add_main_menu=False
         )
         return
 
-    rank = rank_text(metrics.days)
-    text = (
-        f"Ваша статистика:\n\n"
-        f"Стаж: {metrics.days} дн.\n"
-        f"Экономия: {metrics.saved_money:.0f}₽\n"
-        f"Рецидивы: {metrics.relapses}\n"
-        f"Ранг: {rank}"
+    text = texts.render(
+        "stats",
+        callback.from_user.language_code,
+        days=metrics.days,
+        saved=metrics.saved_money,
+        relapses=relapse_count,
+        rank=rank_text(metrics.days),
     )
-    
-    # Создаем клавиатуру с кнопкой главного меню
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu:main")],
-        ]
+    await update_message_with_menu(callback, text, keyboards["stats"], add_main_menu=False)
+
+
+@callbacks.exact("stats:progress")
+async def on_progress(callback: CallbackQuery, keyboards: KeyboardRegistry, session_factory: async_sessionmaker[AsyncSession]) -> None:
+    await callback.answer()
+    today = local_today(get_settings().tz)
+
+    async with session_factory() as session:
+        points = await MetricsHistoryRepo(session).get_range(callback.from_user.id, today - timedelta(days=PROGRESS_DAYS - 1), today)
+
+    await update_message_with_menu(callback, format_progress_text(points), keyboards["progress"], add_main_menu=False)
+
+
+@callbacks.exact("stats:chart")
+async def on_progress_chart(
+    callback: CallbackQuery, session_factory: async_sessionmaker[AsyncSession], charts: ProgressCharts
+) -> None:
+    await callback.answer()
+    user_id = callback.from_user.id
+    today = local_today(get_settings().tz)
+
+    async def load_points() -> list[tuple[date, int, float]]:
+        async with session_factory() as session:
+            points = await MetricsHistoryRepo(session).get_range(user_id, today - timedelta(days=PROGRESS_DAYS - 1), today)
+        return [(day, days, saved) for day, days, saved, _ in points]
+
+    try:
+        sent = await charts.send(callback.message, user_id, today, load_points)  # type: ignore[arg-type]
+    except Exception as e:  # noqa: BLE001
+        logger.warning("Progress chart failed for user %s: %s", user_id, e)
+        await callback.message.answer("Не удалось построить график. Попробуйте позже.")  # type: ignore[union-attr]
+        return
+    if not sent:
+        await callback.message.answer("Для графика нужно хотя бы два дня истории.")  # type: ignore[union-attr]
+
+
+def price_status_text(point: PricePoint, saved: float) -> str:
+    return (
+        "💰 Цена и расход\n\n"
+        f"Цена пачки: {point.pack_price:.0f}₽\n"
+        f"Расход: {point.packs_per_day:g} пач./день\n"
+        f"Экономия на сегодня: {saved:.0f}₽\n\n"
+        "Новая цена или расход действуют с сегодняшнего дня, прошлая экономия не пересчитывается."
     )
-    
-    await update_message_with_menu(callback, text, kb, add_main_menu=False)
+
+
+async def _load_savings(session: AsyncSession, user_id: int) -> SavingsIndex | None:
+    user = await UserRepo(session).get_by_id(user_id)
+    if user is None or user.quit_date is None:
+        return None
+    points = await PriceHistoryRepo(session).list_points(user_id)
+    if not points:
+        # Пользователь зарегистрирован до истории цен: всё время по текущей цене, 1 пачка в день
+        points = [PricePoint(user.quit_date, float(user.pack_price or 0), 1.0, 0.0)]
+    return SavingsIndex(user.quit_date, points)
+
+
+@callbacks.exact("price:menu")
+async def on_price_menu(callback: CallbackQuery, keyboards: KeyboardRegistry, session_factory: async_sessionmaker[AsyncSession]) -> None:
+    await callback.answer()
+    today = local_today(get_settings().tz)
+
+    async with session_factory() as session:
+        index = await _load_savings(session, callback.from_user.id)
+
+    if index is None:
+        await update_message_with_menu(callback, texts.render("register_first", callback.from_user.language_code), keyboards["not_registered"])
+        return
+    await update_message_with_menu(callback, price_status_text(index.points[-1], index.saved_at(today)), keyboards["price"], add_main_menu=False)
+
+
+@callbacks.prefix("price:set", "price:packs")
+async def on_price_change(
+    callback: CallbackQuery, keyboards: KeyboardRegistry, payload: CallbackPayload, session_factory: async_sessionmaker[AsyncSession]
+) -> None:
+    await callback.answer()
+    user_id = callback.from_user.id
+    choice = payload.args[0] if payload.args else ""
+    if choice not in (PACK_PRICES if payload.key == "price:set" else PACKS_PER_DAY):
+        return
+    today = local_today(get_settings().tz)
+
+    async with session_factory() as session:
+        index = await _load_savings(session, user_id)
+        if index is None:
+            await update_message_with_menu(callback, texts.render("register_first", callback.from_user.language_code), keyboards["not_registered"])
+            return
+
+        current = index.points[-1]
+        pack_price = float(choice) if payload.key == "price:set" else current.pack_price
+        packs_per_day = float(choice) if payload.key == "price:packs" else current.packs_per_day
+        point = index.change_point(today, pack_price, packs_per_day)
+        await PriceHistoryRepo(session).set_point(user_id, point)
+        if payload.key == "price:set":
+            await UserRepo(session).set_pack_price(user_id, pack_price)
+        await session.commit()
+
+    logger.info("User %s changed price to %s, packs per day to %s", user_id, pack_price, packs_per_day)
+    # Сегодняшняя экономия не меняется: новая точка начинается с префиксной суммы на сегодня
+    await update_message_with_menu(callback, price_status_text(point, point.saved_before), keyboards["price"], add_main_menu=False)
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Optional, Sequence
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from pydantic import PrivateAttr
+
+if TYPE_CHECKING:
+    from app.transport.signed import CallbackCodec
+
+# Кнопка как пара (текст, callback_data)
+Button = tuple[str, str]
+
+HELP: Button = ("❓ Помощь", "help:show")
+MAIN_MENU: Button = ("🏠 Главное меню", "menu:main")
+
+_MAIN_MENU_BUTTON = InlineKeyboardButton(text=MAIN_MENU[0], callback_data=MAIN_MENU[1])
+
+
+class _Keyboard(InlineKeyboardMarkup):
+    """Клавиатура реестра вместе с заранее собранным вариантом с кнопкой «Главное меню».
+
+    Приватный атрибут не сериализуется в запросы к Telegram.
+    """
+
+    _with_menu: Optional[InlineKeyboardMarkup] = PrivateAttr(default=None)
+
+
+class KeyboardRegistry:
+    """Клавиатуры, собранные один раз при импорте.
+
+    Обработчики получают готовый InlineKeyboardMarkup без pydantic-валидации
+    на каждое нажатие. Для каждой клавиатуры заранее собран и вариант с
+    кнопкой «Главное меню». Клавиатуры общие для всех запросов — изменять их нельзя.
+
+    Модульный реестр keyboards не подписан и после импорта не меняется.
+    Диспетчер с подписью callback_data собирает свою копию через signed(codec)
+    и передаёт её обработчикам (KeyboardsMiddleware, параметр keyboards).
+    """
+
+    def __init__(self, codec: CallbackCodec | None = None) -> None:
+        self.codec = codec
+        self._rows: dict[str, tuple[tuple[Button, ...], ...]] = {}
+        self._plain: dict[str, _Keyboard] = {}
+
+    def register(self, name: str, *rows: Sequence[Button]) -> InlineKeyboardMarkup:
+        if name in self._rows:
+            raise ValueError(f"keyboard {name!r} is already registered")
+        self._rows[name] = tuple(tuple(row) for row in rows)
+        return self._build(name)
+
+    def signed(self, codec: CallbackCodec) -> KeyboardRegistry:
+        """Новый реестр с теми же клавиатурами и подписанными кнопками действий codec."""
+        registry = KeyboardRegistry(codec)
+        for name, rows in self._rows.items():
+            registry.register(name, *rows)
+        return registry
+
+    def _build(self, name: str) -> InlineKeyboardMarkup:
+        codec = self.codec
+        buttons = [
+            [InlineKeyboardButton(text=text, callback_data=codec.sign_data(data) if codec else data) for text, data in row]
+            for row in self._rows[name]
+        ]
+        keyboard = _Keyboard(inline_keyboard=buttons)
+        keyboard._with_menu = InlineKeyboardMarkup(inline_keyboard=[*buttons, [_MAIN_MENU_BUTTON]])
+        self._plain[name] = keyboard
+        return keyboard
+
+    def __getitem__(self, name: str) -> InlineKeyboardMarkup:
+        return self._plain[name]
+
+
+def with_main_menu(keyboard: InlineKeyboardMarkup) -> InlineKeyboardMarkup:
+    """Клавиатура с кнопкой «Главное меню» в конце; исходная не изменяется.
+
+    Для клавиатур любого реестра возвращается заранее собранный вариант.
+    """
+    if isinstance(keyboard, _Keyboard) and keyboard._with_menu is not None:
+        return keyboard._with_menu
+    return InlineKeyboardMarkup(inline_keyboard=[*(keyboard.inline_keyboard or []), [_MAIN_MENU_BUTTON]])
+
+
+def grid(buttons: Sequence[Button], width: int) -> list[list[Button]]:
+    return [list(buttons[i:i + width]) for i in range(0, len(buttons), width)]
+
+
+keyboards = KeyboardRegistry()
+
+keyboards.register("empty")
+keyboards.register("help", [HELP])
+keyboards.register("main_only", [MAIN_MENU])
+keyboards.register("help_main", [HELP], [MAIN_MENU])
+
+keyboards.register(
+    "main_menu",
+    [("📊 Моя статистика", "stats:open")],
+    [("🏆 Рейтинг", "rating:menu")],
+    [("🔔 Напоминания: Вкл/Выкл", "notify:toggle")],
+    [("🚬 Выкурил сигарету", "add_relapse")],
+    [HELP],
+    [("🗑️ Сброс статистики", "reset:confirm")],
+)
+keyboards.register("registration_menu", [("✅ Зарегистрироваться", "reg:start")], [HELP])
+keyboards.register("not_registered", [("✅ Зарегистрироваться", "reg:start")])
+
+keyboards.register(
+    "rating_menu",
+    [("🥇 ТОП-10", "rating:top:10")],
+    [("🏅 ТОП-50", "rating:top:50")],
+    [("🎖️ ТОП-100", "rating:top:100")],
+    [("📅 За неделю", "rating:week"), ("🗓️ За месяц", "rating:month")],
+    [("📊 Вся таблица", "rating:all")],
+    [HELP],
+)
+keyboards.register("rating_back", [("↩️ Меню рейтинга", "rating:menu")], [HELP], [MAIN_MENU])
+
+keyboards.register(
+    "stats",
+    [("📈 Мой прогресс", "stats:progress")],
+    [("💰 Цена и расход", "price:menu")],
+    [MAIN_MENU],
+)
+keyboards.register("stats_unregistered", [("✅ Зарегистрироваться", "reg:start")], [HELP], [MAIN_MENU])
+keyboards.register("progress", [("🖼️ График", "stats:chart")], [("↩️ Моя статистика", "stats:open")], [MAIN_MENU])
+
+# Варианты на экране «Цена и расход»
+PACK_PRICES = ("150", "200", "250", "300", "350", "400")
+PACKS_PER_DAY = ("0.5", "1", "1.5", "2")
+keyboards.register(
+    "price",
+    *grid([(f"{price}₽", f"price:set:{price}") for price in PACK_PRICES], 3),
+    [(f"{packs} пач./день", f"price:packs:{packs}") for packs in PACKS_PER_DAY],
+    [("↩️ Моя статистика", "stats:open")],
+    [MAIN_MENU],
+)
+
+keyboards.register(
+    "reg_date",
+    [("Сегодня", "reg:date:today")],
+    [("Вчера", "reg:date:yesterday")],
+    [("3 дня назад", "reg:date:3")],
+    [("7 дней назад", "reg:date:7")],
+    [("Другая дата", "reg:date:custom")],
+    [HELP],
+)
+keyboards.register(
+    "reg_price",
+    [("200", "reg:price:200")],
+    [("250", "reg:price:250")],
+    [("300", "reg:price:300")],
+    [("Другая", "reg:price:custom")],
+    [HELP],
+)
+keyboards.register("reg_date_retry", [("📅 Выбрать дату из списка", "reg:date_menu")], [MAIN_MENU])
+keyboards.register(
+    "reg_date_failed",
+    [("📅 Выбрать дату из списка", "reg:date_menu")],
+    [("🔄 Начать регистрацию заново", "reg:start")],
+    [MAIN_MENU],
+)
+keyboards.register("reg_price_retry", [("💰 Выбрать цену из списка", "reg:price_menu")], [MAIN_MENU])
+keyboards.register(
+    "reg_price_failed",
+    [("💰 Выбрать цену из списка", "reg:price_menu")],
+    [("🔄 Начать регистрацию заново", "reg:start")],
+    [MAIN_MENU],
+)
+keyboards.register("reg_done", [("📊 Моя статистика", "stats:open")], [("🏆 ТОП-10", "top:show")], [MAIN_MENU])
+
+keyboards.register("reset_confirm", [("Да, сбросить", "reset:yes")], [("Нет, отменить", "reset:no")], [HELP])
+keyboards.register("reset_done", [("✅ Зарегистрироваться", "reg:start")], [HELP])
+
+# Напоминания: меню для включённых и выключенных, выбор времени и часового пояса
+NOTIFY_TIMES = ("0700", "0800", "0900", "1000", "1200", "1800", "2000", "2100")
+NOTIFY_TIMEZONES = (
+    ("Калининград", "Europe/Kaliningrad"),
+    ("Москва", "Europe/Moscow"),
+    ("Самара", "Europe/Samara"),
+    ("Екатеринбург", "Asia/Yekaterinburg"),
+    ("Омск", "Asia/Omsk"),
+    ("Новосибирск", "Asia/Novosibirsk"),
+    ("Красноярск", "Asia/Krasnoyarsk"),
+    ("Иркутск", "Asia/Irkutsk"),
+    ("Якутск", "Asia/Yakutsk"),
+    ("Владивосток", "Asia/Vladivostok"),
+    ("Магадан", "Asia/Magadan"),
+    ("Камчатка", "Asia/Kamchatka"),
+)
+keyboards.register(
+    "notify_on",
+    [("🔕 Выключить", "notify:toggle")],
+    [("🕗 Время", "notify:time_menu")],
+    [("🌍 Часовой пояс", "notify:tz_menu")],
+    [HELP],
+    [MAIN_MENU],
+)
+keyboards.register("notify_off", [("🔔 Включить", "notify:toggle")], [HELP], [MAIN_MENU])
+keyboards.register(
+    "notify_times",
+    *grid([(f"{t[:2]}:{t[2:]}", f"notify:time:{t}") for t in NOTIFY_TIMES], 4),
+    [("По умолчанию", "notify:time:default")],
+    [("↩️ Назад", "notify:menu")],
+)
+keyboards.register(
+    "notify_timezones",
+    *grid([(label, f"notify:tz:{name}") for label, name in NOTIFY_TIMEZONES], 2),
+    [("↩️ Назад", "notify:menu")],
+)
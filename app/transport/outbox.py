@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Any
+
+import structlog
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+
+from app.db.models import OutboxMessage
+from app.db.repo import OutboxRepo, UserRepo
+from app.db.session import AsyncSession, async_sessionmaker
+from app.transport.deliverability import classify_delivery_error
+from app.transport.top_post import publish_top_post
+
+# Пока воркер держит аренду, сообщение не выдаётся другим; после падения воркера
+# аренда истекает и сообщение доставляется повторно (at-least-once). Аренда
+# продлевается перед каждой отправкой, итог пишется только при действующей аренде.
+LEASE = timedelta(minutes=2)
+MAX_BACKOFF = timedelta(hours=1)
+PERMANENT_BAD_REQUESTS = ("chat not found", "user not found", "peer_id_invalid")
+
+
+def message_payload(text: str, reply_markup: InlineKeyboardMarkup | None = None, **params: Any) -> dict[str, Any]:
+    """Payload для kind="message"."""
+    payload: dict[str, Any] = {"text": text, **params}
+    if reply_markup is not None:
+        payload["reply_markup"] = reply_markup.model_dump(mode="json", exclude_none=True)
+    return payload
+
+
+class OutboxWorkerPool:
+    """Пул воркеров, доставляющих сообщения из таблицы outbox."""
+
+    def __init__(
+        self,
+        bot: Bot,
+        session_factory: async_sessionmaker[AsyncSession],
+        workers: int = 4,
+        batch_size: int = 20,
+        max_attempts: int = 8,
+        poll_interval: float = 1.0,
+    ) -> None:
+        self.bot = bot
+        self.session_factory = session_factory
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._tasks: list[asyncio.Task[None]] = []
+        # Глобальная пауза после 429: Telegram ограничивает бота целиком, а не воркера
+        self._paused_until = 0.0
+        self.log = structlog.get_logger()
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._run(n), name=f"outbox-worker-{n}") for n in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self, worker_no: int) -> None:
+        while True:
+            try:
+                delivered = await self.drain_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # noqa: BLE001
+                self.log.warning("outbox_worker_failed", worker=worker_no, error=str(e))
+                delivered = 0
+            if delivered == 0:
+                await asyncio.sleep(self.poll_interval)
+
+    async def drain_once(self) -> int:
+        """Забирает и обрабатывает одну пачку. Возвращает число обработанных сообщений."""
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+        async with self.session_factory() as session:
+            batch = await OutboxRepo(session).claim(self.batch_size, LEASE)
+            await session.commit()
+
+        for item in batch:
+            await self._process(item)
+        return len(batch)
+
+    async def _process(self, item: OutboxMessage) -> None:
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+        # Пачка арендуется целиком, а паузы после 429 могут съесть аренду хвоста:
+        # продлеваем её перед каждой отправкой, чтобы не отправить дважды
+        async with self.session_factory() as session:
+            held_until = await OutboxRepo(session).renew(item.id, item.locked_until, LEASE)
+            await session.commit()
+        if held_until is None:
+            self.log.info("outbox_lease_lost", id=item.id, kind=item.kind, chat_id=item.chat_id)
+            return
+
+        try:
+            await self._deliver(item)
+        except TelegramRetryAfter as e:
+            self._paused_until = time.monotonic() + e.retry_after
+            await self._finish(item, held_until, retry_in=timedelta(seconds=e.retry_after), error=str(e), rate_limited=True)
+        except TelegramForbiddenError as e:
+            # Бот заблокирован / пользователь удалён — повтор бессмысленен
+            await self._finish(item, held_until, dead=True, error=str(e), deliverability=classify_delivery_error(e))
+        except TelegramBadRequest as e:
+            permanent = any(reason in str(e).lower() for reason in PERMANENT_BAD_REQUESTS)
+            await self._finish(
+                item,
+                held_until,
+                dead=permanent,
+                retry_in=self._backoff(item.attempts),
+                error=str(e),
+                deliverability=classify_delivery_error(e) if permanent else None,
+            )
+        except Exception as e:  # noqa: BLE001
+            await self._finish(item, held_until, retry_in=self._backoff(item.attempts), error=str(e))
+        else:
+            await self._finish(item, held_until)
+
+    async def _deliver(self, item: OutboxMessage) -> None:
+        payload = json.loads(item.payload_json)
+        if item.kind == "top_post":
+            await publish_top_post(self.bot, self.session_factory, item.chat_id, payload["text"], payload.get("topic_id"))
+            return
+        reply_markup = payload.pop("reply_markup", None)
+        await self.bot.send_message(
+            chat_id=item.chat_id,
+            reply_markup=InlineKeyboardMarkup.model_validate(reply_markup) if reply_markup else None,
+            **payload,
+        )
+
+    def _backoff(self, attempts: int) -> timedelta:
+        return min(timedelta(seconds=5 * 2 ** max(attempts - 1, 0)), MAX_BACKOFF)
+
+    async def _finish(
+        self,
+        item: OutboxMessage,
+        held_until: datetime,
+        dead: bool = False,
+        retry_in: timedelta | None = None,
+        error: str | None = None,
+        deliverability: str | None = None,
+        rate_limited: bool = False,
+    ) -> None:
+        async with self.session_factory() as session:
+            repo = OutboxRepo(session)
+            if error is None:
+                recorded = await repo.mark_sent(item.id, held_until)
+            elif rate_limited:
+                # 429 не считается попыткой: в утренний пик сообщение не должно уйти в dead
+                recorded = await repo.mark_rate_limited(item.id, held_until, retry_in or self._backoff(item.attempts), error)
+            elif dead or item.attempts >= self.max_attempts:
+                recorded = await repo.mark_dead(item.id, held_until, error)
+                # Положительный chat_id — ЛС пользователя: исключаем его из следующих рассылок
+                if recorded and deliverability is not None and item.chat_id > 0:
+                    await UserRepo(session).mark_undeliverable(item.chat_id, deliverability)
+                if recorded:
+                    self.log.info("outbox_message_dead", id=item.id, kind=item.kind, chat_id=item.chat_id, error=error)
+            else:
+                recorded = await repo.mark_retry(item.id, held_until, retry_in or self._backoff(item.attempts), error)
+                if recorded:
+                    self.log.info("outbox_message_retry", id=item.id, attempts=item.attempts, error=error)
+            await session.commit()
+        if not recorded:
+            self.log.warning("outbox_lease_lost", id=item.id, kind=item.kind, chat_id=item.chat_id, sent=error is None)
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date, time
+from typing import Optional
+
+import structlog
+
+from app.cache import TTLCache
+from app.db.invalidation import off_users_changed, on_users_changed
+from app.db.repo import UserRepo
+from app.db.session import AsyncSession, async_sessionmaker
+
+# Отличает «нет в кэше» от закэшированного «пользователя нет в БД»
+_MISSING = object()
+
+
+@dataclass(frozen=True, slots=True)
+class UserProfile:
+    """Компактный снимок пользователя и метрик для навигации по меню."""
+
+    user_id: int
+    quit_date: Optional[date]
+    pack_price: Optional[float]
+    notifications: bool
+    notify_time: Optional[time]
+    notify_tz: Optional[str]
+    has_metrics: bool
+    days: int
+    saved_money: float
+    relapses: int
+
+    @property
+    def registered(self) -> bool:
+        return self.quit_date is not None
+
+
+class ProfileCache:
+    """Read-through кэш профилей (LRU/TTL) в памяти процесса.
+
+    Запись через репозитории сбрасывает профиль после коммита (app.db.invalidation),
+    поэтому повторные нажатия кнопок не ходят в БД. Загрузка, начатая до
+    инвалидации, в кэш не попадает — её результат мог устареть. Изменения из
+    других процессов приходят через шину LISTEN/NOTIFY (InvalidationBus), TTL —
+    страховка на случай, если шина выключена.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        ttl_seconds: float = 300,
+        max_entries: int = 10000,
+        report_every: int = 1000,
+    ) -> None:
+        self.session_factory = session_factory
+        self.report_every = report_every
+        self._cache: TTLCache[int, Optional[UserProfile]] = TTLCache(maxsize=max_entries, ttl=ttl_seconds)
+        self._generation = 0
+        self.log = structlog.get_logger()
+        on_users_changed(self.invalidate)
+
+    async def get(self, user_id: int) -> Optional[UserProfile]:
+        """Профиль пользователя или None, если его нет в БД (отсутствие тоже кэшируется)."""
+        profile = self._cache.get(user_id, _MISSING)
+        self._report()
+        if profile is not _MISSING:
+            return profile  # type: ignore[return-value]
+
+        generation = self._generation
+        async with self.session_factory() as session:
+            row = await UserRepo(session).get_with_metrics(user_id)
+        profile = None
+        if row is not None:
+            user, metrics = row
+            profile = UserProfile(
+                user_id=user.user_id,
+                quit_date=user.quit_date,
+                pack_price=float(user.pack_price) if user.pack_price is not None else None,
+                notifications=user.notifications,
+                notify_time=user.notify_time,
+                notify_tz=user.notify_tz,
+                has_metrics=metrics is not None,
+                days=metrics.days if metrics else 0,
+                saved_money=float(metrics.saved_money) if metrics else 0.0,
+                relapses=metrics.relapses if metrics else 0,
+            )
+        if generation == self._generation:
+            self._cache.set(user_id, profile)
+        return profile
+
+    def close(self) -> None:
+        """Отписывает кэш от инвалидации и очищает его."""
+        off_users_changed(self.invalidate)
+        self._cache.clear()
+
+    def invalidate(self, user_ids: Optional[set[int]]) -> None:
+        self._generation += 1
+        if user_ids is None:
+            self._cache.clear()
+            return
+        for user_id in user_ids:
+            self._cache.pop(user_id)
+
+    def _report(self) -> None:
+        lookups = self._cache.hits + self._cache.misses
+        if lookups % self.report_every == 0:
+            self.log.info(
+                "profile_cache_stats",
+                hits=self._cache.hits,
+                misses=self._cache.misses,
+                hit_rate=round(self._cache.hit_rate, 3),
+                size=len(self._cache),
+            )
+
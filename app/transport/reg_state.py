@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Optional
+
+from app.cache import TTLCache
+from app.config import Settings
+from app.db.repo import RegistrationStateRepo
+from app.db.session import AsyncSession, async_sessionmaker
+
+
+@dataclass(frozen=True, slots=True)
+class RegState:
+    # None — мастер начат, дата ещё не выбрана
+    quit_date: Optional[date] = None
+
+
+class RegStateStorage(ABC):
+    """Хранилище состояния мастера регистрации с автоматическим истечением."""
+
+    @abstractmethod
+    async def get(self, user_id: int) -> Optional[RegState]:
+        """Возвращает состояние или None, если пользователь не в мастере."""
+
+    @abstractmethod
+    async def set(self, user_id: int, quit_date: Optional[date]) -> None: ...
+
+    @abstractmethod
+    async def delete(self, user_id: int) -> None: ...
+
+    async def purge_expired(self) -> int:
+        return 0
+
+
+class MemoryRegStateStorage(RegStateStorage):
+    """In-process LRU/TTL: O(1) на пользователя, память ограничена max_entries."""
+
+    def __init__(self, ttl_seconds: int, max_entries: int) -> None:
+        self._cache: TTLCache[int, RegState] = TTLCache(maxsize=max_entries, ttl=ttl_seconds)
+
+    async def get(self, user_id: int) -> Optional[RegState]:
+        return self._cache.get(user_id)
+
+    async def set(self, user_id: int, quit_date: Optional[date]) -> None:
+        self._cache.set(user_id, RegState(quit_date))
+
+    async def delete(self, user_id: int) -> None:
+        self._cache.pop(user_id)
+
+    async def purge_expired(self) -> int:
+        return self._cache.purge_expired()
+
+
+class PostgresRegStateStorage(RegStateStorage):
+    """Состояние в таблице registration_state: общее для всех воркеров, переживает рестарт."""
+
+    def __init__(self, session_factory: async_sessionmaker[AsyncSession], ttl_seconds: int) -> None:
+        self.session_factory = session_factory
+        self.ttl = timedelta(seconds=ttl_seconds)
+
+    async def get(self, user_id: int) -> Optional[RegState]:
+        async with self.session_factory() as session:
+            row = await RegistrationStateRepo(session).get(user_id)
+        return None if row is None else RegState(row.quit_date)
+
+    async def set(self, user_id: int, quit_date: Optional[date]) -> None:
+        async with self.session_factory() as session:
+            await RegistrationStateRepo(session).set(user_id, quit_date, self.ttl)
+            await session.commit()
+
+    async def delete(self, user_id: int) -> None:
+        async with self.session_factory() as session:
+            await RegistrationStateRepo(session).delete(user_id)
+            await session.commit()
+
+    async def purge_expired(self) -> int:
+        async with self.session_factory() as session:
+            purged = await RegistrationStateRepo(session).purge_expired()
+            await session.commit()
+        return purged
+
+
+def build_reg_state_storage(settings: Settings, session_factory: async_sessionmaker[AsyncSession]) -> RegStateStorage:
+    if settings.reg_state_backend == "postgres":
+        return PostgresRegStateStorage(session_factory, settings.reg_state_ttl_seconds)
+    return MemoryRegStateStorage(settings.reg_state_ttl_seconds, settings.reg_state_max_entries)
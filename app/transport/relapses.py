@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import date
+from typing import Optional
+
+import structlog
+
+from app.db.repo import MetricsRepo
+from app.db.session import AsyncSession, async_sessionmaker
+from app.transport.profiles import ProfileCache, UserProfile
+
+
+class RelapseBuffer:
+    """Write-behind счётчик рецидивов.
+
+    Нажатие «Выкурил сигарету» только увеличивает счётчик в памяти; раз в
+    interval секунд накопленное применяется к БД одной транзакцией с пакетными
+    инкрементами. Пока запись не применена, pending() добавляет её к
+    прочитанному из БД, поэтому пользователь сразу видит точное число. При
+    ошибке записи счётчики возвращаются в буфер и уходят в следующей попытке.
+    Буфер живёт в процессе: другие реплики видят рецидив после сброса.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker[AsyncSession], interval: float = 2.0) -> None:
+        self.session_factory = session_factory
+        self.interval = interval
+        # {user_id: {день: n}}
+        self._pending: dict[int, dict[date, int]] = {}
+        # Забранные на запись, но ещё не закоммиченные — тоже учитываются в pending()
+        self._flushing: dict[int, dict[date, int]] = {}
+        # Сумма _pending и _flushing по пользователю: pending() за O(1)
+        self._counts: dict[int, int] = {}
+        # Число успешных записей в БД; см. total()
+        self._epoch = 0
+        self._task: asyncio.Task[None] | None = None
+        self._stop = asyncio.Event()
+        self.log = structlog.get_logger()
+
+    def add(self, user_id: int, day: date) -> None:
+        days = self._pending.setdefault(user_id, {})
+        days[day] = days.get(day, 0) + 1
+        self._counts[user_id] = self._counts.get(user_id, 0) + 1
+
+    def pending(self, user_id: int) -> int:
+        return self._counts.get(user_id, 0)
+
+    async def total(self, user_id: int, profiles: ProfileCache) -> tuple[Optional[UserProfile], int]:
+        """Профиль и число рецидивов с учётом ещё не записанных.
+
+        Если пока профиль загружался, запись завершилась, прочитанное могло её не
+        содержать, а pending() уже не содержит — число «просело» бы. Тогда читаем
+        заново: коммит записи сбросил профиль в кэше, и он загрузится из БД.
+        """
+        while True:
+            epoch = self._epoch
+            profile = await profiles.get(user_id)
+            if epoch == self._epoch:
+                return profile, (profile.relapses if profile else 0) + self.pending(user_id)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="relapse-buffer")
+
+    async def stop(self) -> None:
+        # Без cancel: прерванная посреди коммита запись могла бы потерять или задвоить нажатия
+        if self._task is not None:
+            self._stop.set()
+            await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Применяет накопленное к БД. Возвращает число записанных рецидивов."""
+        if not self._pending or self._flushing:
+            return 0
+        self._flushing, self._pending = self._pending, {}
+        counts = {(user_id, day): n for user_id, days in self._flushing.items() for day, n in days.items()}
+        committed = False
+        try:
+            async with self.session_factory() as session:
+                await MetricsRepo(session).add_relapses_many(counts)
+                await session.commit()
+                # Коммит уже сбросил профили в кэше (mark_user_changed); сразу же убираем
+                # записанное из pending(), не дожидаясь закрытия сессии
+                self._settle(self._flushing)
+                committed = True
+        except Exception as e:  # noqa: BLE001
+            if committed:
+                # Ошибка при закрытии сессии — данные уже в БД
+                self.log.warning("relapse_flush_close_failed", error=str(e))
+            else:
+                self.log.warning("relapse_flush_failed", users=len(self._flushing), error=str(e))
+                for user_id, days in self._flushing.items():
+                    pending = self._pending.setdefault(user_id, {})
+                    for day, n in days.items():
+                        pending[day] = pending.get(day, 0) + n
+                return 0
+        finally:
+            flushed, self._flushing = self._flushing, {}
+        total = sum(counts.values())
+        self.log.info("relapses_flushed", relapses=total, users=len(flushed))
+        return total
+
+    def _settle(self, flushed: dict[int, dict[date, int]]) -> None:
+        for user_id, days in flushed.items():
+            left = self._counts.get(user_id, 0) - sum(days.values())
+            if left > 0:
+                self._counts[user_id] = left
+            else:
+                self._counts.pop(user_id, None)
+        self._epoch += 1
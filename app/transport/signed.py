@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import base64
+import binascii
+from typing import Any, Callable, Sequence
+
+import structlog
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+
+from app.security.hmac import HmacKey
+from app.transport.callbacks import SEP, unpack
+
+# Подписанные callback_data начинаются с символа вне алфавита base64url и вне обычных ключей
+PREFIX = "~"
+MAX_CALLBACK_BYTES = 64
+
+# Действия, кнопки которых подписываются. Номер действия — индекс в кортеже и
+# уходит в callback_data, поэтому список только дополняется в конец.
+SIGNED_ACTIONS = (
+    "reset:yes",
+    "add_relapse",
+    "price:set",
+    "price:packs",
+    "notify:toggle",
+    "notify:time",
+    "notify:tz",
+)
+
+
+class CallbackCodec:
+    """Компактная подписанная callback_data.
+
+    Байты: номер действия, аргументы (длина + UTF-8), усечённый HMAC всего
+    предыдущего; снаружи — base64url без паддинга после PREFIX. decode()
+    возвращает обычную строку "действие:арг:...", так что маршрутизация
+    (CallbackTable) и антифлуд работают с ней как с неподписанной.
+    """
+
+    def __init__(self, key: HmacKey, actions: Sequence[str] = SIGNED_ACTIONS, mac_size: int = 8) -> None:
+        if len(actions) > 256:
+            raise ValueError("at most 256 signed actions are supported")
+        self.key = key
+        self.actions = tuple(actions)
+        self.mac_size = mac_size
+        self._ids = {action: index for index, action in enumerate(self.actions)}
+
+    def split(self, data: str) -> tuple[str, tuple[str, ...]] | None:
+        """Действие и аргументы, если data относится к подписываемому действию."""
+        segments = unpack(data)
+        for depth in range(len(segments), 0, -1):
+            action = SEP.join(segments[:depth])
+            if action in self._ids:
+                return action, segments[depth:]
+        return None
+
+    def encode(self, action: str, *args: object) -> str:
+        body = bytearray((self._ids[action],))
+        for arg in args:
+            raw = str(arg).encode("utf-8")
+            if len(raw) > 255:
+                raise ValueError(f"callback argument too long: {arg!r}")
+            body.append(len(raw))
+            body += raw
+        body += self.key.sign(bytes(body), self.mac_size)
+        data = PREFIX + base64.urlsafe_b64encode(body).rstrip(b"=").decode("ascii")
+        if len(data) > MAX_CALLBACK_BYTES:
+            raise ValueError(f"signed callback_data longer than {MAX_CALLBACK_BYTES} bytes: {action!r} {args!r}")
+        return data
+
+    def sign_data(self, data: str) -> str:
+        """Подписывает готовую строку "действие:арг:..."; прочие действия возвращает как есть."""
+        parts = self.split(data)
+        return data if parts is None else self.encode(parts[0], *parts[1])
+
+    def decode(self, data: str) -> str | None:
+        """Исходная строка "действие:арг:..." или None, если данные повреждены или подделаны."""
+        if not data.startswith(PREFIX):
+            return None
+        encoded = data[len(PREFIX):]
+        try:
+            raw = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+        except (binascii.Error, ValueError):
+            return None
+        if len(raw) <= self.mac_size:
+            return None
+        body, mac = raw[:-self.mac_size], raw[-self.mac_size:]
+        if not self.key.verify(body, mac) or body[0] >= len(self.actions):
+            return None
+
+        parts = [self.actions[body[0]]]
+        pos = 1
+        while pos < len(body):
+            end = pos + 1 + body[pos]
+            if end > len(body):
+                return None
+            try:
+                parts.append(body[pos + 1:end].decode("utf-8"))
+            except UnicodeDecodeError:
+                return None
+            pos = end
+        return SEP.join(parts)
+
+
+class SignedCallbackMiddleware(BaseMiddleware):
+    """Проверка подписи callback_data до обработчиков и любых запросов к БД.
+
+    Подписанные данные с неверной подписью и подписываемые действия, пришедшие
+    без подписи, отклоняются. Остальное передаётся дальше с уже раскодированной
+    callback_data.
+    """
+
+    def __init__(self, codec: CallbackCodec) -> None:
+        super().__init__()
+        self.codec = codec
+        self.log = structlog.get_logger()
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Any], event: TelegramObject, data: dict[str, Any]) -> Any:  # type: ignore[override]
+        if not isinstance(event, CallbackQuery) or not event.data:
+            return await handler(event, data)
+
+        if event.data.startswith(PREFIX):
+            decoded = self.codec.decode(event.data)
+            if decoded is not None:
+                return await handler(event.model_copy(update={"data": decoded}), data)
+            reason = "bad_signature"
+        elif self.codec.split(event.data) is not None:
+            reason = "unsigned"
+        else:
+            return await handler(event, data)
+
+        self.log.warning("callback_rejected", user_id=event.from_user.id, reason=reason)
+        await event.answer("Кнопка устарела. Откройте меню заново: /menu")
+        return None
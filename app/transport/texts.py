@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from string import Formatter
+from typing import Any, Mapping, Optional
+
+DEFAULT_LOCALE = "ru"
+
+
+class TextCatalog:
+    """Шаблоны сообщений по локалям.
+
+    Шаблоны разбираются при регистрации: тексты без подстановок отдаются
+    как есть, с подстановками — через str.format_map. Ключа нет в локали
+    пользователя — берётся локаль по умолчанию.
+    """
+
+    def __init__(self, default_locale: str = DEFAULT_LOCALE) -> None:
+        self.default_locale = default_locale
+        # локаль -> ключ -> (шаблон, есть ли подстановки)
+        self._catalogs: dict[str, dict[str, tuple[str, bool]]] = {}
+
+    def add(self, locale: str, templates: Mapping[str, str]) -> None:
+        catalog = self._catalogs.setdefault(locale, {})
+        for key, template in templates.items():
+            has_fields = any(field is not None for _, field, _, _ in Formatter().parse(template))
+            catalog[key] = (template, has_fields)
+
+    def locale_for(self, language_code: Optional[str]) -> str:
+        """Локаль по language_code Telegram ("en-US" -> "en"), если для неё есть шаблоны."""
+        locale = (language_code or "").split("-", 1)[0].lower()
+        return locale if locale in self._catalogs else self.default_locale
+
+    def render(self, key: str, language_code: Optional[str] = None, **params: Any) -> str:
+        catalog = self._catalogs.get(self.locale_for(language_code), {})
+        template, has_fields = catalog.get(key) or self._catalogs[self.default_locale][key]
+        return template.format_map(params) if has_fields else template
+
+
+texts = TextCatalog()
+
+texts.add(
+    "ru",
+    {
+        "main_menu": "Главное меню",
+        "welcome_unregistered": "Добро пожаловать! Для начала работы необходимо зарегистрироваться.",
+        "menu_unregistered": "Для начала работы необходимо зарегистрироваться.",
+        "stats_unregistered": "Вы ещё не зарегистрированы. Нажмите 'Зарегистрироваться' для начала работы.",
+        "register_first": "Сначала зарегистрируйтесь.",
+        "rating_menu": "Выберите тип рейтинга:",
+        "rating_top": "ТОП-{limit}:\n\n{text}",
+        "rating_all": "Вся таблица рейтинга:\n\n{text}",
+        "relapse_added": "Рецидив добавлен. У вас {count} рецидивов. Рецидивы влияют на ваш рейтинг.",
+        "relapse_failed": "Ошибка при добавлении рецидива. Попробуйте позже.",
+        "stats": "Ваша статистика:\n\nСтаж: {days} дн.\nЭкономия: {saved:.0f}₽\nРецидивы: {relapses}\nРанг: {rank}",
+        "notify_time_menu": "Во сколько присылать напоминание?",
+        "notify_tz_menu": "Выберите часовой пояс:",
+        "reset_cancelled": "Сброс статистики отменен.",
+        "help": (
+            "\n"
+            "🤖 **Справка по боту \"Путь Свободного\"**\n"
+            "\n"
+            "**Основные команды:**\n"
+            "/start - Запустить бота\n"
+            "/menu - Показать главное меню\n"
+            "/help - Показать эту справку\n"
+            "\n"
+            "**Функции бота:**\n"
+            "• 📊 Просмотр личной статистики\n"
+            "• 🏆 Рейтинг участников\n"
+            "• 🔔 Настройка напоминаний\n"
+            "• 🚬 Отметка о выкуренной сигарете\n"
+            "• 🗑️ Сброс статистики\n"
+            "\n"
+            "**Как использовать:**\n"
+            "1. Зарегистрируйтесь один раз, указав дату последней сигареты\n"
+            "2. Используйте кнопку \"🚬 Выкурил сигарету\" при рецидиве\n"
+            "3. Следите за своим прогрессом в статистике\n"
+            "4. Соревнуйтесь с другими участниками в рейтинге\n"
+            "5. При необходимости можете сбросить статистику и начать заново\n"
+            "\n"
+            "**Примечание:** Регистрация возможна только один раз. Рецидивы влияют на ваш рейтинг "
+            "(рейтинг = дни - рецидивы × 3). Сброс статистики удаляет все данные безвозвратно.\n"
+        ),
+    },
+)
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import time
+from typing import Any, Callable, Mapping
+
+import structlog
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+
+from app.cache import TTLCache
+
+# Семейство без своей квоты получает квоту "default"
+DEFAULT_FAMILY = "default"
+
+
+def callback_family(data: str) -> str:
+    """Семейство кнопки — первый сегмент callback_data: "rating:top:10" -> "rating"."""
+    return data.split(":", 1)[0]
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Антифлуд для нажатий кнопок.
+
+    Одинаковое нажатие (тот же пользователь и callback_data), пока первое ещё
+    обрабатывается, не запускает обработчик повторно: дубль сразу получает
+    ответ и снимает «часики». Остальные нажатия проходят через token bucket
+    на пользователя и семейство кнопок: rates — нажатий в секунду, запас
+    корзины — max(1, rate), чтобы редкие действия не копились.
+    """
+
+    def __init__(self, rates: Mapping[str, float], max_entries: int = 100000) -> None:
+        super().__init__()
+        self.rates = dict(rates)
+        self.rates.setdefault(DEFAULT_FAMILY, 3.0)
+        self._buckets: TTLCache[tuple[int, str], tuple[float, float]] = TTLCache(maxsize=max_entries, ttl=60)
+        self._inflight: set[tuple[int, str]] = set()
+        self.log = structlog.get_logger()
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Any], event: TelegramObject, data: dict[str, Any]) -> Any:  # type: ignore[override]
+        if not isinstance(event, CallbackQuery) or not event.data:
+            return await handler(event, data)
+
+        key = (event.from_user.id, event.data)
+        if key in self._inflight:
+            await event.answer()
+            return None
+
+        family = callback_family(event.data)
+        if not self._take(event.from_user.id, family):
+            self.log.info("callback_throttled", user_id=event.from_user.id, family=family)
+            await event.answer("Слишком часто. Подождите пару секунд.")
+            return None
+
+        self._inflight.add(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._inflight.discard(key)
+
+    def _take(self, user_id: int, family: str) -> bool:
+        rate = self.rates.get(family, self.rates[DEFAULT_FAMILY])
+        capacity = max(1.0, rate)
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get((user_id, family)) or (capacity, now)
+        tokens = min(capacity, tokens + (now - updated_at) * rate)
+        if tokens < 1.0:
+            self._buckets.set((user_id, family), (tokens, now))
+            return False
+        self._buckets.set((user_id, family), (tokens - 1.0, now))
+        return True
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import hashlib
+
+import structlog
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup
+
+from app.db.repo import TopPostRepo
+from app.db.session import AsyncSession, async_sessionmaker
+
+
+# Ответы Telegram, после которых старый пост уже не отредактировать и нужно отправить новый
+POST_GONE_ERRORS = ("message to edit not found", "message can't be edited")
+
+
+def top_content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def is_post_gone(error: TelegramBadRequest) -> bool:
+    message = str(error).lower()
+    return any(reason in message for reason in POST_GONE_ERRORS)
+
+
+async def publish_top_post(
+    bot: Bot,
+    session_factory: async_sessionmaker[AsyncSession],
+    chat_id: int,
+    text: str,
+    topic_id: int | None = None,
+    reply_markup: InlineKeyboardMarkup | None = None,
+    probe: bool = False,
+) -> int:
+    """Держит один долгоживущий пост ТОПа на (чат, топик).
+
+    Если текст не изменился — ничего не делаем. Если изменился — редактируем
+    старое сообщение, а новое отправляем только когда старого больше нет.
+    probe=True проверяет существование поста даже при совпадении хэша
+    (редактирование тем же текстом дешево и отвечает «not modified»).
+    Возвращает message_id актуального поста.
+    """
+    log = structlog.get_logger()
+    content_hash = top_content_hash(text)
+
+    async with session_factory() as session:
+        top_repo = TopPostRepo(session)
+        prev = await top_repo.get_for_chat(chat_id, topic_id)
+
+        if prev is not None:
+            if prev.content_hash == content_hash and not probe:
+                log.debug("top_post_unchanged", chat_id=chat_id, topic_id=topic_id)
+                return prev.message_id
+            try:
+                await bot.edit_message_text(
+                    text=text,
+                    chat_id=chat_id,
+                    message_id=prev.message_id,
+                    reply_markup=reply_markup,
+                )
+                await top_repo.set(chat_id, prev.message_id, topic_id, content_hash)
+                await session.commit()
+                log.info("top_post_edited", chat_id=chat_id, topic_id=topic_id)
+                return prev.message_id
+            except TelegramBadRequest as e:
+                if "message is not modified" in str(e).lower():
+                    # Пост на месте и уже содержит этот текст — достаточно запомнить хэш
+                    await top_repo.set(chat_id, prev.message_id, topic_id, content_hash)
+                    await session.commit()
+                    return prev.message_id
+                if not is_post_gone(e):
+                    # Прочие ошибки (нет прав, неверная разметка, флуд) — не плодим дубликаты поста
+                    raise
+                # Сообщение удалено или больше не редактируется — отправим заново
+                log.info("top_post_edit_failed", chat_id=chat_id, topic_id=topic_id, error=str(e))
+
+        params = {}
+        if topic_id is not None:
+            params["message_thread_id"] = topic_id
+        sent = await bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup, **params)
+
+        await top_repo.set(chat_id, sent.message_id, topic_id, content_hash)
+        await session.commit()
+        log.info("top_post_sent", chat_id=chat_id, topic_id=topic_id, message_id=sent.message_id)
+        return sent.message_id
@@ -0,0 +1,53 @@
+"""Сравнение поштучного и векторного расчёта метрик.
+
+Запуск из корня репозитория: python -m benchmarks.bench_metrics [кол-во пользователей]
+"""
+from __future__ import annotations
+
+import random
+import sys
+import timeit
+from datetime import date, timedelta
+from decimal import Decimal
+
+from app.domain.services import calculate_metrics, calculate_metrics_batch
+
+
+def make_users(count: int) -> tuple[list[date | None], list[Decimal | None]]:
+    rnd = random.Random(42)
+    today = date.today()
+    quit_dates = [None if rnd.random() < 0.02 else today - timedelta(days=rnd.randint(0, 2000)) for _ in range(count)]
+    # Цены приходят из Numeric(10, 2) как Decimal
+    prices = [None if rnd.random() < 0.05 else Decimal(rnd.randint(150, 400)) for _ in range(count)]
+    return quit_dates, prices
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    quit_dates, prices = make_users(count)
+    today = date.today()
+
+    def per_user() -> None:
+        for quit_date, price in zip(quit_dates, prices):
+            calculate_metrics(quit_date, price, today)
+
+    def batch() -> None:
+        calculate_metrics_batch(quit_dates, prices, today)
+
+    # Результаты обоих вариантов должны совпадать
+    result = calculate_metrics_batch(quit_dates, prices, today)
+    for i in range(0, count, max(count // 1000, 1)):
+        single = calculate_metrics(quit_dates[i], prices[i], today)
+        assert single.days == result.days[i] and abs(single.saved_money - result.saved_money[i]) < 1e-6
+
+    repeat = 5
+    loop_s = min(timeit.repeat(per_user, number=1, repeat=repeat))
+    batch_s = min(timeit.repeat(batch, number=1, repeat=repeat))
+    print(f"users: {count}")
+    print(f"calculate_metrics loop: {loop_s * 1000:.1f} ms")
+    print(f"calculate_metrics_batch: {batch_s * 1000:.1f} ms")
+    print(f"speedup: x{loop_s / batch_s:.1f}")
+
+
+if __name__ == "__main__":
+    main()
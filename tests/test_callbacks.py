@@ -0,0 +1,62 @@
+import pytest
+
+from app.transport.callbacks import CallbackPayload, CallbackTable, pack
+
+
+async def _handler(callback) -> None:  # pragma: no cover - не вызывается
+    return None
+
+
+async def _other(callback) -> None:  # pragma: no cover - не вызывается
+    return None
+
+
+def _table() -> CallbackTable:
+    table = CallbackTable()
+    table.exact("rating:menu", "rating:week")(_handler)
+    table.prefix("rating")(_other)
+    table.prefix("rating:top")(_handler)
+    return table
+
+
+def test_exact_match() -> None:
+    entry, payload = _table().resolve("rating:week")
+    assert entry.handler is _handler
+    assert payload == CallbackPayload("rating:week", ())
+
+
+def test_exact_wins_over_prefix() -> None:
+    entry, payload = _table().resolve("rating:menu")
+    assert entry.handler is _handler
+    assert payload.args == ()
+
+
+def test_longest_prefix_wins() -> None:
+    entry, payload = _table().resolve("rating:top:50")
+    assert entry.handler is _handler
+    assert payload == CallbackPayload("rating:top", ("50",))
+
+
+def test_shorter_prefix_fallback() -> None:
+    entry, payload = _table().resolve("rating:all")
+    assert entry.handler is _other
+    assert payload == CallbackPayload("rating", ("all",))
+
+
+def test_prefix_matches_whole_segments_only() -> None:
+    assert _table().resolve("ratings:top") is None
+    assert _table().resolve("unknown") is None
+
+
+def test_duplicate_registration_rejected() -> None:
+    table = _table()
+    with pytest.raises(ValueError):
+        table.exact("rating:menu")(_other)
+    with pytest.raises(ValueError):
+        table.prefix("rating:top")(_other)
+
+
+def test_pack_limit() -> None:
+    assert pack("rating", "top", 10) == "rating:top:10"
+    with pytest.raises(ValueError):
+        pack("x" * 65)
@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+from app.scheduler import pipeline as pipeline_module
+from app.scheduler.pipeline import Pipeline, Stage
+
+
+class FakeSession:
+    async def __aenter__(self) -> "FakeSession":
+        return self
+
+    async def __aexit__(self, *exc: object) -> None:
+        return None
+
+    async def commit(self) -> None:
+        return None
+
+
+class FakeJobRunRepo:
+    """job_runs в памяти: {(pipeline, run_key, stage): status}."""
+
+    runs: dict[tuple[str, str, str], str] = {}
+
+    def __init__(self, session: FakeSession) -> None:
+        pass
+
+    async def completed_stages(self, pipeline: str, run_key: str) -> set[str]:
+        return {stage for (p, key, stage), status in self.runs.items() if p == pipeline and key == run_key and status == "ok"}
+
+    async def record(self, pipeline: str, run_key: str, stage: str, status: str, *args: object) -> None:
+        self.runs[(pipeline, run_key, stage)] = status
+
+
+@pytest.fixture(autouse=True)
+def job_runs(monkeypatch: pytest.MonkeyPatch) -> dict[tuple[str, str, str], str]:
+    runs: dict[tuple[str, str, str], str] = {}
+    monkeypatch.setattr(FakeJobRunRepo, "runs", runs)
+    monkeypatch.setattr(pipeline_module, "JobRunRepo", FakeJobRunRepo)
+    return runs
+
+
+def _pipeline(stages: list[Stage]) -> Pipeline:
+    return Pipeline("daily", FakeSession, stages)
+
+
+def _recorder(events: list[str], name: str, delay: float = 0.0, fail: bool = False):
+    async def run(run_key: str) -> None:
+        events.append(f"{name}:start")
+        await asyncio.sleep(delay)
+        if fail:
+            raise RuntimeError(name)
+        events.append(f"{name}:end")
+
+    return run
+
+
+def test_toposort_orders_dependencies() -> None:
+    noop = _recorder([], "x")
+    pipeline = _pipeline(
+        [Stage("top_post", noop, after=("metrics",)), Stage("titles", noop, after=("metrics",)), Stage("metrics", noop)]
+    )
+    assert [stage.name for stage in pipeline.stages] == ["metrics", "top_post", "titles"]
+
+
+@pytest.mark.parametrize(
+    "stages",
+    [
+        [Stage("a", _recorder([], "a")), Stage("a", _recorder([], "a"))],
+        [Stage("a", _recorder([], "a"), after=("missing",))],
+        [Stage("a", _recorder([], "a"), after=("b",)), Stage("b", _recorder([], "b"), after=("a",))],
+    ],
+)
+def test_invalid_graph_rejected(stages: list[Stage]) -> None:
+    with pytest.raises(ValueError):
+        _pipeline(stages)
+
+
+def test_stage_starts_after_dependencies_and_siblings_run_in_parallel() -> None:
+    events: list[str] = []
+    pipeline = _pipeline(
+        [
+            Stage("metrics", _recorder(events, "metrics", 0.02)),
+            Stage("titles", _recorder(events, "titles", 0.02), after=("metrics",)),
+            Stage("top_post", _recorder(events, "top_post", 0.02), after=("metrics",)),
+        ]
+    )
+
+    assert asyncio.run(pipeline.run("2026-10-19"))
+    assert events.index("metrics:end") < events.index("titles:start")
+    assert events.index("metrics:end") < events.index("top_post:start")
+    # Независимые стадии стартуют до окончания друг друга
+    assert events.index("top_post:start") < events.index("titles:end")
+
+
+def test_failed_dependency_skips_dependents(job_runs: dict[tuple[str, str, str], str]) -> None:
+    events: list[str] = []
+    pipeline = _pipeline(
+        [
+            Stage("metrics", _recorder(events, "metrics", fail=True)),
+            Stage("titles", _recorder(events, "titles"), after=("metrics",)),
+            Stage("history", _recorder(events, "history")),
+        ]
+    )
+
+    assert not asyncio.run(pipeline.run("2026-10-19"))
+    assert "titles:start" not in events
+    assert job_runs == {
+        ("daily", "2026-10-19", "metrics"): "failed",
+        ("daily", "2026-10-19", "titles"): "skipped",
+        ("daily", "2026-10-19", "history"): "ok",
+    }
+
+
+def test_rerun_completes_only_missing_stages() -> None:
+    events: list[str] = []
+    fail = {"titles": True}
+
+    async def titles(run_key: str) -> None:
+        events.append("titles:start")
+        if fail["titles"]:
+            raise RuntimeError("telegram down")
+
+    pipeline = _pipeline([Stage("metrics", _recorder(events, "metrics")), Stage("titles", titles, after=("metrics",))])
+
+    assert not asyncio.run(pipeline.run("2026-10-19"))
+    fail["titles"] = False
+    events.clear()
+    assert asyncio.run(pipeline.run("2026-10-19"))
+    assert events == ["titles:start"]
+
+
+def test_concurrent_run_is_coalesced() -> None:
+    events: list[str] = []
+    pipeline = _pipeline([Stage("metrics", _recorder(events, "metrics", 0.05))])
+
+    async def scenario() -> list[bool]:
+        first = asyncio.create_task(pipeline.run("2026-10-19"))
+        await asyncio.sleep(0)
+        second = await pipeline.run("2026-10-19")
+        return [await first, second]
+
+    assert asyncio.run(scenario()) == [True, False]
+    assert events == ["metrics:start", "metrics:end"]
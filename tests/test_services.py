@@ -0,0 +1,115 @@
+import random
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from app.domain.services import (
+    NotifySchedule,
+    PricePoint,
+    SavingsIndex,
+    calculate_metrics,
+    calculate_metrics_batch,
+    due_milestone,
+)
+
+TODAY = date(2026, 10, 19)
+
+
+def test_batch_matches_scalar() -> None:
+    rng = random.Random(42)
+    quit_dates = [None if rng.random() < 0.1 else TODAY - timedelta(days=rng.randint(-30, 2000)) for _ in range(500)]
+    prices = [None if rng.random() < 0.1 else round(rng.uniform(100, 400), 2) for _ in range(500)]
+
+    batch = calculate_metrics_batch(quit_dates, prices, TODAY)
+
+    for i, (quit_date, price) in enumerate(zip(quit_dates, prices)):
+        expected = calculate_metrics(quit_date, price, TODAY)
+        assert batch.days[i] == expected.days
+        assert batch.saved_money[i] == pytest.approx(expected.saved_money)
+
+
+def test_batch_per_user_today() -> None:
+    quit_dates = [date(2026, 10, 1), date(2026, 10, 1), None]
+    batch = calculate_metrics_batch(quit_dates, [200, 200, 200], [TODAY, TODAY + timedelta(days=1), TODAY])
+    assert batch.days.tolist() == [18, 19, 0]
+    assert batch.saved_money.tolist() == [3600.0, 3800.0, 0.0]
+
+
+def test_batch_with_price_segments_matches_index() -> None:
+    quit_date = date(2026, 1, 1)
+    index = SavingsIndex(quit_date, [PricePoint(quit_date, 200, 1.0, 0.0)])
+    point = index.change_point(date(2026, 6, 1), 300, 1.5)
+    index = SavingsIndex(quit_date, [*index.points, point])
+
+    batch = calculate_metrics_batch([quit_date, quit_date], [200, 200], TODAY, [point, None])
+    assert batch.saved_money[0] == pytest.approx(index.saved_at(TODAY))
+    assert batch.saved_money[1] == pytest.approx(calculate_metrics(quit_date, 200, TODAY).saved_money)
+
+
+def test_savings_index_segments() -> None:
+    quit_date = date(2026, 1, 1)
+    points = [
+        PricePoint(quit_date, 200, 1.0, 0.0),
+        # 31 день по 200₽ до 1 февраля
+        PricePoint(date(2026, 2, 1), 300, 2.0, 6200.0),
+    ]
+    index = SavingsIndex(quit_date, list(reversed(points)))
+
+    assert index.saved_at(date(2025, 12, 31)) == 0.0
+    assert index.saved_at(quit_date) == 0.0
+    assert index.saved_at(date(2026, 1, 11)) == 2000.0
+    assert index.saved_at(date(2026, 2, 1)) == 6200.0
+    assert index.saved_at(date(2026, 2, 11)) == 6200.0 + 10 * 300 * 2.0
+
+
+def test_savings_index_change_point_replaces_same_day() -> None:
+    quit_date = date(2026, 1, 1)
+    index = SavingsIndex(quit_date, [PricePoint(quit_date, 200, 1.0, 0.0), PricePoint(date(2026, 2, 1), 999, 1.0, 1.0)])
+
+    point = index.change_point(date(2026, 2, 1), 250, 1.0)
+    assert point == PricePoint(date(2026, 2, 1), 250, 1.0, 6200.0)
+
+
+def test_savings_index_before_first_point() -> None:
+    index = SavingsIndex(date(2026, 1, 1), [PricePoint(date(2026, 3, 1), 200, 1.0, 0.0)])
+    assert index.saved_at(date(2026, 2, 1)) == 0.0
+
+
+def test_notify_schedule_spread_is_stable() -> None:
+    schedule = NotifySchedule(default_time=time(9, 0), default_tz="Europe/Moscow", spread_minutes=60)
+    assert schedule.time_for(1, None) == time(9, 1)
+    assert schedule.time_for(61, None) == time(9, 1)
+    assert schedule.time_for(59, None) == time(9, 59)
+    assert schedule.time_for(59, time(7, 30)) == time(7, 30)
+
+
+def test_notify_schedule_next_at_is_strictly_later() -> None:
+    schedule = NotifySchedule(default_time=time(9, 0), default_tz="Europe/Moscow", spread_minutes=1)
+    moscow = ZoneInfo("Europe/Moscow")
+
+    before = datetime(2026, 10, 19, 8, 0, tzinfo=moscow)
+    assert schedule.next_at(7, None, None, before) == datetime(2026, 10, 19, 9, 0, tzinfo=moscow)
+
+    exactly = datetime(2026, 10, 19, 9, 0, tzinfo=moscow)
+    assert schedule.next_at(7, None, None, exactly) == datetime(2026, 10, 20, 9, 0, tzinfo=moscow)
+
+
+def test_notify_schedule_uses_user_timezone() -> None:
+    schedule = NotifySchedule(default_time=time(9, 0), default_tz="Europe/Moscow", spread_minutes=1)
+    # 00:00 UTC — уже 10:00 во Владивостоке: 08:00 там сегодня прошло
+    after = datetime(2026, 10, 19, 0, 0, tzinfo=timezone.utc)
+
+    at = schedule.next_at(7, time(8, 0), "Asia/Vladivostok", after)
+    assert at.astimezone(ZoneInfo("Asia/Vladivostok")).replace(tzinfo=None) == datetime(2026, 10, 20, 8, 0)
+    assert at == datetime(2026, 10, 19, 22, 0, tzinfo=timezone.utc)
+
+
+def test_due_milestone_catches_up() -> None:
+    assert due_milestone(TODAY - timedelta(days=30), TODAY, 0) == 30
+    assert due_milestone(TODAY - timedelta(days=29), TODAY, 0) is None
+    # Пропущенный день: веха наступила вчера, но ещё не отмечена
+    assert due_milestone(TODAY - timedelta(days=31), TODAY, 0) == 30
+    assert due_milestone(TODAY - timedelta(days=31), TODAY, 30) is None
+    # Пропущено несколько вех — только последняя
+    assert due_milestone(TODAY - timedelta(days=400), TODAY, 0) == 365
@@ -0,0 +1,70 @@
+import base64
+
+import pytest
+
+from app.security.hmac import HmacKey
+from app.transport.signed import MAX_CALLBACK_BYTES, PREFIX, CallbackCodec
+
+
+@pytest.fixture
+def codec() -> CallbackCodec:
+    return CallbackCodec(HmacKey("test-secret"))
+
+
+def _flip(data: str, index: int) -> str:
+    encoded = data[len(PREFIX):]
+    raw = bytearray(base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)))
+    raw[index] ^= 0x01
+    return PREFIX + base64.urlsafe_b64encode(bytes(raw)).rstrip(b"=").decode("ascii")
+
+
+@pytest.mark.parametrize(
+    "data",
+    ["reset:yes", "add_relapse", "price:set:250", "price:packs:1.5", "notify:time:0730", "notify:tz:Europe/Moscow"],
+)
+def test_round_trip(codec: CallbackCodec, data: str) -> None:
+    signed = codec.sign_data(data)
+    assert signed.startswith(PREFIX)
+    assert len(signed.encode("utf-8")) <= MAX_CALLBACK_BYTES
+    assert codec.decode(signed) == data
+
+
+def test_unicode_argument_round_trip(codec: CallbackCodec) -> None:
+    assert codec.decode(codec.encode("notify:tz", "Азия/Омск")) == "notify:tz:Азия/Омск"
+
+
+def test_unsigned_actions_pass_through(codec: CallbackCodec) -> None:
+    assert codec.sign_data("rating:top:10") == "rating:top:10"
+    assert codec.split("rating:top:10") is None
+
+
+def test_split_prefers_longest_action(codec: CallbackCodec) -> None:
+    assert codec.split("notify:toggle") == ("notify:toggle", ())
+    assert codec.split("notify:time:0730") == ("notify:time", ("0730",))
+
+
+def test_tampered_mac_rejected(codec: CallbackCodec) -> None:
+    signed = codec.sign_data("price:set:250")
+    assert codec.decode(_flip(signed, -1)) is None
+
+
+def test_tampered_body_rejected(codec: CallbackCodec) -> None:
+    signed = codec.sign_data("price:set:250")
+    # Байт 0 — номер действия, дальше аргументы
+    assert codec.decode(_flip(signed, 0)) is None
+    assert codec.decode(_flip(signed, 2)) is None
+
+
+def test_other_key_rejected(codec: CallbackCodec) -> None:
+    signed = codec.sign_data("reset:yes")
+    assert CallbackCodec(HmacKey("other-secret")).decode(signed) is None
+
+
+@pytest.mark.parametrize("data", ["reset:yes", "~", "~!!!", "~AA", PREFIX + "A" * 40])
+def test_malformed_rejected(codec: CallbackCodec, data: str) -> None:
+    assert codec.decode(data) is None
+
+
+def test_too_long_rejected(codec: CallbackCodec) -> None:
+    with pytest.raises(ValueError):
+        codec.encode("notify:tz", "x" * 60)
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from app.transport.throttling import ThrottlingMiddleware, callback_family
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    return clock
+
+
+def test_burst_up_to_capacity(clock: Clock) -> None:
+    throttle = ThrottlingMiddleware({"rating": 3.0})
+    assert [throttle._take(1, "rating") for _ in range(4)] == [True, True, True, False]
+
+
+def test_refill_at_rate(clock: Clock) -> None:
+    throttle = ThrottlingMiddleware({"rating": 2.0})
+    assert throttle._take(1, "rating") and throttle._take(1, "rating")
+    assert not throttle._take(1, "rating")
+    clock.now += 0.25
+    assert not throttle._take(1, "rating")
+    clock.now += 0.25
+    assert throttle._take(1, "rating")
+
+
+def test_capacity_is_at_least_one(clock: Clock) -> None:
+    throttle = ThrottlingMiddleware({"reset": 0.2})
+    assert throttle._take(1, "reset")
+    assert not throttle._take(1, "reset")
+    clock.now += 4.9
+    assert not throttle._take(1, "reset")
+    clock.now += 0.2
+    assert throttle._take(1, "reset")
+    # Долгий простой не накапливает больше одного токена
+    clock.now += 3600
+    assert throttle._take(1, "reset")
+    assert not throttle._take(1, "reset")
+
+
+def test_buckets_are_per_user_and_family(clock: Clock) -> None:
+    throttle = ThrottlingMiddleware({"default": 1.0})
+    assert throttle._take(1, "stats")
+    assert not throttle._take(1, "stats")
+    assert throttle._take(2, "stats")
+    assert throttle._take(1, "rating")
+
+
+def test_unknown_family_uses_default(clock: Clock) -> None:
+    throttle = ThrottlingMiddleware({})
+    assert sum(throttle._take(1, "whatever") for _ in range(10)) == 3
+
+
+def test_callback_family() -> None:
+    assert callback_family("rating:top:10") == "rating"
+    assert callback_family("add_relapse") == "add_relapse"